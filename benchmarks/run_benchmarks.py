@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Benchmark con2jb on a synthetic export (see synthetic_export.py).
+
+Every stage of the conversion is timed, for a conversion into an empty target (cold) and for a second conversion
+into the same target with nothing changed (incremental). The best of --repeat runs is reported, along with the
+throughput in pages/s and MB/s (of source export). Results are appended to a JSON lines file, and compared to the
+previous result with the same parameters, so regressions between versions are visible.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.synthetic_export import generate_export  # noqa: E402
+from migcon.con2jb import convert  # noqa: E402
+from migcon.drawio_handler import configure_cache  # noqa: E402
+
+DEFAULT_RESULTS = Path(__file__).resolve().parent / 'results.jsonl'
+
+
+class StageTimer:
+    """
+    Times the stages of a conversion, pass stage to migcon.con2jb.convert
+    """
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+
+def version() -> str:
+    """
+    The version of migcon being benchmarked: the git revision of the working tree if available
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=Path(__file__).resolve().parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def export_size(source: Path) -> int:
+    return sum(file.stat().st_size for file in source.rglob('*') if file.is_file())
+
+
+def run(source: Path, target: Path, jobs: int, link_mode: str, cold: bool) -> Dict[str, float]:
+    """
+    Convert the export once
+    :param cold: convert into an empty target (with an empty drawio cache), otherwise into the target of a
+    previous run
+    :return: seconds spent in each stage, and in total
+    """
+    if cold:
+        shutil.rmtree(target, ignore_errors=True)
+        configure_cache()
+    target.mkdir(parents=True, exist_ok=True)
+    timer = StageTimer()
+    start = time.perf_counter()
+    convert(source, target, jobs, link_mode, stage=timer.stage)
+    timer.times['total'] = time.perf_counter() - start
+    return timer.times
+
+
+def best_of(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    return {stage: min(times[stage] for times in runs) for stage in runs[0]}
+
+
+def previous_result(results: Path, parameters: Dict, scenario: str) -> Optional[Dict]:
+    previous = None
+    if results.is_file():
+        with results.open() as input_file:
+            for line in input_file:
+                result = json.loads(line)
+                if result['parameters'] == parameters and result['scenario'] == scenario:
+                    previous = result
+    return previous
+
+
+def report(scenario: str, result: Dict, previous: Optional[Dict]) -> None:
+    print(f"{scenario}: {result['seconds']['total']:.3f}s, {result['pages_per_second']:.1f} pages/s, "
+          f"{result['mb_per_second']:.2f} MB/s")
+    if previous:
+        print(f"  compared to {previous['version']} ({previous['timestamp']})")
+    for stage, seconds in result['seconds'].items():
+        line = f"  {stage:<16} {seconds:9.3f}s"
+        if previous and previous['seconds'].get(stage):
+            line += f" {(seconds / previous['seconds'][stage] - 1) * 100:+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark con2jb on a synthetic Confluence export")
+    parser.add_argument("-n", "--pages", type=int, default=1000, help="Number of pages (default: 1000)")
+    parser.add_argument("-d", "--depth", type=int, default=6, help="Maximum depth of the hierarchy (default: 6)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the export (default: 1)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Worker processes for con2jb (default: 1)")
+    parser.add_argument("--link-mode", default="copy", help="con2jb link mode (default: copy)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per scenario, the best is kept "
+                                                                     "(default: 3)")
+    parser.add_argument("--results", default=str(DEFAULT_RESULTS),
+                        help=f"JSON lines file the results are appended to (default: {DEFAULT_RESULTS}, which git "
+                             "ignores)")
+    parser.add_argument("--work-dir", help="Directory for the export and the target (default: a temporary "
+                                           "directory, removed afterwards)")
+    args = parser.parse_args()
+
+    parameters = {'pages': args.pages, 'depth': args.depth, 'seed': args.seed, 'jobs': args.jobs,
+                  'link_mode': args.link_mode}
+    results = Path(args.results).expanduser()
+    work_dir = Path(args.work_dir).expanduser() if args.work_dir else Path(tempfile.mkdtemp(prefix='migcon-bench-'))
+    try:
+        source = work_dir / f'export-{args.pages}-{args.depth}-{args.seed}'
+        if not (source / 'index.md').is_file():
+            print(f"Generating an export of {args.pages} pages in {source}")
+            generate_export(source, args.pages, args.depth, args.seed)
+        size = export_size(source)
+        target = work_dir / 'target'
+
+        cold = []
+        incremental = []
+        for _ in range(args.repeat):
+            cold.append(run(source, target, args.jobs, args.link_mode, True))
+            incremental.append(run(source, target, args.jobs, args.link_mode, False))
+
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        for scenario, runs in (('cold', cold), ('incremental', incremental)):
+            seconds = best_of(runs)
+            result = {
+                'timestamp': timestamp,
+                'version': version(),
+                'python': platform.python_version(),
+                'cpus': os.cpu_count(),
+                'parameters': parameters,
+                'scenario': scenario,
+                'export_bytes': size,
+                'seconds': seconds,
+                'pages_per_second': args.pages / seconds['total'],
+                'mb_per_second': size / seconds['total'] / 1e6,
+            }
+            report(scenario, result, previous_result(results, parameters, scenario))
+            with results.open(mode='a') as output_file:
+                output_file.write(json.dumps(result) + '\n')
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
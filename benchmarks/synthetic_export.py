@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic Confluence export (as converted to markdown) to benchmark con2jb with.
+
+The export has an index.md with a hierarchy of pages, and pages with the content con2jb has to deal with: links
+to other pages (with and without anchors), expanders, tables, wrapped content, embedded drawio diagrams (png data
+that matches an attachment as well as png data that doesn't) and an Attachments section with several versions of
+images, drawio mxfiles and other files.
+"""
+import argparse
+import base64
+import random
+import zlib
+
+from pathlib import Path
+from urllib.parse import quote
+
+ICONS = ('bullet_blue.gif', 'grey_arrow_down.png')
+
+
+def page_name(index: int) -> str:
+    return f'Page-{index}_{1000 + index}'
+
+
+def generate_hierarchy(pages: int, depth: int, rng: random.Random) -> list:
+    """
+    :param pages: number of pages
+    :param depth: maximum depth of the hierarchy (the root page is at depth 0)
+    :param rng: random number generator
+    :return: the parent index of each page (-1 for the root), pages are numbered in preorder
+    """
+    parents = [-1]
+    path = [0]
+    for index in range(1, pages):
+        # the parent is a page on the path from the root to the previous page, deeper pages are more likely
+        limit = min(len(path), depth)
+        level = min(int(rng.triangular(0, limit, limit)), limit - 1)
+        del path[level + 1:]
+        parents.append(path[level])
+        path.append(index)
+    return parents
+
+
+def write_index(source: Path, parents: list) -> None:
+    lines = ['# Space', '', 'Available Pages:', '']
+    depths = []
+    for index, parent in enumerate(parents):
+        depths.append(depths[parent] + 1 if parent >= 0 else 0)
+        lines += [f'{"    " * depths[index]}-   [Page {index}]({page_name(index)})', '']
+    (source / 'index.md').write_text('\n'.join(lines))
+
+
+def deflate(xml: str) -> str:
+    compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return base64.b64encode(compress.compress(quote(xml).encode('utf-8')) + compress.flush()).decode('ascii')
+
+
+def diagram_xml(index: int, cells: int) -> str:
+    cells = ''.join(f'<mxCell id="c{i}" value="cell {i} of page {index}" style="rounded=1;" vertex="1" parent="1">'
+                    f'<mxGeometry x="{i * 10}" y="{i * 20}" width="120" height="60" as="geometry"/></mxCell>'
+                    for i in range(cells))
+    return f'<mxGraphModel><root><mxCell id="0"/><mxCell id="1" parent="0"/>{cells}</root></mxGraphModel>'
+
+
+def png_data(rng: random.Random, size: int) -> bytes:
+    return b'\x89PNG\r\n\x1a\n' + rng.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def write_page(source: Path, index: int, pages: int, rng: random.Random, links: int, versions: int,
+               image_size: int, diagram_cells: int) -> None:
+    page_id = 5000 + index
+    attachment_dir = source / 'attachments' / str(page_id)
+    attachment_dir.mkdir(parents=True, exist_ok=True)
+    body = [f'# Page {index}', '']
+
+    # link heavy text, with links to other pages (some with anchors or queries) and to external sites
+    for paragraph in range(max(1, links // 10)):
+        words = []
+        for _ in range(10):
+            other = page_name(rng.randrange(pages))
+            words.append(rng.choice([f'[see {other}]({other})', f'[section]({other}.md#section-{paragraph})',
+                                     f'[query]({other}?version=2)', f'[site](https://example.com/{paragraph})',
+                                     'plain words in between the links']))
+        body += [' '.join(words), '']
+
+    body += ['<div class="content-wrapper">', '', 'Wrapped content of the page.', '', '</div>', '']
+    rows = ''.join(f'<tr><td>row {row}</td><td>value <a href="https://example.com/{row}">link</a></td></tr>'
+                   for row in range(rng.randint(2, 8)))
+    body += ['<div class="table-wrap">', '',
+             f'<table><tbody><tr><th>Name</th><th>Value</th></tr>{rows}</tbody></table>', '', '</div>', '']
+    body += ['<div id="expander-1" class="expand-container">', '',
+             '<div id="expander-control-1" class="expand-control">', '',
+             '<img src="images/icons/grey_arrow_down.png" class="expand-control-image" />Details', '', '</div>', '',
+             '<div id="expander-content-1" class="expand-content">', '', 'Expanded content.', '', '</div>', '',
+             '</div>', '']
+
+    # attachments: several versions of an image, a drawio mxfile with its png rendering, and a document
+    attachments = []
+    image = png_data(rng, image_size)
+    for version in range(versions):
+        file = f'{page_id}{version:02d}.png'
+        (attachment_dir / file).write_bytes(image if version == 0 else png_data(rng, image_size))
+        attachments.append(('diagram.png' if version == 0 else 'picture.png', file, 'image/png'))
+    file = f'{page_id}90'
+    (attachment_dir / file).write_text(f'<mxfile><diagram id="d{index}" name="Page-1">'
+                                       f'{deflate(diagram_xml(index, diagram_cells))}</diagram></mxfile>')
+    attachments.append((f'architecture {index}', file, 'application/vnd.jgraph.mxfile'))
+    file = f'{page_id}91.txt'
+    (attachment_dir / file).write_text(f'notes of page {index}\n')
+    attachments.append(('meeting notes.txt', file, 'text/plain'))
+
+    body += [f'<img src="attachments/{page_id}/{page_id}01.png" />', ''] if versions > 1 else []
+    # an embedded drawio diagram that matches an attachment, and one that doesn't
+    body += [f'<img src="data:image/png;base64,{base64.b64encode(image).decode("ascii")}" '
+             'class="drawio-diagram-image" />', '']
+    if index % 4 == 0:
+        body += [f'<img src="data:image/png;base64,{base64.b64encode(png_data(rng, image_size)).decode("ascii")}" '
+                 'class="drawio-diagram-image" />', '']
+
+    body += ['<div class="pageSectionHeader">', '', '## Attachments:', '', '</div>', '',
+             '<div class="greybox" align="left">', '']
+    for name, file, kind in attachments:
+        body += ['<img src="images/icons/bullet_blue.gif" width="8" height="8" />',
+                 f'[{name}](attachments/{page_id}/{file})', f'({kind})  ']
+    body += ['', '</div>', '', '## Change History', '', 'Page created.', '']
+    (source / f'{page_name(index)}.md').write_text('\n'.join(body))
+
+
+def generate_export(source: Path, pages: int = 1000, depth: int = 6, seed: int = 1, links: int = 40,
+                    versions: int = 3, image_size: int = 2048, diagram_cells: int = 50) -> None:
+    """
+    Generate a synthetic export
+    :param source: directory to generate the export in
+    :param pages: number of pages
+    :param depth: maximum depth of the page hierarchy
+    :param seed: seed of the random number generator, the same parameters and seed generate the same export
+    :param links: (approximate) number of links in each page
+    :param versions: number of versions of the image attached to each page
+    :param image_size: size of the attached images, in bytes
+    :param diagram_cells: number of cells in the drawio diagram of each page
+    """
+    rng = random.Random(seed)
+    source.mkdir(parents=True, exist_ok=True)
+    (source / 'images' / 'icons').mkdir(parents=True, exist_ok=True)
+    for icon in ICONS:
+        (source / 'images' / 'icons' / icon).write_bytes(b'icon')
+    write_index(source, generate_hierarchy(pages, depth, rng))
+    for index in range(pages):
+        write_page(source, index, pages, rng, links, versions, image_size, diagram_cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Confluence export")
+    parser.add_argument("output", help="Directory to generate the export in")
+    parser.add_argument("-n", "--pages", type=int, default=1000, help="Number of pages (default: 1000)")
+    parser.add_argument("-d", "--depth", type=int, default=6, help="Maximum depth of the hierarchy (default: 6)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--links", type=int, default=40, help="Links per page (default: 40)")
+    parser.add_argument("--versions", type=int, default=3, help="Versions of each attached image (default: 3)")
+    parser.add_argument("--image-size", type=int, default=2048, help="Size of attached images (default: 2048)")
+    parser.add_argument("--diagram-cells", type=int, default=50, help="Cells per drawio diagram (default: 50)")
+    args = parser.parse_args()
+    generate_export(Path(args.output).expanduser(), args.pages, args.depth, args.seed, args.links, args.versions,
+                    args.image_size, args.diagram_cells)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
+import re
+
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from markdown_it.token import Token
 
@@ -87,3 +89,96 @@ def process_tokens(tokens: List[Token], page_name: str) -> AttachmentInfo:
                             attachments[att_name] = Attachment(att_name, {att_type: [att_url]})
                         att_type = att_name = att_url = None
     return AttachmentInfo(page_id, page_name, attachments)
+
+
+# the "Attachments:" section of a Confluence export, as found by get_attachment_info
+SECTION_HEADER = b'<div class="pageSectionHeader">\n\n## Attachments:'
+BULLETS = (b'<img src="/images/icons/bullet_blue.gif" width="8" height="8" />',
+           b'<img src="images/icons/bullet_blue.gif" width="8" height="8" />')
+
+# an attachment: [name](url) (type), the name can span lines. Anything that markdown would treat as more than
+# plain text (escapes, emphasis, entities, html, code, ...) is excluded, such sections are left to the parser
+_ENTRY = re.compile(rb'[ \n]*\[([^\[\]\\`*&<>!\n\r\t]+(?:\n[^\[\]\\`*&<>!\n\r\t]+)*)\]'
+                    rb'\(([A-Za-z0-9._~/-]+)\)[ \n]*(\([^()\s\\`*_&<>\[\]!]+\)) *(?:\n|$)')
+_BLANK = re.compile(rb' *$')
+_HEADING = re.compile(rb' {0,3}#{1,6}(?: |$)')
+_DIV = re.compile(rb' {0,3}</?div(?:[ >]|/>|$)', re.IGNORECASE)
+# lines that start a block other than a paragraph (or turn the paragraph into a heading)
+_OTHER_BLOCK = re.compile(rb' {0,3}(?:[-+*>#=_`~<|]|\d{1,9}[.)](?: |$))')
+_INDENTED_CODE = re.compile(rb' {4}')
+# underscores that could open or close emphasis
+_EMPHASIS = re.compile(rb'(?<![0-9A-Za-z])_|_(?![0-9A-Za-z])')
+
+
+def scan_attachment_section(data: bytes, page_name: str) -> Optional[AttachmentInfo]:
+    """
+    Extract the attachment information from the "Attachments:" section without a markdown parser. Confluence
+    generates these sections in a very regular form, anything else is declined (and should be parsed with
+    process_tokens, which this is equivalent to).
+    :param data: the content of the page from the section header on
+    :param page_name: the page name
+    :return: the attachment information, None if the section isn't in the regular form
+    """
+    if not data.startswith(SECTION_HEADER) or b'\r' in data or b'\t' in data or b'\0' in data:
+        return None
+    for bullet in BULLETS:
+        data = data.replace(bullet, b'')
+    lines = data[len(SECTION_HEADER):].split(b'\n')
+    if not _BLANK.match(lines[0]):
+        return None
+    paragraphs = []
+    paragraph = []
+    in_div = False
+    for line in lines[1:]:
+        if not in_div and (line[:1] in (b'[', b'(') or (paragraph and line[:1].isalpha())):
+            # (the start of) an attachment, or the continuation of one
+            paragraph.append(line)
+        elif _BLANK.match(line):
+            in_div = False
+            if paragraph:
+                paragraphs.append(paragraph)
+                paragraph = []
+        elif in_div:
+            # html blocks extend to the next blank line
+            return None
+        elif _HEADING.match(line):
+            break
+        elif _DIV.match(line):
+            in_div = True
+            if paragraph:
+                paragraphs.append(paragraph)
+                paragraph = []
+        elif _OTHER_BLOCK.match(line) or (not paragraph and _INDENTED_CODE.match(line)):
+            return None
+        else:
+            paragraph.append(line)
+    if paragraph:
+        paragraphs.append(paragraph)
+
+    attachments = {}
+    page_id = 'unset'
+    for paragraph in paragraphs:
+        text = b'\n'.join(paragraph)
+        position = 0
+        while position < len(text):
+            match = _ENTRY.match(text, position)
+            if not match:
+                return None
+            position = match.end()
+            name_lines = match.group(1).split(b'\n')
+            if any(line.endswith(b'  ') for line in name_lines[:-1]) or _EMPHASIS.search(match.group(1)):
+                return None
+            parts = [line.decode('utf-8').strip() for line in name_lines]
+            if not parts[0]:
+                return None
+            att_name = ' '.join(part for part in parts if part)
+            att_url = match.group(2).decode('utf-8')
+            att_type = match.group(3).decode('utf-8')
+            att_name = att_name.replace(' ', '_')
+            if att_name in attachments:
+                attachments[att_name].files.setdefault(att_type, []).append(att_url)
+            else:
+                attachments[att_name] = Attachment(att_name, {att_type: [att_url]})
+    if attachments:
+        page_id = Path(att_url).parent.name
+    return AttachmentInfo(page_id, page_name, attachments)
@@ -1,22 +1,91 @@
 import argparse
+import io
+import sys
 
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path
-from migcon.content_manager import copy_into_dir_tree, rewrite_links, process_attachments, remove_trailing_sections, \
-    fixup_attachment_references, fixup_div_tags, convert_remaining_html
+from migcon import output_sink, profiler
+from migcon.content_manager import DEFAULT_IO_WORKERS, LinkRewriter, copy_into_dir_tree, process_attachments, \
+    page_fixups, run_page_pipeline
 from migcon.content_tree import build_content_tree, generate_replacement_dictionary
+from migcon.drawio_handler import configure_cache
+from migcon.export_source import open_export
+from migcon.manifest import Manifest
+from migcon.materialize import LINK_MODES
+from migcon.plan import PlanSink, migration_plan, save_plan
 from migcon.toc_generator import JupyterBookTOCGenerator
+from typing import Callable, ContextManager, Optional, Set
 
 def main():
     # create an argument parser that accepts to arguments an input directory and an output directory
     parser = argparse.ArgumentParser(description="Convert a Confluence export to Jupyter Book")
-    parser.add_argument("input", help="Source Directory (created by Confluence to Markdown)")
-    parser.add_argument("output", help="Target directory (will hold migrated Jupyter Book source)")
+    parser.add_argument("input", help="Source Directory (created by Confluence to Markdown), or a zip archive of it")
+    parser.add_argument("output", help="Target directory (will hold migrated Jupyter Book source), or an archive "
+                                       "(.zip, .tar, .tar.gz, .tar.xz, .tar.bz2, .tar.zst) to write it to")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to fixup pages (default: 1)")
+    parser.add_argument("--io-workers", type=int, default=DEFAULT_IO_WORKERS,
+                        help=f"Number of concurrent file operations used to copy attachments "
+                             f"(default: {DEFAULT_IO_WORKERS})")
+    parser.add_argument("--link-mode", choices=LINK_MODES, default="copy",
+                        help="How pages and attachments are materialized in the target (default: copy)")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-process every page, even if the manifest in the target shows it is unchanged")
+    parser.add_argument("--cache-dir",
+                        help="Directory to persist decoded drawio diagrams in, so later runs can re-use them")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="Write a report of the time, memory, i/o and slowest pages of each stage to REPORT (json)")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="With --profile, also run each stage under cProfile (written next to the report)")
+    parser.add_argument("--plan", metavar="PLAN",
+                        help="Write nothing to the target, write the plan of the conversion (every file it would "
+                             "write and remove, attachments, link rewrites and warnings) to PLAN (json) instead")
     args = parser.parse_args()
 
     source = Path(args.input).expanduser()
     target = Path(args.output).expanduser()
-    target.mkdir(parents=True, exist_ok=True)
+    plan = Path(args.plan).expanduser() if args.plan else None
+    if not output_sink.archive_suffix(target) and not plan:
+        target.mkdir(parents=True, exist_ok=True)
+    if args.cache_dir:
+        configure_cache(Path(args.cache_dir).expanduser())
 
+    if args.profile:
+        report = Path(args.profile).expanduser()
+        stage_profiler = profiler.Profiler(report.with_suffix('') if args.cprofile else None)
+        profiler.activate(stage_profiler)
+        try:
+            convert(source, target, args.jobs, args.link_mode, args.force, stage_profiler.stage, args.io_workers,
+                    plan)
+        finally:
+            profiler.activate(None)
+        stage_profiler.save(report)
+    else:
+        convert(source, target, args.jobs, args.link_mode, args.force, io_workers=args.io_workers, plan=plan)
+
+
+def _no_stage(name: str):
+    return nullcontext()
+
+
+def convert(source: Path, target: Path, jobs: int = 1, link_mode: str = 'copy', force: bool = False,
+            stage: Callable[[str], ContextManager] = _no_stage, io_workers: int = DEFAULT_IO_WORKERS,
+            plan: Optional[Path] = None) -> Set[Path]:
+    """
+    Convert a Confluence export (markdown) to a Jupyter Book
+    :param source: source directory, or a zip archive of it (read without extracting it)
+    :param target: target directory, or an archive to write the book to (see output_sink.ARCHIVE_SUFFIXES)
+    :param jobs: number of worker processes used to fixup pages
+    :param link_mode: how pages and attachments are materialized in the target, see materialize.LINK_MODES
+    :param force: re-process every page, even if the manifest in the target shows it is unchanged
+    :param stage: called with the name of each stage of the conversion, the stage runs in the context it returns
+    (e.g. to time the stages)
+    :param io_workers: number of concurrent file operations used to copy attachments
+    :param plan: if given, nothing is written (or removed) in the target. Instead, the plan of the conversion is
+    written to this file (json): every file it would write and remove, the attachments, link rewrites and warnings
+    :return: the target files of the pages that were (re-)processed (for an archive, under the directory named
+    after the archive)
+    """
     # The following needs to take place:
     # 1. Build a content tree from the index.md in the source directory
     # 2. Build a link replacement dictionary from the content tree
@@ -29,17 +98,61 @@ def main():
     # 8. Fixup references to attachments (meaningful names, markdown imagee syntax, drawio directives, etc.)
     # 9. Fixup superfluous <div> tags in the markdown files
     # 10. Convert tables and images to markdown
+    #
+    # Steps 6 through 10 are applied as a single pass over the pages, each page is read once, run through all
+    # the fixups (in order) and written once.
+    #
+    # A manifest in the target records the inputs and outputs of each page, steps 4 through 10 are only applied
+    # to pages whose inputs changed since the last run into the same target.
+    #
+    # An archive target is written in a single pass instead (see output_sink.ArchiveSink): step 4 is skipped, the
+    # fixups read the pages from the source and every file goes straight into the archive. There is no manifest,
+    # the archive is written in full every time.
+    #
+    # A plan runs the same steps, reading the source and hashing, with every write recorded rather than made (see
+    # plan.PlanSink).
 
-    tree = build_content_tree(source, target)                           # 1.
-    replacements = generate_replacement_dictionary(tree)                # 2.
-    JupyterBookTOCGenerator().generate(tree)                            # 3.
-    copy_into_dir_tree(source, tree)                                    # 4.
-    attachment_info = process_attachments(source, tree)                 # 5.
-    rewrite_links(tree, replacements)                                   # 6.
-    remove_trailing_sections(tree)                                      # 7.
-    fixup_attachment_references(tree, attachment_info, source, target)  # 8.
-    fixup_div_tags(tree)                                                # 9.
-    convert_remaining_html(tree)                                        # 10.
+    source = open_export(source)
+    archive = output_sink.archive_suffix(target) is not None
+    if plan is not None:
+        sink = PlanSink(output_sink.archive_root(target) if archive else target)
+    else:
+        sink = output_sink.ArchiveSink(target) if archive else None
+    output = io.StringIO()
+    with sink or nullcontext(), redirect_stdout(output) if plan is not None else nullcontext():
+        if sink:
+            target = sink.root
+        with stage('content tree'):
+            tree = build_content_tree(source, target)                           # 1.
+        with stage('link dictionary'):
+            replacements = generate_replacement_dictionary(tree)                # 2.
+        with stage('toc'):
+            JupyterBookTOCGenerator().generate(tree)                            # 3.
+        pages = None
+        if not archive:
+            with stage('manifest'):
+                manifest = Manifest.load(target)
+                # a plan into a target without a manifest has every page to process, and no need for fingerprints
+                if sink is None or manifest.pages:
+                    pages = manifest.changed_pages(source, tree, replacements, link_mode, force, sink is None)
+        if sink is None:
+            with stage('copy pages'):
+                copy_into_dir_tree(source, tree, link_mode, pages)              # 4.
+        with stage('attachments'):
+            attachment_info = process_attachments(source, tree, link_mode, pages, io_workers)  # 5.
+        with stage('page fixups'):
+            fixups = page_fixups(replacements, attachment_info, source, target, link_mode)
+            run_page_pipeline(tree, fixups, jobs, pages, source if sink else None)  # 6. - 10.
+        if sink is None:
+            with stage('record manifest'):
+                manifest.record(attachment_info, pages)
+                manifest.save()
+    if plan is not None:
+        sys.stdout.write(output.getvalue())
+        links_rewritten = next(fixup for fixup in fixups if isinstance(fixup, LinkRewriter)).page_stats
+        save_plan(migration_plan(source, tree, replacements, attachment_info, links_rewritten, pages, sink,
+                                 [] if archive else manifest.stale_outputs, output.getvalue().splitlines()), plan)
+    return pages if pages is not None else set(tree.dest_files())
 
 
 if __name__ == "__main__":
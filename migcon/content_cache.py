@@ -0,0 +1,116 @@
+import os
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+# default bound of the (in memory) size of a cache, in characters
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+class ContentCache:
+    """
+    A content addressed cache of text, e.g. decoded drawio diagrams keyed by a digest of the encoded diagram.
+    Entries are kept in memory, least recently used first out once the total size exceeds max_size. If a
+    directory is given, entries are also persisted there (one file per entry) so later runs can re-use them. The
+    directory is bounded by max_size (in bytes) as well, the entries least recently used (by this or earlier runs)
+    are removed first. Processes sharing the directory each keep it within the bound as they see it.
+    """
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, directory: Optional[Path] = None):
+        self.max_size = max_size
+        self.directory = directory
+        self.size = 0
+        self.entries: 'OrderedDict[str, str]' = OrderedDict()
+        # the cache is shared by the threads that copy attachments
+        self.lock = threading.Lock()
+        # the sizes of the persisted entries, least recently used first
+        self.files: 'OrderedDict[str, int]' = OrderedDict()
+        self.files_size = 0
+        if directory:
+            directory.mkdir(parents=True, exist_ok=True)
+            entries = []
+            for file in directory.iterdir():
+                if not file.name.startswith('.'):
+                    try:
+                        stat = file.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, file.name, stat.st_size))
+            for _, key, size in sorted(entries):
+                self.files[key] = size
+                self.files_size += size
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        :param key: the (digest based) key of the entry
+        :return: the cached text, None if it isn't cached
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                if key in self.files:
+                    self.files.move_to_end(key)
+                return value
+        if self.directory:
+            try:
+                with (self.directory / key).open(mode='r', encoding='utf-8', newline='') as input_file:
+                    value = input_file.read()
+            except OSError:
+                return None
+            self._remember(key, value)
+            with self.lock:
+                if key in self.files:
+                    self.files.move_to_end(key)
+            try:
+                # the entry was used, it is kept over those that weren't (in later runs too)
+                os.utime(self.directory / key)
+            except OSError:
+                pass
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        """
+        :param key: the (digest based) key of the entry
+        :param value: the text to cache
+        """
+        self._remember(key, value)
+        if self.directory and len(value) <= self.max_size:
+            # write under a temporary name and move it into place, so a reader never sees a partial entry
+            temp_file = self.directory / f'.{key}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with temp_file.open(mode='w', encoding='utf-8', newline='') as output_file:
+                output_file.write(value)
+            os.replace(temp_file, self.directory / key)
+            self._prune(key, len(value.encode('utf-8')))
+
+    def _prune(self, key: str, size: int) -> None:
+        """
+        An entry was persisted, remove the least recently used entries while the directory exceeds max_size
+        """
+        with self.lock:
+            self.files_size += size - self.files.pop(key, 0)
+            self.files[key] = size
+            evicted = []
+            while self.files_size > self.max_size and len(self.files) > 1:
+                old_key, old_size = self.files.popitem(last=False)
+                self.files_size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                (self.directory / old_key).unlink()
+            except OSError:
+                # (removed by another process already)
+                pass
+
+    def _remember(self, key: str, value: str) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            if len(value) > self.max_size:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
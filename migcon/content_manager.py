@@ -1,20 +1,41 @@
+import io
 import mmap
-import os
 import re
-import shutil
+import sys
 
-from anytree import Node, PreOrderIter
+from anytree import Node
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
 from markdownify import markdownify as md
-from migcon.attachment_info import AttachmentInfo, Attachment, process_tokens
-from migcon.drawio_handler import copy_drawio_file, handle_attachment
+from migcon.attachment_info import AttachmentInfo, Attachment, SECTION_HEADER, process_tokens, \
+    scan_attachment_section
+from migcon.content_tree import Tree, as_content_tree
+from migcon.div_unwrapper import EXPANDER_KINDS, MULTI_COLUMN_KINDS, TOC_MACRO_KINDS, unwrap_divs
+from migcon.drawio_handler import cache_settings, configure_cache, copy_drawio_file, drawio_target, handle_attachment, \
+    png_digest_index
+from migcon.export_source import ZipPath
 from migcon.file_dups import find_duplicates
+from migcon.html_converter import fast_markdownify
+from migcon import output_sink, profiler
+from migcon.materialize import break_link, materialize
 from markdown_it import MarkdownIt
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 REMOVE_STRING_A = '<img src="/images/icons/bullet_blue.gif" width="8" height="8" />'
 REMOVE_STRING_B = '<img src="images/icons/bullet_blue.gif" width="8" height="8" />'
 
+# parser for the attachment sections that can't be scanned directly
+_markdown = MarkdownIt("commonmark")
+
+# an attachment file to copy: the source file, the destination and whether it is a drawio (mxfile) file
+AttachmentCopy = Tuple[Path, Path, bool]
+# default number of concurrent file system operations when copying attachments
+DEFAULT_IO_WORKERS = 8
+
+# a page transform takes the destination file of a page and its current content and returns the new content
+PageTransform = Callable[[Path, str], str]
+
 
 def get_dest_file_from_node(node: Node) -> Path:
     if node.parent:
@@ -26,71 +47,245 @@ def get_dest_file_from_node(node: Node) -> Path:
     return Path(dest_dir, filename)
 
 
-def copy_into_dir_tree(src_dir: Path, structure: Node) -> None:
+def copy_into_dir_tree(src_dir: Path, structure: Tree, link_mode: str = 'copy', pages: Optional[Set[Path]] = None)\
+        -> None:
     """
     Copies the source file into the new directory structure (provided by structure argument)
 
     :param src_dir: source directory
     :param structure: hierarchy of new directory structure
+    :param link_mode: how files are materialized in the target, see materialize.LINK_MODES
+    :param pages: if given, only these pages (target files) are copied
+    """
+    tree = as_content_tree(structure)
+    for directory in tree.directories():
+        directory.mkdir(parents=True, exist_ok=True)
+    for dest in tree.dest_files():
+        if pages is not None and dest not in pages:
+            continue
+        src = src_dir / dest.name
+        with profiler.page(dest):
+            materialize(src, dest, link_mode)
+
+
+def run_page_pipeline(structure: Tree, transforms: List[PageTransform], jobs: int = 1,
+                      pages: Optional[Set[Path]] = None, source: Optional[Path] = None) -> None:
     """
-    for node in PreOrderIter(structure):
-        if len(node.children) > 0:
-            node.filepath.mkdir(parents=True, exist_ok=True)
-        dest = get_dest_file_from_node(node)
-        src = Path(src_dir, dest.name)
-        shutil.copy(src, dest)
+    Runs each page in the content tree through the list of transforms. Every page is read once, the transforms
+    are applied (in order) to the in memory content and the page is written back once, and only if it changed.
 
+    When jobs is greater than 1, pages are spread across a pool of worker processes. Output of each page is
+    captured in the worker and printed in page order, so results and warnings are identical to a serial run.
+    Transforms that record per page statistics (in a page_stats dictionary keyed by page file) get the
+    statistics recorded by the workers merged into theirs.
 
-def rewrite_links(structure: Node, replacement_files: Dict[str, str]) -> None:
-    """
-    Rewrites Markdown links based on the new directory structure created by running the conversion
+    When an output sink is active (see output_sink), every page is written to the sink, and what the workers
+    write is collected and written to the sink of this process in page order.
     :param structure: hierarchy of new directory structure
+    :param transforms: the page transforms to apply
+    :param jobs: number of worker processes to use
+    :param pages: if given, only these pages (target files) are processed
+    :param source: if given, the pages are read from this source directory rather than from the target (the
+                   pages are not copied into an output sink before they are processed)
+    """
+    files = as_content_tree(structure).dest_files()
+    if pages is not None:
+        files = [file for file in files if file in pages]
+    if jobs > 1 and len(files) > 1:
+        chunk_size = max(1, len(files) // (jobs * 16))
+        active_profiler = profiler.active()
+        sink = output_sink.active()
+        sink_state = (sink.root, sink.written) if sink else None
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_page_worker,
+                                 initargs=(transforms, active_profiler is not None, source, sink_state,
+                                           cache_settings())) as executor:
+            for file, (output, stats, recorded, written) in zip(files, executor.map(_run_page_worker, files,
+                                                                                     chunksize=chunk_size)):
+                sys.stdout.write(output)
+                for index, value in stats:
+                    transforms[index].page_stats[file] = value
+                if recorded:
+                    active_profiler.merge(recorded)
+                if written:
+                    sink.merge(written)
+    else:
+        for file in files:
+            _run_page(file, transforms, source)
+
+
+def _run_page(file: Path, transforms: List[PageTransform], source: Optional[Path] = None) -> None:
+    """
+    Reads a single page, applies the transforms and writes the page back if it changed
+    :param file: the page to process
+    :param transforms: the page transforms to apply
+    :param source: if given, the page is read from this source directory
+    """
+    page_file = file if source is None else source / file.name
+    if not page_file.is_file():
+        return
+    with profiler.page(file):
+        with page_file.open(mode='r') as input_file:
+            data = input_file.read()
+        new = data
+        for transform in transforms:
+            new = transform(file, new)
+        if output_sink.active() is not None:
+            output_sink.write_data(file, new.encode('utf-8'))
+        elif new != data:
+            # pages may be linked to the source export, never write through to the source
+            break_link(file)
+            with file.open(mode='w') as output_file:
+                output_file.write(new)
+
+
+# transforms for the pipeline worker processes, these are shipped to each worker once by _init_page_worker
+_worker_transforms: List[PageTransform] = []
+_worker_source: Optional[Path] = None
+
+
+def _init_page_worker(transforms: List[PageTransform], profiling: bool = False, source: Optional[Path] = None,
+                      sink_state: Optional[Tuple[Path, Set[str]]] = None,
+                      drawio_cache: Optional[Tuple[Optional[Path], int]] = None) -> None:
+    """
+    :param sink_state: the root of the output sink of the main process and the files written to it so far, if
+                       there is one
+    :param drawio_cache: the settings of the drawio cache of the main process (see drawio_handler.cache_settings)
+    """
+    global _worker_transforms, _worker_source
+    _worker_transforms = transforms
+    _worker_source = source
+    profiler.activate(profiler.Profiler() if profiling else None)
+    output_sink.activate(output_sink.CollectingSink(*sink_state) if sink_state else None)
+    if drawio_cache:
+        configure_cache(*drawio_cache)
+
+
+def _run_page_worker(file: Path) -> Tuple[str, List[Tuple[int, Any]], Optional[Tuple],
+                                          Optional[List[output_sink.SinkEntry]]]:
+    """
+    Runs a page through the pipeline in a worker process
+    :return: anything printed while processing the page, the statistics the transforms recorded for it (as
+    pairs of transform index and value), what the profiler of the worker recorded (if profiling) and the files
+    written for the page (if there is an output sink)
+    """
+    with redirect_stdout(io.StringIO()) as output:
+        _run_page(file, _worker_transforms, _worker_source)
+    stats = [(index, transform.page_stats.pop(file)) for index, transform in enumerate(_worker_transforms)
+             if file in getattr(transform, 'page_stats', ())]
+    worker_profiler = profiler.active()
+    worker_sink = output_sink.active()
+    return output.getvalue(), stats, worker_profiler.drain() if worker_profiler else None, \
+        worker_sink.drain() if worker_sink else None
+
+
+def page_fixups(replacement_files: Dict[str, str], attachments: Dict[Path, AttachmentInfo], source_root_dir: Path,
+                target_root_dir: Path, link_mode: str = 'copy') -> List[PageTransform]:
+    """
+    The page transforms that con2jb applies to every page, in the order in which they must run
     :param replacement_files: a dictionary of file name (flat) to file name (relative to new root)
+    :param attachments: information about all the source attachments, key: target file, value: AttachmentInfo
+    :param source_root_dir: the root of the source directory tree
+    :param target_root_dir: the root directory of the target directory tree
+    :param link_mode: how images are materialized in the target, see materialize.LINK_MODES
+    :return: list of page transforms
     """
-    for node in PreOrderIter(structure):
-        target_file = get_dest_file_from_node(node)
-        if target_file.is_file():
-            _rewrite_links(target_file, replacement_files)
+    return [
+        LinkRewriter(replacement_files),
+        remove_trailing_section,
+        AttachmentReferenceFixup(attachments, source_root_dir, target_root_dir, link_mode),
+        fixup_divs,
+        convert_html,
+    ]
 
 
-def _rewrite_links(file: Path, replacement_files: Dict[str, str]) -> None:
+def rewrite_links(structure: Tree, replacement_files: Dict[str, str]) -> None:
     """
     Rewrites Markdown links based on the new directory structure created by running the conversion
-    :param file: source markdown file
+    :param structure: hierarchy of new directory structure
     :param replacement_files: a dictionary of file name (flat) to file name (relative to new root)
     """
-    class Fixup:
-        def __init__(self):
-            self.changed = False
+    run_page_pipeline(structure, [LinkRewriter(replacement_files)])
 
-        def fixup(self, match) -> str:
-            link_target = match.group(1)
-            if link_target in replacement_files:
-                self.changed = True
-                return f'](/{replacement_files[link_target]})'
-            return f']({link_target})'
 
-    with open(file, mode='r+') as input_file:
-        data = input_file.read()
+# a markdown link target: ](destination "optional title"). The destination can't contain white space or
+# parentheses, and the whole target must be on one line
+_LINK_TARGET = re.compile(r"""\]\(([^\s()]*)((?:[ \t]+(?:"[^"\n]*"|'[^'\n]*'))?[ \t]*\))""")
+# the query and/or fragment of a link destination
+_LINK_SUFFIX = re.compile(r'[?#]')
 
-    fixup = Fixup()
-    flags = re.IGNORECASE | re.DOTALL | re.MULTILINE
-    new = re.sub(']\((.*?)\)', fixup.fixup, data, 0, flags)
 
-    if fixup.changed:
-        with open(file, mode='w') as output_file:
-            output_file.write(new)
+def split_link(destination: str) -> Tuple[str, str]:
+    """
+    Split a link destination into its path and its query and/or fragment
+    :param destination: link destination, e.g. Page_123.md#section
+    :return: path and suffix (with the leading ? or #), e.g. ('Page_123.md', '#section')
+    """
+    match = _LINK_SUFFIX.search(destination)
+    if match:
+        return destination[:match.start()], destination[match.start():]
+    return destination, ''
+
 
+def link_paths(content: str) -> Set[str]:
+    """
+    The paths of the destinations of the markdown links in a page (without queries and fragments)
+    """
+    return {split_link(match.group(1))[0] for match in _LINK_TARGET.finditer(content)}
 
-def get_attached_files(structure: Node) -> Dict[Path, AttachmentInfo]:
+
+class LinkRewriter:
+    """
+    Page transform that rewrites Markdown links based on the new directory structure. Links to pages (by name,
+    with or without the .md suffix) are rewritten to the location of the page in the new structure, queries and
+    fragments are kept. The number of links rewritten is recorded for every page in page_stats.
+    """
+    def __init__(self, replacement_files: Dict[str, str]):
+        self.replacement_files = replacement_files
+        self.page_stats: Dict[Path, int] = {}
+
+    def resolve(self, path: str) -> Optional[str]:
+        """
+        :param path: the path of a link destination
+        :return: the path of the destination in the new structure, None if it isn't a page
+        """
+        afile = self.replacement_files.get(path)
+        if afile is not None:
+            return f'/{afile}'
+        if path.endswith('.md'):
+            afile = self.replacement_files.get(path[:-len('.md')])
+            if afile is not None:
+                return f'/{afile}.md'
+        return None
+
+    def __call__(self, file: Path, content: str) -> str:
+        rewritten = 0
+
+        def fixup(match) -> str:
+            nonlocal rewritten
+            path, suffix = split_link(match.group(1))
+            resolved = self.resolve(path)
+            if resolved is None:
+                return match.group(0)
+            rewritten += 1
+            return f']({resolved}{suffix}{match.group(2)}'
+
+        content = _LINK_TARGET.sub(fixup, content)
+        self.page_stats[file] = rewritten
+        profiler.count('substitutions', rewritten)
+        return content
+
+
+def get_attached_files(structure: Tree, pages: Optional[Set[Path]] = None) -> Dict[Path, AttachmentInfo]:
     """
     Returns a dictionary of target file paths to attachment information
     :param structure: root of the content tree
+    :param pages: if given, only these pages (target files) are considered
     :return: mapping of target file to attachment information for that file
     """
     attached_files = {}
-    for node in PreOrderIter(structure):
-        file = get_dest_file_from_node(node)
+    for file in as_content_tree(structure).dest_files():
+        if pages is not None and file not in pages:
+            continue
         if file.is_file():
             page_name = file.stem
             attachment_info = get_attachment_info(file, page_name)
@@ -109,25 +304,41 @@ def get_attachment_info(file: Path, page_name: str) -> AttachmentInfo:
     :param page_name: the page name
     :returns: a dictionary that holds the mapping information
     """
-    with file.open(mode='r+') as input_file:
+    if isinstance(file, ZipPath):
+        # members of a zipped export can't be mapped, read them instead
+        return _attachment_section_info(file.read_bytes(), page_name)
+    with file.open(mode='rb') as input_file:
         with mmap.mmap(input_file.fileno(), length=0, access=mmap.ACCESS_READ) as mmap_in:
-            attachments_offset = mmap_in.rfind(b'<div class="pageSectionHeader">\n\n## Attachments:')
-            if attachments_offset >= 0:
-                # we have a section header, so we can process the attachments
-                # read from there to end of file
-                mmap_in.seek(attachments_offset)
-                data = mmap_in.read().decode('utf-8')
-                # not sure why but the Markdown parser doesn't work properly with the following line, so just remove
-                # it. Confluence is pretty standard on this line in exports, so it's relatively safe, even though
-                # it's a bit of a hack.
-                data = data.replace(REMOVE_STRING_A, '').replace(REMOVE_STRING_B, '')
-                md = MarkdownIt("commonmark")
-                tokens = md.parse(data)
-                # now we have a list of tokens, so we can process them
-                return process_tokens(tokens, page_name)
-
-
-def process_attachments(source: Path, tree: Node) -> Dict[Path, AttachmentInfo]:
+            return _attachment_section_info(mmap_in, page_name)
+
+
+def _attachment_section_info(content, page_name: str) -> Optional[AttachmentInfo]:
+    """
+    :param content: the content of the page (bytes or mmap)
+    :param page_name: the page name
+    """
+    attachments_offset = content.rfind(SECTION_HEADER)
+    if attachments_offset >= 0:
+        # we have a section header, so we can process the attachments
+        # read from there to end of file
+        data = content[attachments_offset:]
+        # Confluence generates the section in a very regular form, which is scanned directly. Only if
+        # that fails is the section parsed as Markdown
+        attachment_info = scan_attachment_section(data, page_name)
+        if attachment_info:
+            return attachment_info
+        data = data.decode('utf-8')
+        # not sure why but the Markdown parser doesn't work properly with the following line, so just remove
+        # it. Confluence is pretty standard on this line in exports, so it's relatively safe, even though
+        # it's a bit of a hack.
+        data = data.replace(REMOVE_STRING_A, '').replace(REMOVE_STRING_B, '')
+        tokens = _markdown.parse(data)
+        # now we have a list of tokens, so we can process them
+        return process_tokens(tokens, page_name)
+
+
+def process_attachments(source: Path, tree: Tree, link_mode: str = 'copy', pages: Optional[Set[Path]] = None,
+                        io_workers: int = DEFAULT_IO_WORKERS) -> Dict[Path, AttachmentInfo]:
     """
     Gathers information on the attachments for each source page. It is common for Confluence to attach multiple
     copies of the same file (different versions perhaps, but often they are identical). This function will
@@ -137,38 +348,99 @@ def process_attachments(source: Path, tree: Node) -> Dict[Path, AttachmentInfo]:
     }
     as well as copying the attachments from the source directory into the target directory tree with meaningful
     names rather than page id and attachment ids.
+
+    The file system work (existence checks, duplicate detection, directory creation and copies) is spread across
+    a pool of io_workers threads, as on network storage the latency of each operation rather than the bandwidth
+    sets the pace. The destination names, warnings and results are the same as when copying one file at a time.
     :param source: Root directory of the source files
     :param tree: content tree
+    :param link_mode: how attachments are materialized in the target, see materialize.LINK_MODES
+    :param pages: if given, only the attachments of these pages (target files) are copied, the attachments of
+                  the other pages are only resolved to their destination (so pages can embed them)
+    :param io_workers: the maximum number of concurrent file system operations
     :return: dictionary mapping target files to attachment information
     """
-    attachment_dir = tree.filepath / 'attachments'
-    attachment_dir.mkdir(exist_ok=True)
-    attachments = get_attached_files(tree)
-    for parent_page, attachment_info in attachments.items():
-        files_copied = 0
-        files_skipped = 0
-        page_dir = attachment_dir / attachment_info.page_name
-        page_dir.mkdir(exist_ok=True)
-        for meaningful_name, attachment in attachment_info.attachments.items():
-            copied, skipped = copy_attachment(source, page_dir, attachment, meaningful_name, parent_page)
-            files_copied += copied
-            files_skipped += skipped
-        # after copying all attachments, ensure that the same number of files appear in the source and target
-        # directories
-        source_dir = source / next(iter(next(iter(attachment_info.attachments.values())).files.values()))[0]
-        source_dir = source_dir.parent
-        source_count = len(list(source_dir.glob('*')))
-        dest_count = files_copied + files_skipped
-        if source_count != dest_count:
-            # If you see this warning, there is another case to add to test_content_manager
-            print(f'Warning: {files_copied} files were copied to {page_dir}, and {files_skipped} were skipped '
-                  f'due to duplication detection or missing file, but there are {source_count} files in the '
-                  f'{source_dir}.')
+    tree = as_content_tree(tree)
+    attachment_dir = tree.target_dir / 'attachments'
+    output_sink.make_dirs(attachment_dir)
+    # the target files of the pages that were fixed up by a previous run, and those of all pages when writing to
+    # an output sink (pages are not copied into the sink), are not there to read: read their source instead
+    from_target = pages if output_sink.active() is None else set()
+    attachments = get_attached_files(tree, from_target)
+    if from_target is not None:
+        for file in tree.dest_files():
+            if file not in from_target and (source / file.name).is_file():
+                attachment_info = get_attachment_info(source / file.name, file.stem)
+                if attachment_info:
+                    attachments[file] = attachment_info
+
+    def plan(item: Tuple[Path, AttachmentInfo]) -> Tuple[List[AttachmentCopy], List[str]]:
+        parent_page, attachment_info = item
+        return _plan_page_attachments(source, attachment_dir, parent_page, attachment_info,
+                                      pages is None or parent_page in pages)
+
+    # the copies by the file they write, when several copies write the same file the last one wins (as it would
+    # if the pages were copied one after the other)
+    copies: Dict[Path, AttachmentCopy] = {}
+    with ThreadPoolExecutor(max_workers=max(1, io_workers)) as executor:
+        for page_copies, warnings in executor.map(plan, attachments.items()):
+            for warning in warnings:
+                print(warning)
+            for attachment_copy in page_copies:
+                source_file, dest_file, is_drawio = attachment_copy
+                written = drawio_target(dest_file) if is_drawio else dest_file
+                copies.pop(written, None)
+                copies[written] = attachment_copy
+        if output_sink.active() is None:
+            for _ in executor.map(lambda attachment_copy: _copy_attachment_file(*attachment_copy, link_mode),
+                                  copies.values()):
+                pass
+    if output_sink.active() is not None:
+        # a sink writes one file at a time anyway, writing them in order keeps archives and plans reproducible
+        for attachment_copy in copies.values():
+            _copy_attachment_file(*attachment_copy, link_mode)
     return attachments
 
 
-def copy_attachment(source: Path, page_dir: Path, attachment: Attachment, meaningful_name: str, parent_page: Path)\
-        -> Tuple[int, int]:
+def _plan_page_attachments(source: Path, attachment_dir: Path, parent_page: Path, attachment_info: AttachmentInfo,
+                           copy: bool) -> Tuple[List[AttachmentCopy], List[str]]:
+    """
+    Determine the destination of the attachments of a page, see plan_attachment
+    :param copy: if False, the attachments were copied by a previous run, only their destination is determined
+    :return: the copies to make, and the warnings to print
+    """
+    copies = []
+    warnings = []
+    files_copied = 0
+    files_skipped = 0
+    page_dir = attachment_dir / attachment_info.page_name
+    if copy:
+        output_sink.make_dirs(page_dir)
+    with profiler.page(parent_page):
+        for meaningful_name, attachment in attachment_info.attachments.items():
+            attachment_copies, skipped = plan_attachment(source, page_dir, attachment, meaningful_name,
+                                                         parent_page, copy, warnings)
+            copies.extend(attachment_copies)
+            files_copied += len(attachment_copies)
+            files_skipped += skipped
+    if not copy:
+        return [], warnings
+    # after copying all attachments, ensure that the same number of files appear in the source and target
+    # directories
+    source_dir = source / next(iter(next(iter(attachment_info.attachments.values())).files.values()))[0]
+    source_dir = source_dir.parent
+    source_count = len(list(source_dir.glob('*')))
+    dest_count = files_copied + files_skipped
+    if source_count != dest_count:
+        # If you see this warning, there is another case to add to test_content_manager
+        warnings.append(f'Warning: {files_copied} files were copied to {page_dir}, and {files_skipped} were '
+                        f'skipped due to duplication detection or missing file, but there are {source_count} '
+                        f'files in the {source_dir}.')
+    return copies, warnings
+
+
+def copy_attachment(source: Path, page_dir: Path, attachment: Attachment, meaningful_name: str, parent_page: Path,
+                    link_mode: str = 'copy', copy: bool = True) -> Tuple[int, int]:
     """
     Copy the attachment to the attachment directory.
     :param source: the source directory
@@ -176,8 +448,31 @@ def copy_attachment(source: Path, page_dir: Path, attachment: Attachment, meanin
     :param attachment: the attachment_obj that holds the attachments to copy
     :param meaningful_name: the name of the attachment
     :param parent_page: the page that the attachment is attached to
+    :param link_mode: how the attachment is materialized in the target, see materialize.LINK_MODES
+    :param copy: if False, only the destination of the attachment is determined (it was copied by a previous run)
     :return: Tuple of (# of files copied, # of files skipped)
     """
+    copies, files_skipped = plan_attachment(source, page_dir, attachment, meaningful_name, parent_page, copy)
+    if copy:
+        for attachment_copy in copies:
+            _copy_attachment_file(*attachment_copy, link_mode)
+    return len(copies), files_skipped
+
+
+def plan_attachment(source: Path, page_dir: Path, attachment: Attachment, meaningful_name: str, parent_page: Path,
+                    copy: bool = True, warnings: Optional[List[str]] = None) -> Tuple[List[AttachmentCopy], int]:
+    """
+    Determine the destination of each distinct file of an attachment (and set the destination_file of the
+    attachment), without copying them.
+    :param source: the source directory
+    :param page_dir: the directory to copy the attachment to
+    :param attachment: the attachment_obj that holds the attachments to copy
+    :param meaningful_name: the name of the attachment
+    :param parent_page: the page that the attachment is attached to
+    :param copy: if False, the attachment was copied by a previous run, existing destinations are left alone
+    :param warnings: warnings are added to this list, if not given they are printed
+    :return: Tuple of (the copies to make, # of files skipped)
+    """
     files = []
     for attachment_type, file_paths in attachment.files.items():
         # we will ignore attachment type. The cases we've seen with same name for different types are:
@@ -187,7 +482,7 @@ def copy_attachment(source: Path, page_dir: Path, attachment: Attachment, meanin
     deduped_files = find_duplicates(files)
     is_drawio = '(application/vnd.jgraph.mxfile)' in attachment.files
     idx = 0
-    files_copied = 0
+    copies = []
     files_skipped = 0
     for source_file, skipped_files in deduped_files.items():
         files_skipped += len(skipped_files)
@@ -198,22 +493,32 @@ def copy_attachment(source: Path, page_dir: Path, attachment: Attachment, meanin
             dest_file = page_dir / f'{meaningful_name}'
         if idx > 0:
             dest_file = dest_file.parent / f'{dest_file.stem}_{idx}{dest_file.suffix}'
-        if dest_file.exists():
-            dest_file.unlink()
+        if copy:
+            output_sink.remove(dest_file)
         if not source_file.exists():
-            print(f'Warning: {source_file} does not exist. (Meaningful name: {dest_file})')
+            if copy:
+                warning = f'Warning: {source_file} does not exist. (Meaningful name: {dest_file})'
+                if warnings is None:
+                    print(warning)
+                else:
+                    warnings.append(warning)
             files_skipped += 1
         else:
-            files_copied += 1
+            copies.append((source_file, dest_file, is_drawio))
             if is_drawio:
-                dest_file = copy_drawio_file(source_file, dest_file)
-            else:
-                shutil.copy(source_file, dest_file)
+                dest_file = drawio_target(dest_file)
             if attachment.destination_file:
                 attachment.multiple_copies_warning = True
             attachment.destination_file = dest_file
             idx += 1
-    return files_copied, files_skipped
+    return copies, files_skipped
+
+
+def _copy_attachment_file(source_file: Path, dest_file: Path, is_drawio: bool, link_mode: str) -> None:
+    if is_drawio:
+        copy_drawio_file(source_file, dest_file)
+    else:
+        materialize(source_file, dest_file, link_mode)
 
 
 def nn_min(x: int, y: int) -> int:
@@ -229,24 +534,28 @@ def nn_min(x: int, y: int) -> int:
     return y
 
 
-def remove_trailing_sections(tree: Node):
+def remove_trailing_sections(tree: Tree):
     """
     Removes the "extra" sections that are part of the export, e.g. Attachments, Comments, Change History
     :param tree: Root of the target directory tree
     """
-    for node in PreOrderIter(tree):
-        file = get_dest_file_from_node(node)
-        with file.open(mode='r+') as input_file:
-            with mmap.mmap(input_file.fileno(), length=0, access=mmap.ACCESS_READ) as mmap_in:
-                offset = mmap_in.rfind(b'<div class="pageSectionHeader">\n\n## Attachments:')
-                offset = nn_min(mmap_in.rfind(b'<div class="pageSectionHeader">\n\n## Comments:'), offset)
-                offset = nn_min(mmap_in.rfind(b'## Change History'), offset)
-            if offset >= 0:
-                os.ftruncate(input_file.fileno(), offset)
+    run_page_pipeline(tree, [remove_trailing_section])
 
 
-def fixup_attachment_references(tree: Node, attachments: Dict[Path, AttachmentInfo], source_root_dir: Path,
-                                target_root_dir: Path):
+def remove_trailing_section(file: Path, content: str) -> str:
+    """
+    Page transform that truncates the page at the first of the "extra" sections
+    """
+    offset = content.rfind('<div class="pageSectionHeader">\n\n## Attachments:')
+    offset = nn_min(content.rfind('<div class="pageSectionHeader">\n\n## Comments:'), offset)
+    offset = nn_min(content.rfind('## Change History'), offset)
+    if offset >= 0:
+        return content[:offset]
+    return content
+
+
+def fixup_attachment_references(tree: Tree, attachments: Dict[Path, AttachmentInfo], source_root_dir: Path,
+                                target_root_dir: Path, link_mode: str = 'copy'):
     """
     The export from Confluence results in attachments identified by page_id (directory) and attachment_id (filename).
     Additionally, drawio macros result in an <img> tag with the source drawio deflated and base64 encoded.
@@ -256,163 +565,163 @@ def fixup_attachment_references(tree: Node, attachments: Dict[Path, AttachmentIn
     :param attachments: information about all the source attachments, key: page_name, value: AttachmentInfo
     :param source_root_dir: the root of the source directory tree
     :param target_root_dir: the root directory of the target directory tree
+    :param link_mode: how images are materialized in the target, see materialize.LINK_MODES
     :return: None
     """
-    class Fixup:
-        def __init__(self, attachment_info_map: Dict[Path, AttachmentInfo]):
-            self.attachment_info_map = attachment_info_map
-            self.changed = False
-            self.current_file = None
-
-        def prep_file(self, file: Path):
-            self.changed = False
-            self.current_file = file
-
-        def fixup(self, match):
-            self.changed = True
-            if match.group(1).startswith('<img src="images/'):
-                data = match.group(1).replace('src="images', 'src="/images')
-                img_file = match.group(2)
-                target_img_file = target_root_dir / img_file
-                target_img_file.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy(source_root_dir / img_file, target_img_file)
-                return data
-            elif match.group(1).find("drawio-diagram-image") != -1:
-                data = match.group(2)
-                if self.current_file in self.attachment_info_map:
-                    attachment_info = self.attachment_info_map[self.current_file]
-                else:
-                    attachment = Attachment("Unknown", {
-                        "(application/vnd.jgraph.mxfile)": [""]
-                    })
-                    attachment_info = AttachmentInfo("Unknown", self.current_file.stem, {"Unknown": attachment})
-                meaningful_name, file_id = handle_attachment(data, attachment_info, source_root_dir, target_root_dir)
-                if meaningful_name.endswith('.drawio.xml'):
-                    return f'''```{{drawio-image}} {file_id}
-```'''
-                else:
-                    return f'![{meaningful_name}](/{file_id})'
-            else:
-                # find the attachment_file name in the set of attachments for this page, use the
-                # meaningful attachment name for the 'alt text' and the destination file for the
-                # path to the image
-                img_file = match.group(2)
-                attachment_info = self.attachment_info_map[self.current_file]
-                for attachment in attachment_info.attachments.values():
-                    for files in attachment.files.values():
-                        for file in files:
-                            if file == img_file:
-                                return f'![{attachment.meaningful_name}]' \
-                                       f'(/{attachment.destination_file.relative_to(target_root_dir)})'
-                # there are a few cases where the conversion to markdown doesn't copy files over.
-                # assuming that the source export directory is a peer directory to the markdown root
-                # and the markdown source root is a subdirectory of the markdown root, see if we can fish the
-                # file out of the original source directory
-
-                if (source_root_dir.parent.parent / source_root_dir.name / img_file).exists():
-                    # probably one of the 'download/temp' files; copy it to target directory and
-                    # return name of the file
-                    img_path = Path(img_file)
-                    target_img_file = f"attachments/{self.current_file.stem}/{img_path.name}"
-                    shutil.copyfile(source_root_dir.parent.parent / source_root_dir.name / img_file,
-                                    target_root_dir / target_img_file)
-                    return f'![{img_path.stem}](/{target_img_file})'
-                print(f'Warning: Could not find attachment file {img_file} for page {self.current_file}')
-
-    fixup = Fixup(attachments)
-
-    for node in PreOrderIter(tree):
-        file = get_dest_file_from_node(node)
-        fixup.prep_file(file)
-        with file.open(mode='r+') as input_file:
-            data = input_file.read()
-        flags = re.IGNORECASE | re.DOTALL | re.MULTILINE
-        new = re.sub(r'(<img\s*src="(.*?)".*?>)', fixup.fixup, data, 0, flags)
-        if fixup.changed:
-            with file.open(mode='w') as output_file:
-                output_file.write(new)
+    run_page_pipeline(tree, [AttachmentReferenceFixup(attachments, source_root_dir, target_root_dir, link_mode)])
 
 
-def fixup_div_tags(tree: Node) -> None:
+def build_attachment_index(attachments: Dict[Path, AttachmentInfo]) -> Dict[str, Tuple[Attachment, Path]]:
+    """
+    Index the attachments of all pages by their source files, so an image reference (to an attachment of the page
+    itself or of any other page) is resolved with a single lookup
+    :param attachments: attachment information of all pages, key: target file, value: AttachmentInfo
+    :return: dictionary mapping source file (as referenced by the pages) to the attachment and its destination file
+    """
+    index = {}
+    for attachment_info in attachments.values():
+        for attachment in attachment_info.attachments.values():
+            if not attachment.destination_file:
+                continue
+            for files in attachment.files.values():
+                for file in files:
+                    index.setdefault(file, (attachment, attachment.destination_file))
+    return index
+
+
+# an <img> tag and its src, the negated classes match what lazy .*? would (up to the first quote, then the first >)
+# without the lazy matching's per character overhead on the long data: urls of embedded diagrams
+_IMG_TAG = re.compile(r'(<img\s*src="([^"]*)"[^>]*>)', re.IGNORECASE)
+
+
+class AttachmentReferenceFixup:
+    """
+    Page transform that replaces <img> tags with Markdown syntax, see fixup_attachment_references
+    """
+    def __init__(self, attachment_info_map: Dict[Path, AttachmentInfo], source_root_dir: Path, target_root_dir: Path,
+                 link_mode: str = 'copy'):
+        self.attachment_info_map = attachment_info_map
+        self.attachment_index = build_attachment_index(attachment_info_map)
+        self.png_indexes: Dict[Path, Dict[str, Tuple[str, str]]] = {}
+        self.source_root_dir = source_root_dir
+        self.target_root_dir = target_root_dir
+        self.link_mode = link_mode
+        self.current_file = None
+
+    def fixup(self, match):
+        source_root_dir = self.source_root_dir
+        target_root_dir = self.target_root_dir
+        if match.group(1).startswith('<img src="images/'):
+            data = match.group(1).replace('src="images', 'src="/images')
+            img_file = match.group(2)
+            target_img_file = target_root_dir / img_file
+            output_sink.make_dirs(target_img_file.parent)
+            materialize(source_root_dir / img_file, target_img_file, self.link_mode)
+            return data
+        elif match.group(1).find("drawio-diagram-image") != -1:
+            data = match.group(2)
+            if self.current_file in self.attachment_info_map:
+                attachment_info = self.attachment_info_map[self.current_file]
+            else:
+                attachment = Attachment("Unknown", {
+                    "(application/vnd.jgraph.mxfile)": [""]
+                })
+                attachment_info = AttachmentInfo("Unknown", self.current_file.stem, {"Unknown": attachment})
+            if self.current_file not in self.png_indexes:
+                self.png_indexes[self.current_file] = png_digest_index(attachment_info, source_root_dir)
+            meaningful_name, file_id = handle_attachment(data, attachment_info, source_root_dir, target_root_dir,
+                                                         self.png_indexes[self.current_file])
+            if meaningful_name.endswith('.drawio.xml'):
+                return f'''```{{drawio-image}} {file_id}
+```'''
+            else:
+                return f'![{meaningful_name}](/{file_id})'
+        else:
+            # find the attachment_file name in the attachments (of this page, or any other page), use the
+            # meaningful attachment name for the 'alt text' and the destination file for the path to the image
+            img_file = match.group(2)
+            indexed = self.attachment_index.get(img_file)
+            if indexed:
+                attachment, destination_file = indexed
+                return f'![{attachment.meaningful_name}](/{destination_file.relative_to(target_root_dir)})'
+            # there are a few cases where the conversion to markdown doesn't copy files over.
+            # assuming that the source export directory is a peer directory to the markdown root
+            # and the markdown source root is a subdirectory of the markdown root, see if we can fish the
+            # file out of the original source directory
+
+            if (source_root_dir.parent.parent / source_root_dir.name / img_file).exists():
+                # probably one of the 'download/temp' files; copy it to target directory and
+                # return name of the file
+                img_path = Path(img_file)
+                target_img_file = f"attachments/{self.current_file.stem}/{img_path.name}"
+                materialize(source_root_dir.parent.parent / source_root_dir.name / img_file,
+                            target_root_dir / target_img_file, self.link_mode)
+                return f'![{img_path.stem}](/{target_img_file})'
+            print(f'Warning: Could not find attachment file {img_file} for page {self.current_file}')
+
+    def __call__(self, file: Path, content: str) -> str:
+        self.current_file = file
+        content, substitutions = _IMG_TAG.subn(self.fixup, content)
+        profiler.count('substitutions', substitutions)
+        return content
+
+
+def fixup_div_tags(tree: Tree) -> None:
     """
     Fixup the div tags in the markdown files.
     :param tree: the content root node
     """
-    for node in PreOrderIter(tree):
-        file = get_dest_file_from_node(node)
-        with file.open(mode='r+') as input_file:
-            data = input_file.read()
-        new = _fixup_divs(data)
-        if new != data:
-            with file.open(mode='w') as output_file:
-                output_file.write(new)
+    run_page_pipeline(tree, [fixup_divs])
+
+
+def fixup_divs(file: Path, content: str) -> str:
+    """
+    Page transform wrapper for _fixup_divs
+    """
+    return _fixup_divs(content)
+
 
 def _fixup_divs(content: str) -> str:
-    patterns = [
-        r'<div class="content-wrapper">\s*(.*?)\s*</div>',
-        r'<div class="content-wrapper">\s*(.*?)\s*</div>',
-        r'<div class="table-wrap">\s*(.*?)\s*</div>',
-        r'<div class="code panel.*?<div class="CodeContent.*?>\s*(.*?)\s*</div>\s*</div>',
-        r'<div>\s*(.*?)\s*</div>',
-        r'<div>\s*(.*?)\s*</div>',
-        r'<div class="details">\s*(.*?)\s*</div>',
-    ]
-    flags = re.IGNORECASE | re.DOTALL | re.MULTILINE
-    content = fixup_expander(content, flags)
-    for pattern in patterns:
-        content = re.sub(pattern, r'\1\n', content, 0, flags)
     content = content.replace(u'\xa0', ' ')
-    content = fixup_toc_macro(content, flags)
-    content = fixup_multi_column(content, flags)
-    return content
+    return unwrap_divs(content)
 
 
+# the flags arguments of the following are no longer used, they are kept so existing callers continue to work
 def fixup_toc_macro(content, flags = re.DOTALL | re.MULTILINE | re.IGNORECASE):
     # since jupyter-book has a toc for each page when rendering html, we can just remove the toc-macro
-    toc_macro = r'<div class="toc-macro.*?>.*?</div>'
-    content = re.sub(toc_macro, '', content, 0, flags)
-    return content
+    return unwrap_divs(content, TOC_MACRO_KINDS)
 
 
 def fixup_expander(content, flags = re.DOTALL | re.MULTILINE | re.IGNORECASE):
     # replace the expander macro with the dropdown directive from sphinx.panels
-    expander = r'<div id="expander-content-.*?class="expand-content">\s*(.*?)\s*</div>'
-    content = re.sub(expander, r'\1\n```', content, 0, flags)
-    expander = r'<div id="expander-control-.*?class="expand-control">\s*<img.*?/>(.*?)\s*</div>'
-    content = re.sub(expander, r'```{dropdown} \1', content, 0, flags)
-    expander = r'<div id="expander-.*?class="expand-container">(.*?)\s*</div>'
-    content = re.sub(expander, r'\1', content, 0, flags)
-    return content
+    return unwrap_divs(content, EXPANDER_KINDS)
 
 
 def fixup_multi_column(content, flags = re.DOTALL | re.MULTILINE | re.IGNORECASE):
-    patterns = [
-        r'<div class="innerCell">\s*(.*?)\s*</div>',
-        r'<div class="cell normal" data-type="normal">\s*(.*?)\s*</div>',
-        r'<div class="columnLayout single" layout="single">\s*(.*?)\s*</div>',
-    ]
-    for pattern in patterns:
-        content = re.sub(pattern, r'\1', content, 0, flags)
-    return content
+    return unwrap_divs(content, MULTI_COLUMN_KINDS)
 
-def convert_remaining_html(tree: Node) -> None:
+def convert_remaining_html(tree: Tree) -> None:
     """
     Fixup the div tags in the markdown files.
     :param tree: the content root node
     """
-    for node in PreOrderIter(tree):
-        file = get_dest_file_from_node(node)
-        with file.open(mode='r+') as input_file:
-            data = input_file.read()
-        new = _convert_remaining_html(data)
-        if new != data:
-            with file.open(mode='w') as output_file:
-                output_file.write(new)
+    run_page_pipeline(tree, [convert_html])
+
+
+def convert_html(file: Path, content: str) -> str:
+    """
+    Page transform wrapper for _convert_remaining_html
+    """
+    return _convert_remaining_html(content)
+
 
 def _convert_remaining_html(content: str) -> str:
     strip_newline = False
     def _convert_to_md(match):
-        converted = md(match.group(1))
+        # plain links and simple tables are converted directly, anything else by markdownify
+        converted = fast_markdownify(match.group(1))
+        if converted is None:
+            converted = md(match.group(1))
         if strip_newline:
             converted = converted.replace('\n', '')
         return converted
@@ -421,10 +730,11 @@ def _convert_remaining_html(content: str) -> str:
 
     strip_newline = True
     html_link = r'(<a\s*?href.*?</a>)'
-    content = re.sub(html_link, _convert_to_md, content, 0, flags)
+    content, links = re.subn(html_link, _convert_to_md, content, 0, flags)
 
     strip_newline = False
     html_table = r'(<table.*?</table>)'
-    content = re.sub(html_table, _convert_to_md, content, 0, flags)
+    content, tables = re.subn(html_table, _convert_to_md, content, 0, flags)
+    profiler.count('substitutions', links + tables)
 
     return content
@@ -1,82 +1,199 @@
 import os
+import re
 
 from anytree import Node, RenderTree, PreOrderIter
-from markdown_it import MarkdownIt
+from array import array
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional, Tuple, Union
 
 
-def build_content_tree(source_dir: Path, target_dir: Path) -> Node:
+# an item of the "Available Pages:" list: indentation, then a bullet and a link to the page. The title of the link can
+# hold escaped brackets (\[Draft\] Plan) and balanced brackets, as in commonmark
+_PAGE_ITEM = re.compile(r'( *)[-*+] +\[(?:\\.|[^\\\[\]]|\[(?:\\.|[^\\\[\]])*\])*\]\(([^)\s]*)\)')
+
+
+class ContentTree:
+    """
+    The page hierarchy, held in parallel arrays (name, parent index and location in the target of each page)
+    rather than as a tree of objects. Pages are stored in preorder (a page is always added after its parent and
+    before the pages that follow its subtree), so walking the pages in order is a preorder traversal, and the
+    tree pickles cheaply.
+
+    - name: the name of the page (and of its file in the source, without the .md suffix)
+    - afile: the path of the page (and of its directory, if it has children) relative to the target directory,
+      without the .md suffix
+    """
+    def __init__(self, target_dir: Path):
+        self.target_dir = target_dir
+        self.names: List[str] = []
+        self.parents = array('l')
+        self.afiles: List[str] = []
+        self._dest_files: Optional[List[Path]] = None
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state['_dest_files'] = None
+        return state
+
+    @property
+    def filepath(self) -> Path:
+        """
+        The directory of the root page, i.e. the target directory (as the filepath of the root Node)
+        """
+        return self.target_dir
+
+    def add(self, name: str, parent: int = -1) -> int:
+        """
+        Add a page, after the pages of the subtree of its parent
+        :param name: the name of the page
+        :param parent: the index of the parent page, -1 for the root
+        :return: the index of the page
+        """
+        self.names.append(name)
+        self.parents.append(parent)
+        # the pages directly under the root are at the top of the target directory
+        self.afiles.append(os.path.join(self.afiles[parent], name) if parent > 0 else name)
+        self._dest_files = None
+        return len(self.names) - 1
+
+    def dest_file(self, index: int) -> Path:
+        """
+        The file of a page in the target directory tree (the equivalent of get_dest_file_from_node)
+        """
+        return self.dest_files()[index]
+
+    def dest_files(self) -> List[Path]:
+        """
+        The files of all pages in the target directory tree, in preorder
+        """
+        if self._dest_files is None:
+            self._dest_files = [self.target_dir / f'{afile}.md' for afile in self.afiles]
+        return self._dest_files
+
+    def directories(self) -> List[Path]:
+        """
+        The directories of the pages that have children, in preorder
+        """
+        with_children = set(self.parents)
+        return [self.target_dir / afile if i else self.target_dir
+                for i, afile in enumerate(self.afiles) if i in with_children]
+
+    def depths(self) -> List[int]:
+        """
+        The depth of each page in the hierarchy (0 for the root), in preorder
+        """
+        depths = []
+        for parent in self.parents:
+            depths.append(depths[parent] + 1 if parent >= 0 else 0)
+        return depths
+
+    def to_node(self) -> Optional[Node]:
+        """
+        The tree as anytree Nodes (with afile and filepath attributes), for code that walks Nodes
+        :return: the root node
+        """
+        nodes = []
+        for i, name in enumerate(self.names):
+            parent = self.parents[i]
+            node = Node(name, nodes[parent] if parent >= 0 else None)
+            node.filepath = self.target_dir / self.afiles[i] if i else self.target_dir
+            node.afile = self.afiles[i]
+            nodes.append(node)
+        return nodes[0] if nodes else None
+
+    @classmethod
+    def from_node(cls, root: Node) -> 'ContentTree':
+        """
+        Build the tree from anytree Nodes (with filepath attributes), the inverse of to_node
+        :param root: the root node
+        """
+        tree = cls(root.filepath)
+        indices = {}
+        for node in PreOrderIter(root):
+            parent = indices[id(node.parent)] if node.parent else -1
+            indices[id(node)] = len(tree)
+            tree.names.append(node.name)
+            tree.parents.append(parent)
+            if node.parent:
+                tree.afiles.append(os.path.relpath(Path(node.parent.filepath, node.filepath.name), root.filepath))
+            else:
+                tree.afiles.append(node.name)
+        return tree
+
+
+# the functions that take the page hierarchy accept a ContentTree, or (for existing callers) the root of a tree of
+# anytree Nodes with afile and filepath attributes
+Tree = Union[ContentTree, Node]
+
+
+def as_content_tree(structure: Tree) -> ContentTree:
+    """
+    :param structure: a content tree, or the root Node of one
+    :return: the content tree
+    """
+    if isinstance(structure, ContentTree):
+        return structure
+    return ContentTree.from_node(structure)
+
+
+def build_content_tree(source_dir: Path, target_dir: Path) -> ContentTree:
     """
     Parse the index.md file and build the content tree.
 
-    Tree nodes will have two attributes:
-    - afile: the name of the file
-    - filepath: that file path (relative to root), including file name
+    For each page, the tree holds:
+    - afile: the name of the file, relative to the target directory
+    - the file of the page in the target directory (see ContentTree.dest_file)
 
-    :param source_dir: directory that contains the html to md converted export from Confluence
+    :param source_dir: directory that contains the html to md converted export from Confluence (or a ZipPath,
+    see export_source.open_export)
     :param target_dir: directory that sphinx/jupyter book files will be writen to
-    :return: root node of the content tree
+    :return: the content tree
     """
     # from the confluence generated embedded list representing page hierarchy
-    # parse the markdown and use it to generate a page hierarchy tree
-    index = Path(source_dir, 'index.md')
-    md = MarkdownIt("commonmark")
-    with open(index, mode='r') as fid:
-        tokens = md.parse(fid.read())
-    structure = []
+    # build a page hierarchy tree. The index is read a line at a time, the indentation of each list item gives
+    # its depth and a stack of the pages on the path to the current item gives its parent
+    index = source_dir / 'index.md'
+    tree = ContentTree(target_dir)
+    stack: List[Tuple[int, int]] = []
     process = False
-    level = 0
-    for token in tokens:
-        if token.content == 'Available Pages:':
-            process = True
-        if process:
-            if token.type == 'bullet_list_open':
-                level = token.level
-            if token.type == "inline" and 'href' in token.children[0].attrs:
-                structure.append((level, token.children[0].attrs['href']))
-    idx = -1
-    parents = {}
-    root = parent = None
-    keys = []
-    for element in structure:
-        if element[0] > idx:
-            node = Node(element[1], parent)
-        else:
-            # remove keys from tmp_parent of equal or greater value than the index
-            while True:
-                key = keys.pop()
-                del parents[key]
-                if key == element[0]:
-                    break
-            node = Node(element[1], parents[keys[-1]])
-        parents[element[0]] = node
-        idx = element[0]
-        keys.append(idx)
-        parent = node
-        if node.parent:
-            node.filepath = Path(node.parent.filepath, element[1])
-            node.afile = os.path.relpath(node.filepath, target_dir)
-        else:
-            root = node
-            node.filepath = target_dir
-            node.afile = node.name
-    return root
-
-
-def print_tree(root: Node):
+    with index.open(mode='r') as fid:
+        for line in fid:
+            if not process:
+                process = line.strip() == 'Available Pages:'
+                continue
+            match = _PAGE_ITEM.match(line.expandtabs(4))
+            if not match:
+                continue
+            indent = len(match.group(1))
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+            if not len(tree):
+                page = tree.add(match.group(2))
+            else:
+                # (another top level page can only go under the root)
+                page = tree.add(match.group(2), stack[-1][1] if stack else 0)
+            stack.append((indent, page))
+    return tree
+
+
+def print_tree(root: Tree):
+    if isinstance(root, ContentTree):
+        root = root.to_node()
     for pre, fill, node in RenderTree(root):
         print(f"{pre}{node.name}")
 
 
-def generate_replacement_dictionary(doc_tree: Node) -> Dict[str, str]:
+def generate_replacement_dictionary(doc_tree: Tree) -> Dict[str, str]:
     """
     Generate a dictionary that maps flat file to structure file
-    :param doc_tree: page hierarchy root node
+    :param doc_tree: page hierarchy
     :return: mapping dictionary
     """
+    tree = as_content_tree(doc_tree)
     mapping_dictionary = {}
-    for node in PreOrderIter(doc_tree):
-        if node.parent:
-            mapping_dictionary[node.name] = node.afile
+    for name, afile in zip(tree.names[1:], tree.afiles[1:]):
+        mapping_dictionary[name] = afile
     return mapping_dictionary
@@ -0,0 +1,231 @@
+import re
+
+from typing import Dict, List, Optional, Union
+
+# div kinds (Confluence macros and layouts) and what they are replaced with
+EXPAND_CONTENT = 'expand_content'        # content, followed by the close of the dropdown directive
+EXPAND_CONTROL = 'expand_control'        # open of the dropdown directive, with the control text as title
+EXPAND_CONTAINER = 'expand_container'    # content
+CONTENT_WRAPPER = 'content_wrapper'      # content, followed by a new line
+TABLE_WRAP = 'table_wrap'                # content, followed by a new line
+CODE_PANEL = 'code_panel'                # content of the code content div, followed by a new line
+CODE_CONTENT = 'code_content'            # (only in a code panel)
+PLAIN = 'plain'                          # content, followed by a new line
+DETAILS = 'details'                      # content, followed by a new line
+TOC_MACRO = 'toc_macro'                  # removed (jupyter-book renders a toc for each page)
+INNER_CELL = 'inner_cell'                # content
+CELL = 'cell'                            # content
+COLUMN_LAYOUT = 'column_layout'          # content
+
+EXPANDER_KINDS = frozenset([EXPAND_CONTENT, EXPAND_CONTROL, EXPAND_CONTAINER])
+WRAPPER_KINDS = frozenset([CONTENT_WRAPPER, TABLE_WRAP, CODE_PANEL, CODE_CONTENT, PLAIN, DETAILS])
+TOC_MACRO_KINDS = frozenset([TOC_MACRO])
+MULTI_COLUMN_KINDS = frozenset([INNER_CELL, CELL, COLUMN_LAYOUT])
+ALL_KINDS = EXPANDER_KINDS | WRAPPER_KINDS | TOC_MACRO_KINDS | MULTI_COLUMN_KINDS
+
+_DIV_TAG = re.compile(r'<div\b[^>]*>|</div\s*>', re.IGNORECASE)
+_ATTRIBUTE = re.compile(r'([\w-]+)\s*=\s*"([^"]*)"')
+_EXPAND_CONTROL_IMAGE = re.compile(r'\s*<img[^>]*?/>', re.IGNORECASE)
+
+# kinds of divs by their class (lower case)
+_CLASS_KINDS = {
+    'content-wrapper': CONTENT_WRAPPER,
+    'table-wrap': TABLE_WRAP,
+    'details': DETAILS,
+    'innercell': INNER_CELL,
+}
+_CLASS_PREFIX_KINDS = [
+    ('code panel', CODE_PANEL),
+    ('codecontent', CODE_CONTENT),
+    ('toc-macro', TOC_MACRO),
+]
+# text appended to the content of the div when it is unwrapped
+_SUFFIXES: Dict[str, str] = {
+    EXPAND_CONTENT: '\n```',
+    CONTENT_WRAPPER: '\n',
+    TABLE_WRAP: '\n',
+    PLAIN: '\n',
+    DETAILS: '\n',
+}
+
+
+def div_kind(open_tag: str) -> Optional[str]:
+    """
+    Classify a div by its open tag
+    :param open_tag: the <div ...> tag
+    :return: the kind of div, None if it isn't one of the divs we unwrap
+    """
+    attributes = {name.lower(): value for name, value in _ATTRIBUTE.findall(open_tag)}
+    if not attributes:
+        return PLAIN if open_tag.strip().lower() == '<div>' else None
+    css_class = attributes.get('class', '').lower()
+    div_id = attributes.get('id', '').lower()
+    if div_id.startswith('expander-'):
+        if css_class == 'expand-content' and div_id.startswith('expander-content-'):
+            return EXPAND_CONTENT
+        if css_class == 'expand-control' and div_id.startswith('expander-control-'):
+            return EXPAND_CONTROL
+        if css_class == 'expand-container':
+            return EXPAND_CONTAINER
+    if css_class in _CLASS_KINDS:
+        return _CLASS_KINDS[css_class]
+    for prefix, kind in _CLASS_PREFIX_KINDS:
+        if css_class.startswith(prefix):
+            return kind
+    if css_class == 'cell normal' and attributes.get('data-type') == 'normal':
+        return CELL
+    if css_class == 'columnlayout single' and attributes.get('layout') == 'single':
+        return COLUMN_LAYOUT
+    return None
+
+
+class _Frame:
+    """
+    An open div on the stack of the scanner. Once closed, an unwrapped div stays in the pieces of its parent as is,
+    so its content is never copied; lclean and rclean tell that the whitespace at the start (end) of its content has
+    been stripped already.
+    """
+    __slots__ = ['open_tag', 'kind', 'pieces', 'code_content', 'lclean', 'rclean']
+
+    def __init__(self, open_tag: str, kind: Optional[str]):
+        self.open_tag = open_tag
+        self.kind = kind
+        self.pieces: List[Union[str, _Frame]] = []
+        self.code_content: Optional[str] = None
+        self.lclean = False
+        self.rclean = False
+
+
+def unwrap_divs(content: str, kinds=ALL_KINDS) -> str:
+    """
+    Unwrap (or remove) the divs that Confluence generates for macros and layouts. This is a single pass over the
+    div tags of the content that keeps a stack of the open divs, so every close tag is paired with its own open
+    tag however deep divs are nested, and the time taken grows linearly with the size of the content (the content
+    of a div is handed to its parent without being copied, and joined once at the end). Divs of other kinds, and
+    unbalanced tags, are left as they are.
+    :param content: page content
+    :param kinds: the kinds of divs to unwrap
+    :return: the content with the divs unwrapped
+    """
+    root = _Frame('', None)
+    stack = [root]
+    position = 0
+    for match in _DIV_TAG.finditer(content):
+        top = stack[-1]
+        if match.start() > position:
+            top.pieces.append(content[position:match.start()])
+        position = match.end()
+        tag = match.group()
+        if tag[1] != '/':
+            kind = div_kind(tag)
+            stack.append(_Frame(tag, kind if kind in kinds else None))
+        elif len(stack) > 1:
+            stack.pop()
+            _close(top, tag, stack[-1])
+        else:
+            top.pieces.append(tag)
+    if position < len(content):
+        stack[-1].pieces.append(content[position:])
+    # anything left open is emitted as is
+    while len(stack) > 1:
+        frame = stack.pop()
+        stack[-1].pieces.append(frame.open_tag)
+        stack[-1].pieces.append(frame)
+    return _join(root.pieces)
+
+
+def _join(pieces: List[Union[str, _Frame]]) -> str:
+    """
+    The text of pieces, with the content of the divs they hold
+    """
+    text = []
+    iterators = [iter(pieces)]
+    while iterators:
+        for piece in iterators[-1]:
+            if isinstance(piece, str):
+                text.append(piece)
+            else:
+                iterators.append(iter(piece.pieces))
+                break
+        else:
+            iterators.pop()
+    return ''.join(text)
+
+
+def _strip(pieces: List[Union[str, _Frame]], end: bool) -> None:
+    """
+    Strip the whitespace at the start (or end) of the text of pieces, descending into the divs they hold as far as
+    needed. Divs that are stripped are marked, so they aren't descended into again.
+    """
+    clean = 'rclean' if end else 'lclean'
+    path: List[_Frame] = []
+    current = pieces
+    while True:
+        count = 0
+        for piece in (reversed(current) if end else current):
+            if isinstance(piece, str):
+                piece = piece.rstrip() if end else piece.lstrip()
+                if piece:
+                    current[-count - 1 if end else count] = piece
+                    break
+            elif not getattr(piece, clean) or piece.pieces:
+                break
+            count += 1
+        if end:
+            del current[len(current) - count:]
+        else:
+            del current[:count]
+        if current:
+            edge = current[-1 if end else 0]
+            if not isinstance(edge, str) and not getattr(edge, clean):
+                path.append(edge)
+                current = edge.pieces
+                continue
+        if current or not path:
+            break
+        # the div is empty, it is skipped in the pieces of its parent
+        setattr(path.pop(), clean, True)
+        current = path[-1].pieces if path else pieces
+    for frame in path:
+        setattr(frame, clean, True)
+
+
+def _close(frame: _Frame, close_tag: str, parent: _Frame) -> None:
+    """
+    A div was closed, add its replacement to the content of its parent
+    """
+    kind = frame.kind
+    if kind is None or (kind == CODE_PANEL and frame.code_content is None):
+        parent.pieces.append(frame.open_tag)
+        parent.pieces.append(frame)
+        parent.pieces.append(close_tag)
+    elif kind == TOC_MACRO:
+        pass
+    elif kind == CODE_CONTENT:
+        if parent.kind == CODE_PANEL:
+            parent.code_content = _join(frame.pieces).strip()
+        else:
+            parent.pieces.append(frame.open_tag)
+            parent.pieces.append(frame)
+            parent.pieces.append(close_tag)
+    elif kind == CODE_PANEL:
+        parent.pieces.append(f'{frame.code_content}\n')
+    elif kind == EXPAND_CONTROL:
+        text = _join(frame.pieces)
+        image = _EXPAND_CONTROL_IMAGE.match(text)
+        if image:
+            text = text[image.end():]
+        else:
+            text = text.lstrip()
+        parent.pieces.append(f'```{{dropdown}} {text.rstrip()}')
+    elif kind == EXPAND_CONTAINER:
+        _strip(frame.pieces, end=True)
+        frame.rclean = True
+        parent.pieces.append(frame)
+    else:
+        _strip(frame.pieces, end=False)
+        _strip(frame.pieces, end=True)
+        frame.lclean = frame.rclean = True
+        parent.pieces.append(frame)
+        if kind in _SUFFIXES:
+            parent.pieces.append(_SUFFIXES[kind])
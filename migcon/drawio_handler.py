@@ -1,14 +1,40 @@
 import base64
-import filecmp
-import shutil
-import xml.etree.ElementTree as ETree
+import io
 import zlib
 
+from migcon import output_sink, profiler
 from migcon.attachment_info import AttachmentInfo
+from migcon.content_cache import DEFAULT_MAX_SIZE, ContentCache
+from migcon.drawio_stream import render_compressed, render_mxfile
+from migcon.file_dups import data_digest, file_digest
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 from urllib.parse import unquote
-from xml.dom import minidom
+
+
+# rendered drawio files by digest of their content, see configure_cache and copy_drawio_file. Bump the version
+# whenever the rendering changes, so entries persisted by previous versions are not used
+CACHE_VERSION = 1
+# rendered diagrams larger than this (in bytes) are decoded every time rather than cached
+MAX_CACHED_DIAGRAM_SIZE = 1024 * 1024
+_cache = ContentCache()
+
+
+def configure_cache(directory: Optional[Path] = None, max_size: int = DEFAULT_MAX_SIZE) -> None:
+    """
+    Configure the cache of rendered drawio files
+    :param directory: if given, the cache is persisted to (and re-used from) this directory
+    :param max_size: bound of the size of the cache held in memory, in characters, and of the cache directory, in bytes
+    """
+    global _cache
+    _cache = ContentCache(max_size, directory)
+
+
+def cache_settings() -> Tuple[Optional[Path], int]:
+    """
+    The settings of the cache (the arguments of configure_cache), to configure the cache of a worker process
+    """
+    return _cache.directory, _cache.max_size
 
 
 def inflate(data: str) -> str:
@@ -28,22 +54,86 @@ def inflate(data: str) -> str:
     return unquote(inflated.decode('utf-8'))
 
 
+def render_diagram(data: str) -> str:
+    """
+    The (pretty printed) xml of a compressed diagram
+    :param data: base64 encoded string
+    :return: xml
+    """
+    output = io.StringIO()
+    render_compressed(data, output)
+    return output.getvalue()
+
+
+def drawio_target(target: Path) -> Path:
+    """
+    The file that copy_drawio_file writes the inflated diagram of a drawio attachment to
+    """
+    return Path(f"{str(target)}.drawio.xml")
+
+
 def copy_drawio_file(source: Path, target: Path) -> Path:
-    tree = ETree.parse(source)
-    root = tree.getroot()
-    data = root.find('diagram').text
-    target_file = Path(f"{str(target)}.drawio.xml")
-    write_file_from_data(data, target_file)
+    target_file = drawio_target(target)
+    profiler.count('files_copied')
+    sink = output_sink.active()
+    if sink is not None and not sink.needs_content:
+        sink.add_file(target_file, source)
+        return target_file
+    if source.stat().st_size > MAX_CACHED_DIAGRAM_SIZE:
+        # too large to cache, decode the diagram straight into the target, a block at a time, so it is never held in
+        # memory
+        if sink is not None:
+            output = io.StringIO()
+            render_mxfile(source, output)
+            output_sink.write_data(target_file, output.getvalue().encode('utf-8'))
+        else:
+            with target_file.open(mode='w+') as output_file:
+                render_mxfile(source, output_file)
+        return target_file
+    # the same mxfile is often attached many times, so look up the rendered diagram by the content of the file
+    # before parsing it. The file is read once, for both the digest and the rendering
+    content = source.read_bytes()
+    key = f'file-{CACHE_VERSION}-{data_digest(content)}'
+    rendered = _cache.get(key)
+    if rendered is None:
+        output = io.StringIO()
+        render_mxfile(content, output)
+        rendered = output.getvalue()
+        if len(rendered) <= MAX_CACHED_DIAGRAM_SIZE:
+            _cache.put(key, rendered)
+    if sink is not None:
+        output_sink.write_data(target_file, rendered.encode('utf-8'))
+    else:
+        with target_file.open(mode='w+') as output_file:
+            output_file.write(rendered)
     return target_file
 
 
 def write_file_from_data(data: str, target_file: Path) -> None:
     with target_file.open(mode='w+') as output_file:
-        output_file.write(minidom.parseString(inflate(data)).toprettyxml(indent="   "))
+        output_file.write(render_diagram(data))
+
+
+def png_digest_index(attachment_info: AttachmentInfo, source_root: Path) -> Dict[str, Tuple[str, str]]:
+    """
+    Index the png attachments of a page by the digest of their content
+    :param attachment_info: the attachments of the page
+    :param source_root: the root of the source directory tree
+    :return: dictionary of hex digest to (meaningful name, file) of the first attachment file with that content
+    """
+    index = {}
+    for attachment in attachment_info.attachments.values():
+        for file in attachment.files.get("(image/png)", []):
+            try:
+                digest = file_digest(source_root / file)
+            except OSError:
+                continue
+            index.setdefault(digest, (attachment.meaningful_name, file))
+    return index
 
 
 def handle_attachment(data: str, attachment_info: AttachmentInfo, source_root: Path,
-                      target_root: Path) -> Tuple[str, str]:
+                      target_root: Path, png_index: Optional[Dict[str, Tuple[str, str]]] = None) -> Tuple[str, str]:
     # data is likely coming in as base64 encoded string prefixed with 'data:image/png;base64,'
     # verify that's the case... If it isn't, then I'm uncertain what to do, so print a warning and
     # continue...
@@ -52,31 +142,25 @@ def handle_attachment(data: str, attachment_info: AttachmentInfo, source_root: P
         return "skip", "skip"
     data = base64.b64decode(data[len('data:image/png;base64,'):])
 
-    # create a temporary file and write inflated data str into it
-    temp_file = target_root / "attachments/temporary.png"
-    with open(temp_file, 'wb') as output_file:
-        output_file.write(data)
-
-    # compare the temp file to the contents of the files in attachments that are 'png'
-    for attachment in attachment_info.attachments.values():
-        if "(image/png)" in attachment.files:
-            for file in attachment.files["(image/png)"]:
-                if filecmp.cmp(temp_file, source_root / file):
-                    # if the file is the same, we don't need to copy it again
-                    temp_file.unlink()
-                    # TODO: if we find a match with a png file in the attachments, then try to correlate it back to a
-                    #  drawio file
-                    #  Unfortunately, exact match on contents is not sufficient. For now, leave this as a manual step
-                    return attachment.meaningful_name, file
+    # compare the content to the contents of the files in attachments that are 'png'
+    if png_index is None:
+        png_index = png_digest_index(attachment_info, source_root)
+    match = png_index.get(data_digest(data))
+    if match:
+        # if the file is the same, we don't need to copy it again
+        # TODO: if we find a match with a png file in the attachments, then try to correlate it back to a
+        #  drawio file
+        #  Unfortunately, exact match on contents is not sufficient. For now, leave this as a manual step
+        return match
     # if we get here, the file is not the same as any of the files in the attachments, so we need to copy it
     target_dir = target_root / "attachments" / attachment_info.page_name
-    target_dir.mkdir(parents=True, exist_ok=True)
+    output_sink.make_dirs(target_dir)
     idx = 0
     while True:
         meaningful_name = f"auto_generated_{idx}.png"
         target_file = target_dir / meaningful_name
-        if not target_file.exists():
-            shutil.copy(temp_file, target_file)
-            temp_file.unlink()
+        if not output_sink.exists(target_file):
+            output_sink.write_data(target_file, data)
+            profiler.count('files_copied')
             return meaningful_name, str(target_file.relative_to(target_root))
         idx += 1
@@ -0,0 +1,337 @@
+import base64
+import binascii
+import codecs
+import io
+import re
+import tempfile
+import zlib
+
+from migcon.export_source import ZipPath
+from pathlib import Path
+from typing import Iterator, List, Optional, TextIO, Tuple, Union
+from urllib.parse import unquote_to_bytes
+from xml.parsers import expat
+
+# size of the blocks the source file is read in, and the bound of the data inflated at a time
+READ_BLOCK_SIZE = 64 * 1024
+INDENT = "   "
+# the xml of the first diagram of a drawio file is held in memory up to this size (in characters), then spooled to disk
+SPOOL_SIZE = 1024 * 1024
+# marks the start of the lines of the first diagram (xml can't hold a NUL character)
+MARGIN = '\0'
+XML_DECLARATION = '<?xml version="1.0" ?>\n'
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class PrettyXmlWriter:
+    """
+    Writes xml, given as a stream of parser events, indented exactly like minidom's toprettyxml, without holding
+    the document in memory. Only the element that is currently open, and the text that follows it, are buffered
+    to decide whether the element is written on a single line.
+    """
+    def __init__(self, output: TextIO, indent: str = INDENT, margin: str = ''):
+        """
+        :param margin: written before the indentation of every line
+        """
+        self.output = output
+        self.indent = indent
+        self.margin = margin
+        # for each open element: its name and whether its start tag is still open (it has no children yet)
+        self.stack: List[List] = []
+        self.text: List[str] = []
+        self.output.write(XML_DECLARATION)
+
+    def start(self, name: str, attributes: List[str]) -> None:
+        """
+        :param name: element name
+        :param attributes: attribute names and values, alternating (as reported by expat with ordered_attributes)
+        """
+        self._child()
+        write = self.output.write
+        write(f'{self.margin}{self.indent * len(self.stack)}<{name}')
+        pairs = [(attributes[i], attributes[i + 1]) for i in range(0, len(attributes), 2)]
+        # like minidom, namespace declarations go first
+        pairs.sort(key=lambda pair: not (pair[0] == 'xmlns' or pair[0].startswith('xmlns:')))
+        for attribute, value in pairs:
+            write(f' {attribute}="{_escape(value)}"')
+        self.stack.append([name, True])
+
+    def end(self, name: str = None) -> None:
+        name, start_open = self.stack[-1]
+        if start_open and self.text:
+            # the only child is text, it goes on the same line
+            self.stack.pop()
+            self.output.write(f'>{_escape("".join(self.text))}</{name}>\n')
+            self.text = []
+            return
+        self._flush_text()
+        name, start_open = self.stack.pop()
+        if start_open:
+            self.output.write('/>\n')
+        else:
+            self.output.write(f'{self.margin}{self.indent * len(self.stack)}</{name}>\n')
+
+    def characters(self, data: str) -> None:
+        if self.stack:
+            self.text.append(data)
+
+    def comment(self, data: str) -> None:
+        self._child()
+        self.output.write(f'{self.margin}{self.indent * len(self.stack)}<!--{data}-->\n')
+
+    def _child(self) -> None:
+        """
+        A child (other than text) follows, write whatever precedes it
+        """
+        self._flush_text()
+        if self.stack and self.stack[-1][1]:
+            self.output.write('>\n')
+            self.stack[-1][1] = False
+
+    def _flush_text(self) -> None:
+        if self.text:
+            if self.stack[-1][1]:
+                self.output.write('>\n')
+                self.stack[-1][1] = False
+            self.output.write(_escape(f'{self.margin}{self.indent * len(self.stack)}{"".join(self.text)}\n'))
+            self.text = []
+
+
+class DiagramDecoder:
+    """
+    Decodes a compressed drawio diagram (base64, raw deflate, url encoding) as it is fed, one block at a time,
+    and reports the xml it holds to a PrettyXmlWriter
+    """
+    def __init__(self, writer: PrettyXmlWriter):
+        self.base64_tail = ''
+        self.decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+        self.unquote_tail = b''
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.parser = _parser(writer)
+        self.fed = False
+
+    def feed(self, data: str) -> None:
+        """
+        :param data: the next block of the base64 encoded diagram
+        """
+        data = self.base64_tail + _WHITESPACE.sub('', data)
+        self.fed = self.fed or bool(data)
+        usable = len(data) - len(data) % 4
+        self.base64_tail = data[usable:]
+        if usable:
+            self._inflate(base64.b64decode(data[:usable]))
+
+    def close(self) -> None:
+        if self.base64_tail:
+            raise binascii.Error('Incorrect padding')
+        if self.fed:
+            self._unquote(self.decompress.flush(), True)
+            self.parser.Parse('', True)
+
+    def _inflate(self, data: bytes) -> None:
+        while data:
+            self._unquote(self.decompress.decompress(data, READ_BLOCK_SIZE))
+            data = self.decompress.unconsumed_tail
+
+    def _unquote(self, data: bytes, final: bool = False) -> None:
+        data = self.unquote_tail + data
+        split = len(data)
+        if not final:
+            # an escape (%xx) can be split across blocks, keep it for the next block
+            percent = data.rfind(b'%', max(len(data) - 2, 0))
+            if percent >= 0:
+                split = percent
+        self.unquote_tail = data[split:]
+        text = self.text_decoder.decode(unquote_to_bytes(data[:split]), final)
+        if text:
+            self.parser.Parse(text, False)
+
+
+def render_compressed(data: str, output: TextIO) -> None:
+    """
+    Write the (pretty printed) xml of a compressed diagram
+    :param data: base64 encoded string
+    :param output: where the xml is written to
+    """
+    decoder = DiagramDecoder(PrettyXmlWriter(output))
+    for start in range(0, len(data), READ_BLOCK_SIZE):
+        decoder.feed(data[start:start + READ_BLOCK_SIZE])
+    decoder.close()
+
+
+def render_mxfile(source: Union[Path, ZipPath, bytes], output: TextIO) -> int:
+    """
+    Write the (pretty printed) xml of the diagrams of a drawio file, reading and decoding the file a block at a
+    time, in a single pass. The xml of a single diagram is written as is, several diagrams (pages) are written as an
+    mxfile with the decoded xml of each page in its diagram element. Both compressed and uncompressed diagrams are
+    supported.
+    :param source: the drawio (mxfile) file, or its content
+    :param output: where the xml is written to
+    :return: the number of diagrams
+    """
+    state = _MxfileState(output)
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = state.start
+    parser.EndElementHandler = state.end
+    parser.CharacterDataHandler = state.characters
+    parser.CommentHandler = state.comment
+    if isinstance(source, bytes):
+        for start in range(0, len(source), READ_BLOCK_SIZE):
+            parser.Parse(source[start:start + READ_BLOCK_SIZE], False)
+    else:
+        with source.open(mode='rb') as input_file:
+            for block in iter(lambda: input_file.read(READ_BLOCK_SIZE), b''):
+                parser.Parse(block, False)
+    parser.Parse(b'', True)
+    state.close()
+    return state.diagrams
+
+
+class _Spool:
+    """
+    Text held in memory, moved to a temporary file (in one write) whenever it outgrows SPOOL_SIZE, see spill
+    """
+    def __init__(self):
+        self.buffer = io.StringIO()
+        self.write = self.buffer.write
+        self.file = None
+        # the size of the text in the file
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return self.spilled + self.buffer.tell()
+
+    def spill(self) -> None:
+        if self.buffer.tell() > SPOOL_SIZE:
+            if self.file is None:
+                self.file = tempfile.TemporaryFile(mode='w+', newline='')
+            self.file.write(self.buffer.getvalue())
+            self.spilled += self.buffer.tell()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+    def blocks(self, start: int) -> Iterator[str]:
+        """
+        The text from start on, a block at a time
+        """
+        if self.file is None:
+            text = self.buffer.getvalue()
+            for offset in range(start, len(text), READ_BLOCK_SIZE):
+                yield text[offset:offset + READ_BLOCK_SIZE]
+            return
+        with self.file:
+            self.file.write(self.buffer.getvalue())
+            self.file.seek(0)
+            self.file.read(start)
+            yield from iter(lambda: self.file.read(READ_BLOCK_SIZE), '')
+
+
+class _MxfileState:
+    """
+    Routes the events of the parser of a drawio file: compressed diagram content to a DiagramDecoder, the
+    elements of uncompressed diagrams (and, for several diagrams, the mxfile and diagram elements) to the writer.
+    Whether the diagrams are wrapped in their mxfile is only known once a second diagram starts (or the file ends),
+    so the first diagram is written to a spool, with MARGIN in front of the indentation of every line. The margin is
+    then dropped (a single diagram) or replaced by the indentation of the diagram in the mxfile.
+    """
+    def __init__(self, output: TextIO):
+        self.output = output
+        self.spool = _Spool()
+        self.target = PrettyXmlWriter(self.spool, margin=MARGIN)
+        # the writer, once the number of diagrams is known to be more than one
+        self.writer: Optional[PrettyXmlWriter] = None
+        self.root: Optional[Tuple[str, List[str]]] = None
+        self.first_diagram: Optional[List[str]] = None
+        self.diagrams = 0
+        self.depth = 0
+        self.in_diagram = False
+        self.decoder: Optional[DiagramDecoder] = None
+
+    def start(self, name: str, attributes: List[str]) -> None:
+        self.depth += 1
+        if self.in_diagram:
+            # an uncompressed diagram
+            self.decoder = None
+            self.target.start(name, attributes)
+            if self.writer is None:
+                self.spool.spill()
+        elif self.depth == 2 and name == 'diagram':
+            self.diagrams += 1
+            if self.diagrams == 1:
+                self.first_diagram = attributes
+            else:
+                if self.writer is None:
+                    self._wrap()
+                self.writer.start(name, attributes)
+            self.in_diagram = True
+            self.decoder = DiagramDecoder(self.target)
+        elif self.depth == 1:
+            self.root = (name, attributes)
+
+    def end(self, name: str) -> None:
+        self.depth -= 1
+        if self.depth > 1 and self.in_diagram:
+            self.target.end(name)
+        elif self.depth == 1 and self.in_diagram:
+            if self.decoder:
+                self.decoder.close()
+            self.decoder = None
+            self.in_diagram = False
+            if self.writer:
+                self.writer.end(name)
+        elif self.depth == 0 and self.writer:
+            self.writer.end(name)
+
+    def characters(self, data: str) -> None:
+        if self.depth == 2 and self.decoder:
+            self.decoder.feed(data)
+            if self.writer is None:
+                self.spool.spill()
+        elif self.depth > 2 and self.in_diagram:
+            self.target.characters(data)
+
+    def comment(self, data: str) -> None:
+        if self.depth > 2 and self.in_diagram:
+            self.target.comment(data)
+
+    def close(self) -> None:
+        if self.writer is None:
+            # a single diagram (or none), written as is
+            self._copy_spool('', 0)
+
+    def _wrap(self) -> None:
+        """
+        A second diagram starts: write the mxfile and the first diagram in it, the diagrams that follow are written
+        as they are decoded
+        """
+        self.writer = PrettyXmlWriter(self.output)
+        self.writer.start(*self.root)
+        self.writer.start('diagram', self.first_diagram)
+        if len(self.spool) > len(XML_DECLARATION):
+            self.writer._child()
+            self._copy_spool(self.writer.indent * 2, len(XML_DECLARATION))
+        self.writer.end('diagram')
+        self.target = self.writer
+
+    def _copy_spool(self, margin: str, start: int) -> None:
+        for block in self.spool.blocks(start):
+            self.output.write(block.replace(MARGIN, margin))
+
+
+def _parser(writer: PrettyXmlWriter):
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = writer.start
+    parser.EndElementHandler = writer.end
+    parser.CharacterDataHandler = writer.characters
+    parser.CommentHandler = writer.comment
+    return parser
+
+
+def _escape(data: str) -> str:
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
@@ -0,0 +1,207 @@
+import fnmatch
+import io
+import os
+import posixpath
+import shutil
+import stat
+import threading
+import time
+import zipfile
+
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, NamedTuple, Optional, Union
+
+# size of the blocks members are streamed to their targets in
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# the open archives of this process by file, see _open_archive
+_archives: Dict[Path, 'ZipDirectory'] = {}
+_archives_pid = os.getpid()
+_archives_lock = threading.Lock()
+
+
+class ZipDirectory:
+    """
+    The directory of a zip archive: its (file) members by name and the names of the entries of each directory,
+    including the directories that are only implied by the names of members
+    """
+    def __init__(self, file: Path):
+        self.zip_file = zipfile.ZipFile(file)
+        self.members: Dict[str, zipfile.ZipInfo] = {}
+        # entries of each directory ('' is the root), in the order of the archive
+        self.entries: Dict[str, Dict[str, None]] = {'': {}}
+        for info in self.zip_file.infolist():
+            name = info.filename.strip('/')
+            if not name:
+                continue
+            if info.is_dir():
+                self.entries.setdefault(name, {})
+            else:
+                self.members[name] = info
+            # add the entry to its directory, and the directories on its path to theirs
+            while name:
+                parent, _, entry = name.rpartition('/')
+                entries = self.entries.setdefault(parent, {})
+                if entry in entries:
+                    break
+                entries[entry] = None
+                name = parent
+
+
+def _open_archive(file: Path) -> ZipDirectory:
+    """
+    The directory of an archive, read once per process. The threads of a process share the archive (ZipFile
+    serializes the reads of its members), worker processes open it again rather than share the file offset of
+    their parent.
+    """
+    global _archives_pid
+    with _archives_lock:
+        if _archives_pid != os.getpid():
+            _archives.clear()
+            _archives_pid = os.getpid()
+        directory = _archives.get(file)
+        if directory is None:
+            directory = _archives[file] = ZipDirectory(file)
+        return directory
+
+
+class ZipStat(NamedTuple):
+    st_size: int
+    st_mtime_ns: int
+    st_mode: int
+    crc: int
+
+
+class ZipPath:
+    """
+    A file or directory in a zip archive, with the part of the pathlib.Path interface the conversion uses on the
+    source export. Members are read straight from the archive, so a zipped export doesn't have to be extracted.
+    """
+    def __init__(self, archive: Path, at: str = ''):
+        """
+        :param archive: the zip file
+        :param at: the name of the member (or directory) in the archive, '' for the root of the archive
+        """
+        self.archive = archive
+        self.at = at
+
+    def __truediv__(self, other: Union[str, os.PathLike]) -> 'ZipPath':
+        at = posixpath.normpath(posixpath.join(self.at, PurePosixPath(other).as_posix()))
+        return ZipPath(self.archive, '' if at == '.' else at)
+
+    def __str__(self) -> str:
+        return f'{self.archive}/{self.at}' if self.at else str(self.archive)
+
+    def __repr__(self) -> str:
+        return f'ZipPath({str(self.archive)!r}, {self.at!r})'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ZipPath) and (self.archive, self.at) == (other.archive, other.at)
+
+    def __hash__(self) -> int:
+        return hash((self.archive, self.at))
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.at).name if self.at else self.archive.stem
+
+    @property
+    def stem(self) -> str:
+        return PurePosixPath(self.name).stem
+
+    @property
+    def suffix(self) -> str:
+        return PurePosixPath(self.name).suffix
+
+    @property
+    def parent(self) -> Union['ZipPath', Path]:
+        """
+        The directory of the member, the parent of the root of the archive is the directory of the zip file
+        """
+        if not self.at:
+            return self.archive.parent
+        return ZipPath(self.archive, posixpath.dirname(self.at))
+
+    def info(self) -> Optional[zipfile.ZipInfo]:
+        """
+        The entry of the member in the zip directory (size, crc, ...), None if there is no such member
+        """
+        return _open_archive(self.archive).members.get(self.at)
+
+    def exists(self) -> bool:
+        return self.is_file() or self.is_dir()
+
+    def is_file(self) -> bool:
+        return self.info() is not None
+
+    def is_dir(self) -> bool:
+        return self.at in _open_archive(self.archive).entries
+
+    def stat(self) -> ZipStat:
+        info = self.info()
+        if info is None:
+            raise FileNotFoundError(f'No such member: {self}')
+        mtime = int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+        return ZipStat(info.file_size, mtime, stat.S_IFREG | 0o644, info.CRC)
+
+    def open(self, mode: str = 'r', encoding: Optional[str] = None):
+        if mode not in ('r', 'rb'):
+            raise ValueError(f'A zipped export is read only, can not open {self} with mode {mode}')
+        info = self.info()
+        if info is None:
+            raise FileNotFoundError(f'No such member: {self}')
+        member = _open_archive(self.archive).zip_file.open(info)
+        if mode == 'rb':
+            return member
+        return io.TextIOWrapper(member, encoding=encoding)
+
+    def read_bytes(self) -> bytes:
+        with self.open(mode='rb') as member:
+            return member.read()
+
+    def read_text(self, encoding: Optional[str] = None) -> str:
+        with self.open(mode='r', encoding=encoding) as member:
+            return member.read()
+
+    def iterdir(self) -> Iterator['ZipPath']:
+        entries = _open_archive(self.archive).entries.get(self.at)
+        if entries is None:
+            raise NotADirectoryError(f'No such directory: {self}')
+        for entry in entries:
+            yield self / entry
+
+    def glob(self, pattern: str) -> Iterator['ZipPath']:
+        """
+        The entries of the directory matching the pattern, only patterns without path separators are supported
+        """
+        if '/' in pattern:
+            raise ValueError(f'Unsupported pattern: {pattern}')
+        entries = _open_archive(self.archive).entries.get(self.at, {})
+        for entry in entries:
+            if fnmatch.fnmatchcase(entry, pattern):
+                yield self / entry
+
+    def copy_to(self, target: Path) -> None:
+        """
+        Stream the member into a file
+        """
+        with self.open(mode='rb') as member, open(target, 'wb') as output_file:
+            shutil.copyfileobj(member, output_file, COPY_BUFFER_SIZE)
+
+
+def open_export(source: Union[Path, ZipPath]) -> Union[Path, ZipPath]:
+    """
+    The root of a Confluence export (converted to markdown): the directory itself, or for a zip archive of the
+    export the directory in the archive that holds the index.md (the root of the archive, or its single top level
+    directory)
+    :param source: the export directory or zip file
+    :return: the root of the export, a ZipPath for a zip archive
+    """
+    if isinstance(source, ZipPath) or not source.is_file() or not zipfile.is_zipfile(source):
+        return source
+    root = ZipPath(source)
+    if not (root / 'index.md').is_file():
+        top_level: List[ZipPath] = [entry for entry in root.iterdir() if entry.is_dir()]
+        if len(top_level) == 1 and (top_level[0] / 'index.md').is_file():
+            return top_level[0]
+    return root
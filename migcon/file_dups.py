@@ -1,17 +1,123 @@
-import filecmp
+import hashlib
 
+from migcon.export_source import ZipPath
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+# number of bytes read from the head of a file to compute the partial digest
+PARTIAL_DIGEST_SIZE = 64 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+# digests by (file, size, mtime), so a file that has been hashed is never read again (unless it changes)
+_partial_digests: Dict[Tuple[Path, int, int], bytes] = {}
+_full_digests: Dict[Tuple[Path, int, int], bytes] = {}
 
 
 def find_duplicates(files: List[Path]) -> Dict[Path, List[Path]]:
-    is_duplicate = set()
+    """
+    Find the files with identical content. Files are bucketed by size first, then by a digest of the head of the
+    file and only then by a digest of the full content, so a file is only read in full if another file of the
+    same size shares the same head. Members of a zipped export are compared by the size and crc recorded in the
+    zip directory, without reading them.
+    :param files: the files to check
+    :return: dictionary of the first occurrence of each distinct file to the list of its duplicates (in order)
+    """
+    keys = _content_keys(files)
     duplicates = {}
-    for i in range(len(files)):
-        if files[i] not in is_duplicate:
-            duplicates[files[i]] = []
-            for j in range(i + 1, len(files)):
-                if filecmp.cmp(files[i], files[j]):
-                    duplicates[files[i]].append(files[j])
-                    is_duplicate.add(files[j])
+    first_occurrence = {}
+    for file, key in zip(files, keys):
+        if key is not None and key in first_occurrence:
+            duplicates[first_occurrence[key]].append(file)
+        else:
+            duplicates[file] = []
+            if key is not None:
+                first_occurrence[key] = file
     return duplicates
+
+
+def file_digest(file: Path) -> str:
+    """
+    The (cached) digest of the full content of a file
+    :param file: the file to hash
+    :return: hex digest of the file content
+    """
+    stat = file.stat()
+    return _full_digest((file, stat.st_size, stat.st_mtime_ns)).hex()
+
+
+def data_digest(data: bytes) -> str:
+    """
+    The digest of content held in memory, equal to the file_digest of a file with that content
+    :param data: the content to hash
+    :return: hex digest of the content
+    """
+    return hashlib.blake2b(data).hexdigest()
+
+
+def _content_keys(files: List[Path]) -> List[Optional[Tuple]]:
+    """
+    Compute a key for each file such that two files share a key if and only if they have the same content.
+    Files that are the only one of their size (or head) get a cheap key, files that can't be read get None.
+    """
+    stats = []
+    by_size: Dict[int, List[int]] = {}
+    keys: List[Optional[Tuple]] = [None] * len(files)
+    for i, file in enumerate(files):
+        try:
+            stat = file.stat()
+        except OSError:
+            stats.append(None)
+            continue
+        if isinstance(file, ZipPath):
+            stats.append(None)
+            keys[i] = ('zip', stat.st_size, stat.crc)
+            continue
+        stats.append((file, stat.st_size, stat.st_mtime_ns))
+        by_size.setdefault(stat.st_size, []).append(i)
+
+    for size, indices in by_size.items():
+        if len(indices) == 1:
+            keys[indices[0]] = (size,)
+            continue
+        by_head: Dict[bytes, List[int]] = {}
+        for i in indices:
+            try:
+                by_head.setdefault(_partial_digest(stats[i]), []).append(i)
+            except OSError:
+                # unreadable (or gone since the stat), it keeps no key
+                continue
+        for head, head_indices in by_head.items():
+            if len(head_indices) == 1 or size <= PARTIAL_DIGEST_SIZE:
+                # either unique, or the head is the whole file
+                for i in head_indices:
+                    keys[i] = (size, head)
+            else:
+                for i in head_indices:
+                    try:
+                        keys[i] = (size, head, _full_digest(stats[i]))
+                    except OSError:
+                        continue
+    return keys
+
+
+def _partial_digest(stat_key: Tuple[Path, int, int]) -> bytes:
+    digest = _partial_digests.get(stat_key)
+    if digest is None:
+        with stat_key[0].open(mode='rb') as f:
+            digest = hashlib.blake2b(f.read(PARTIAL_DIGEST_SIZE)).digest()
+        _partial_digests[stat_key] = digest
+        if stat_key[1] <= PARTIAL_DIGEST_SIZE:
+            _full_digests[stat_key] = digest
+    return digest
+
+
+def _full_digest(stat_key: Tuple[Path, int, int]) -> bytes:
+    digest = _full_digests.get(stat_key)
+    if digest is None:
+        hasher = hashlib.blake2b()
+        with stat_key[0].open(mode='rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                hasher.update(block)
+        digest = hasher.digest()
+        _full_digests[stat_key] = digest
+    return digest
@@ -1,47 +1,195 @@
 import argparse
 import json
+import re
 
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
 
 
-def generate_replacement_template(source: Path, target: Path):
-    # read the input file
-    with open(source, "r") as f:
-        lines = f.readlines()
-    structure = defaultdict(list)
+_FENCE = re.compile(r' {0,3}(`{3,}|~{3,})')
+_ATX = re.compile(r' {0,3}#{1,6}(?:[ \t]|$)')
+_SETEXT = re.compile(r' {0,3}(?:=+|-+)[ \t]*$')
+
+
+def extract_headings(file: Path) -> List[str]:
+    """
+    Find the ATX (``# heading``) and setext (text underlined with ``===`` or ``---``) headings of a markdown page,
+    headings in fenced code blocks are skipped. A heading is returned as it appears in the page, with its line
+    endings and, for setext headings, the text and the underline
+    :param file: the page
+    :return: the headings, in page order
+    """
+    with open(file, "r") as f:
+        lines = f.read().splitlines(keepends=True)
+    headings = []
+    fence = None
+    paragraph = []
     for line in lines:
-        file, heading = line.split(".md:")
-        structure[f'{file}.md'].append((heading, heading))
-    with open(target, "w") as f:
-        json.dump(structure, f, indent=4)
+        stripped = line.lstrip(' ')
+        first = stripped[:1]
+        if fence:
+            # a fence is closed by a run of the same character at least as long as the opening one
+            closing = stripped.rstrip()
+            if closing.startswith(fence) and not closing.strip(fence[0]):
+                fence = None
+            continue
+        if first and first in '`~':
+            match = _FENCE.match(line)
+            if match and not (first == '`' and '`' in line[match.end():]):
+                fence = match.group(1)
+                paragraph = []
+                continue
+        if first == '#' and _ATX.match(line):
+            headings.append(line)
+            paragraph = []
+        elif first and first in '=-' and paragraph and _SETEXT.match(line):
+            headings.append(''.join(paragraph) + line)
+            paragraph = []
+        elif not line.strip() or (len(line) - len(stripped) >= 4 and not paragraph):
+            # blank lines end a paragraph, indented code can't start one
+            paragraph = []
+        else:
+            paragraph.append(line)
+    return headings
 
 
-def execute_replacement(source: Path, target: Path):
-    # read the input json file
+def _grep_structure(source: Path) -> Iterator[Tuple[str, List[List[str]]]]:
+    # the output of grep, file.md:heading lines
+    structure = defaultdict(list)
     with open(source, "r") as f:
-        structure = json.load(f)
-    for file, changes in structure.items():
-        target_file = target / file
-        if not target_file.exists():
-            print(f"Warning: {target_file} doesn't exist")
-            continue
-        # read the file
-        with open(target_file, "r") as f:
-            data = f.read()
-        try:
-            for change in changes:
-                old, new = change
-                if data.find(old) == -1:
-                    print(f"Warning: {old} not found in {file}. Content has changed, re-examine your change file")
-                else:
-                    data = data.replace(old, new)
-        except ValueError as e:
-            print(f"Error: {e} on file: {target_file}")
+        for line in f:
+            file, heading = line.split(".md:", 1)
+            structure[f'{file}.md'].append([heading, heading])
+    return iter(structure.items())
+
+
+def _page_headings(file: Path) -> List[List[str]]:
+    return [[heading, heading] for heading in extract_headings(file)]
+
+
+def _tree_structure(source: Path, jobs: int) -> Iterator[Tuple[str, List[List[str]]]]:
+    files = sorted(source.rglob('*.md'))
+    names = [file.relative_to(source).as_posix() for file in files]
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            yield from zip(names, executor.map(_page_headings, files, chunksize=max(1, len(files) // (jobs * 16))))
+    else:
+        yield from zip(names, map(_page_headings, files))
 
+
+def generate_replacement_template(source: Path, target: Path, jobs: int = 1):
+    """
+    Write a change file (see execute_replacement) with every heading mapped to itself, to be edited
+    :param source: the directory of the migrated pages, whose headings are extracted (see extract_headings), or the
+    output of a grep for the headings (file.md:heading lines)
+    :param target: the change file (json)
+    :param jobs: number of worker processes the pages are read in
+    """
+    structure = _tree_structure(source, jobs) if source.is_dir() else _grep_structure(source)
+    # the template is written as the pages are scanned, laid out like json.dump(..., indent=4)
+    with open(target, "w") as f:
+        separator = '{\n'
+        for file, headings in structure:
+            if headings:
+                f.write(f'{separator}    {json.dumps(file)}: ' + json.dumps(headings, indent=4).replace('\n', '\n    '))
+                separator = ',\n'
+        f.write('{}' if separator == '{\n' else '\n}')
+
+
+class Replacer:
+    """
+    Applies a set of (old, new) replacements to a text in a single pass, with one compiled alternation of the old
+    strings. The longest of the old strings matching at a position is replaced, and every replacement is made in
+    the original text: the new text of one replacement is never replaced again (so headings can be swapped).
+    """
+    def __init__(self, changes: List[Tuple[str, str]]):
+        """
+        :param changes: the (old, new) pairs, an old string that appears more than once is replaced by its first new
+        (the other changes of that old string are listed in conflicts)
+        :raises ValueError: if a change is not a pair
+        """
+        self.replacements: Dict[str, str] = {}
+        self.conflicts: List[Tuple[str, str]] = []
+        for change in changes:
+            old, new = change
+            if old not in self.replacements:
+                self.replacements[old] = new
+            elif self.replacements[old] != new:
+                self.conflicts.append((old, new))
+        olds = sorted((old for old in self.replacements if old), key=len, reverse=True)
+        self.pattern = re.compile('|'.join(map(re.escape, olds))) if olds else None
+
+    def __call__(self, data: str) -> Tuple[str, List[str]]:
+        """
+        :param data: the text
+        :return: the text with the replacements made, and the old strings that were not found (in change order)
+        """
+        found = set()
+
+        def replace(match) -> str:
+            found.add(match.group(0))
+            return self.replacements[match.group(0)]
+
+        if self.pattern:
+            data = self.pattern.sub(replace, data)
+        return data, [old for old in self.replacements if old not in found]
+
+
+def replace_in_file(target_file: Path, file: str, changes: List[Tuple[str, str]]) -> List[str]:
+    """
+    Apply the changes of a file, the file is only written if it changed
+    :param target_file: the file
+    :param file: the name of the file in the change file
+    :param changes: the (old, new) pairs
+    :return: the warnings
+    """
+    if not target_file.exists():
+        return [f"Warning: {target_file} doesn't exist"]
+    # read the file
+    with open(target_file, "r") as f:
+        data = f.read()
+    try:
+        replacer = Replacer(changes)
+    except ValueError as e:
+        return [f"Error: {e} on file: {target_file}"]
+    new, missing = replacer(data)
+    warnings = [f"Warning: {old} is changed more than once in {file}, ignoring the change to {new}. Only the first "
+                f"change of a heading is made" for old, new in replacer.conflicts]
+    warnings.extend(f"Warning: {old} not found in {file}. Content has changed, re-examine your change file"
+                    for old in missing)
+    if new != data:
         # write the file
         with open(target_file, "w") as f:
-            f.write(data)
+            f.write(new)
+    return warnings
+
+
+def execute_replacement(source: Path, target: Path, jobs: int = 1):
+    """
+    Apply the heading changes of a change file (see generate_replacement_template) to the files in the target
+    directory. All the changes of a file are made in a single pass over the file, see Replacer.
+    :param source: the change file (json), a list of (old, new) pairs for each file
+    :param target: the directory the files are in
+    :param jobs: number of worker processes the files are spread across, warnings are printed in file order
+    """
+    # read the input json file
+    with open(source, "r") as f:
+        structure = json.load(f)
+    files = list(structure)
+    target_files = [target / file for file in files]
+    changes = [structure[file] for file in files]
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for warnings in executor.map(replace_in_file, target_files, files, changes,
+                                         chunksize=max(1, len(files) // (jobs * 16))):
+                for warning in warnings:
+                    print(warning)
+    else:
+        for warnings in map(replace_in_file, target_files, files, changes):
+            for warning in warnings:
+                print(warning)
 
 
 def main():
@@ -51,19 +199,21 @@ def main():
     parser.add_argument("target", help="Target directory or File")
     # add an optional argument to specify the function to perform
     parser.add_argument("-f", "--function", help="Function to perform", choices=["generate", "execute"], default="generate")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to read or change the pages (default: 1)")
     args = parser.parse_args()
 
     source = Path(args.source).expanduser()
     target = Path(args.target).expanduser()
     if not source.exists():
-        print("Input heading change file doesn't exist")
+        print("Input directory or heading change file doesn't exist")
         return
 
     # based on the function argument, call the appropriate function
     if args.function == "generate":
-        generate_replacement_template(source, target)
+        generate_replacement_template(source, target, args.jobs)
     elif args.function == "execute":
-        execute_replacement(source, target)
+        execute_replacement(source, target, args.jobs)
 
 
 if __name__ == '__main__':
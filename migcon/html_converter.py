@@ -0,0 +1,299 @@
+import html
+import re
+
+from typing import Callable, Dict, List, Optional, Set, Union
+
+# Converts the html that _convert_remaining_html hands to markdownify, plain links and simple tables, without
+# BeautifulSoup. The conversion is a port of markdownify's (for the default options) restricted to the elements
+# below, and gives the same markdown. Anything else (other elements, comments, colspan/rowspan, badly nested or
+# unusual markup, ...) is declined, i.e. left to markdownify.
+
+# the markdownify versions (from, up to) the conversion gives the same markdown as. With any other version installed
+# everything is left to markdownify
+MARKDOWNIFY_VERSIONS = ((1, 1), (1, 3))
+
+VOID_ELEMENTS = {'br', 'col'}
+ELEMENTS = {'a', 'b', 'br', 'col', 'colgroup', 'em', 'i', 'p', 'span', 'strong', 'table', 'tbody', 'td', 'tfoot',
+            'th', 'thead', 'tr'}
+# markdownify removes the whitespace inside and around these
+_BLOCK_ELEMENTS = {'p', 'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr'}
+
+_TAG = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)((?:\s+[^\s"\'<>/=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'=<>`]+))?)*)'
+                  r'\s*(/?)>')
+_ATTRIBUTE = re.compile(r'\s+([^\s"\'<>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'=<>`]+)))?')
+# character references that the html parser and html.unescape agree on
+_CHARREF = re.compile(r'&(?!(?:amp|lt|gt|quot|apos|nbsp|#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6});)')
+
+_WHITESPACE = re.compile(r'[\t ]+')
+_NEWLINE_WHITESPACE = re.compile(r'[\t \r\n]*[\r\n][\t \r\n]*')
+_EXTRACT_NEWLINES = re.compile(r'^(\n*)((?:.*[^\n])?)(\n*)$', flags=re.DOTALL)
+
+
+def _markdownify_compatible() -> bool:
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:  # python 3.7
+        return False
+    try:
+        installed = tuple(int(number) for number in re.findall(r'\d+', version('markdownify'))[:2])
+    except PackageNotFoundError:
+        return False
+    return MARKDOWNIFY_VERSIONS[0] <= installed < MARKDOWNIFY_VERSIONS[1]
+
+
+MARKDOWNIFY_COMPATIBLE = _markdownify_compatible()
+
+
+class Element:
+    def __init__(self, name: str, attrs: Dict[str, str], parent: Optional['Element']):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.children: List[Union['Element', 'Text']] = []
+        self.index = 0
+
+    def previous_element(self) -> Optional['Element']:
+        """
+        The previous sibling that is an element (rather than text)
+        """
+        if self.parent:
+            for sibling in reversed(self.parent.children[:self.index]):
+                if isinstance(sibling, Element):
+                    return sibling
+        return None
+
+    def find_all(self, names: Set[str]) -> List['Element']:
+        found = []
+        for child in self.children:
+            if isinstance(child, Element):
+                if child.name in names:
+                    found.append(child)
+                found.extend(child.find_all(names))
+        return found
+
+
+class Text(str):
+    parent: Element
+    index: int
+
+
+def parse(fragment: str) -> Optional[Element]:
+    """
+    Parse a fragment of html into a tree of elements and text, the way BeautifulSoup's html.parser would
+    :return: the document (root) element, None if the fragment has anything the converter doesn't handle
+    """
+    if '\r' in fragment or '\0' in fragment:
+        return None
+    document = Element('[document]', {}, None)
+    current = document
+    position = 0
+    for match in _TAG.finditer(fragment):
+        if match.start() > position and not _add_text(current, fragment[position:match.start()]):
+            return None
+        position = match.end()
+        closing, name, attributes, self_closing = match.groups()
+        name = name.lower()
+        if name not in ELEMENTS:
+            return None
+        if closing:
+            if attributes or self_closing or current.name != name:
+                return None
+            current = current.parent
+            continue
+        if self_closing and name not in VOID_ELEMENTS:
+            return None
+        attrs = {}
+        for attribute in _ATTRIBUTE.finditer(attributes):
+            key = attribute.group(1).lower()
+            value = next((value for value in attribute.groups()[1:] if value is not None), '')
+            if key in attrs or _CHARREF.search(value):
+                return None
+            attrs[key] = html.unescape(value)
+        element = Element(name, attrs, current)
+        element.index = len(current.children)
+        current.children.append(element)
+        if name not in VOID_ELEMENTS:
+            current = element
+    if position < len(fragment) and not _add_text(current, fragment[position:]):
+        return None
+    if current is not document:
+        return None
+    return document
+
+
+def _add_text(parent: Element, data: str) -> bool:
+    if '<' in data or _CHARREF.search(data):
+        return False
+    text = Text(html.unescape(data))
+    text.parent = parent
+    text.index = len(parent.children)
+    parent.children.append(text)
+    return True
+
+
+def fast_markdownify(fragment: str) -> Optional[str]:
+    """
+    Convert plain links and simple tables to markdown, exactly like markdownify(fragment) does
+    :param fragment: html
+    :return: markdown, None if the fragment has to be converted by markdownify
+    """
+    if not MARKDOWNIFY_COMPATIBLE:
+        return None
+    document = parse(fragment)
+    if document is None or not _supported(document):
+        return None
+    return _process_element(document, set()).strip('\n')
+
+
+def _supported(element: Element) -> bool:
+    for child in element.children:
+        if isinstance(child, Element):
+            if 'colspan' in child.attrs or 'rowspan' in child.attrs:
+                return False
+            if child.name == 'table' and element.name != '[document]':
+                return False
+            if not _supported(child):
+                return False
+    return True
+
+
+def _remove_inside(element) -> bool:
+    return isinstance(element, Element) and element.name in _BLOCK_ELEMENTS
+
+
+def _sibling(node, offset: int):
+    index = node.index + offset
+    if 0 <= index < len(node.parent.children):
+        return node.parent.children[index]
+    return None
+
+
+def _process_element(element: Element, parent_tags: Set[str]) -> str:
+    remove_inside = _remove_inside(element)
+
+    def can_ignore(child) -> bool:
+        if isinstance(child, Element) or child.strip() != '':
+            return False
+        previous = _sibling(child, -1)
+        following = _sibling(child, 1)
+        if remove_inside and (previous is None or following is None):
+            return True
+        return _remove_inside(previous) or _remove_inside(following)
+
+    tags = set(parent_tags)
+    tags.add(element.name)
+    if element.name in ('td', 'th'):
+        tags.add('_inline')
+    strings = [_process_text(child, tags) if isinstance(child, Text) else _process_element(child, tags)
+               for child in element.children if not can_ignore(child)]
+
+    # collapse the newlines at the boundaries of the children
+    collapsed = ['']
+    for string in strings:
+        if not string:
+            continue
+        leading, content, trailing = _EXTRACT_NEWLINES.match(string).groups()
+        if collapsed[-1] and leading:
+            previous = collapsed.pop()
+            leading = '\n' * min(2, max(len(previous), len(leading)))
+        collapsed.extend([leading, content, trailing])
+    text = ''.join(collapsed)
+
+    convert = _CONVERTERS.get(element.name)
+    return convert(element, text, parent_tags) if convert else text
+
+
+def _process_text(text: Text, parent_tags: Set[str]) -> str:
+    value = _NEWLINE_WHITESPACE.sub('\n', text)
+    value = _WHITESPACE.sub(' ', value)
+    value = value.replace('*', r'\*').replace('_', r'\_')
+    previous = _sibling(text, -1)
+    following = _sibling(text, 1)
+    if _remove_inside(previous) or (_remove_inside(text.parent) and previous is None):
+        value = value.lstrip(' \t\r\n')
+    if _remove_inside(following) or (_remove_inside(text.parent) and following is None):
+        value = value.rstrip()
+    return value
+
+
+def _chomp(text: str):
+    prefix = ' ' if text and text[0] == ' ' else ''
+    suffix = ' ' if text and text[-1] == ' ' else ''
+    return prefix, suffix, text.strip()
+
+
+def _convert_a(element: Element, text: str, parent_tags: Set[str]) -> str:
+    prefix, suffix, text = _chomp(text)
+    if not text:
+        return ''
+    href = element.attrs.get('href')
+    title = element.attrs.get('title')
+    if text.replace(r'\_', '_') == href and not title:
+        return f'<{href}>'
+    title_part = ' "%s"' % title.replace('"', r'\"') if title else ''
+    return f'{prefix}[{text}]({href}{title_part}){suffix}' if href else text
+
+
+def _inline_conversion(markup: str) -> Callable[[Element, str, Set[str]], str]:
+    def convert(element: Element, text: str, parent_tags: Set[str]) -> str:
+        prefix, suffix, text = _chomp(text)
+        if not text:
+            return ''
+        return f'{prefix}{markup}{text}{markup}{suffix}'
+    return convert
+
+
+def _convert_br(element: Element, text: str, parent_tags: Set[str]) -> str:
+    if '_inline' in parent_tags:
+        return text + ' ' if text else ' '
+    return '  \n' + text
+
+
+def _convert_p(element: Element, text: str, parent_tags: Set[str]) -> str:
+    if '_inline' in parent_tags:
+        return ' ' + text.strip(' \t\r\n') + ' '
+    text = text.strip(' \t\r\n')
+    return f'\n\n{text}\n\n' if text else ''
+
+
+def _convert_table(element: Element, text: str, parent_tags: Set[str]) -> str:
+    return '\n\n' + text.strip() + '\n\n'
+
+
+def _convert_cell(element: Element, text: str, parent_tags: Set[str]) -> str:
+    return ' ' + text.strip().replace('\n', ' ') + ' |'
+
+
+def _convert_tr(element: Element, text: str, parent_tags: Set[str]) -> str:
+    cells = element.find_all({'td', 'th'})
+    parent = element.parent
+    is_first_row = element.previous_element() is None
+    is_headrow = all(cell.name == 'th' for cell in cells) or \
+        (parent.name == 'thead' and len(parent.find_all({'tr'})) == 1)
+    is_head_row_missing = (is_first_row and not parent.name == 'tbody') or \
+        (is_first_row and parent.name == 'tbody' and len(parent.parent.find_all({'thead'})) < 1)
+    overline = ''
+    underline = ''
+    if is_headrow and is_first_row:
+        underline += '| ' + ' | '.join(['---'] * len(cells)) + ' |' + '\n'
+    elif is_head_row_missing or \
+            (is_first_row and (parent.name == 'table' or
+                               (parent.name == 'tbody' and not parent.previous_element()))):
+        overline += '| ' + ' | '.join([''] * len(cells)) + ' |' + '\n'
+        overline += '| ' + ' | '.join(['---'] * len(cells)) + ' |' + '\n'
+    return overline + '|' + text + '\n' + underline
+
+
+_CONVERTERS = {
+    'a': _convert_a,
+    'b': _inline_conversion('**'),
+    'br': _convert_br,
+    'em': _inline_conversion('*'),
+    'i': _inline_conversion('*'),
+    'p': _convert_p,
+    'strong': _inline_conversion('**'),
+    'table': _convert_table,
+    'td': _convert_cell,
+    'th': _convert_cell,
+    'tr': _convert_tr,
+}
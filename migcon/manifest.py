@@ -0,0 +1,236 @@
+import hashlib
+import json
+import re
+
+from migcon import profiler
+from migcon.attachment_info import AttachmentInfo
+from migcon.content_manager import LinkRewriter, get_attachment_info, link_paths
+from migcon.content_tree import Tree, as_content_tree
+from pathlib import Path
+from typing import Dict, List, Set
+
+MANIFEST_FILE = '.migcon-manifest.json'
+
+# bump whenever a change to the page transforms (or to attachment handling) changes the generated output, this
+# forces the next incremental run to re-process every page
+TRANSFORM_VERSION = 3
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class Manifest:
+    """
+    Records, for every page migrated into a target, a fingerprint of everything that went into producing the page
+    (source page and attachment content hashes, the page's location in the hierarchy, where the pages it links to
+    live, the transform version and link mode) together with the outputs it produced. A later run into the same
+    target only needs to re-process the pages whose fingerprint changed.
+
+    To avoid re-hashing unchanged files, content hashes are cached by file size and modification time.
+    """
+    def __init__(self, target: Path, data: Dict = None):
+        self.target = target
+        data = data or {}
+        if data.get('transform_version') != TRANSFORM_VERSION:
+            data = {}
+        self.digests: Dict[str, List] = data.get('digests', {})
+        # the files hashed in this run, only their digests are saved (so those of deleted files are dropped)
+        self.used_digests: Set[str] = set()
+        self.pages: Dict[str, Dict] = data.get('pages', {})
+        self.fingerprints: Dict[str, str] = {}
+        self.page_ids: Dict[str, str] = {}
+        self.embedded_page_ids: Dict[str, Set[str]] = {}
+        # the outputs of previous runs that are no longer produced, see changed_pages
+        self.stale_outputs: List[str] = []
+
+    @classmethod
+    def load(cls, target: Path) -> 'Manifest':
+        manifest_file = target / MANIFEST_FILE
+        if manifest_file.is_file():
+            with manifest_file.open(mode='r') as input_file:
+                return cls(target, json.load(input_file))
+        return cls(target)
+
+    def save(self) -> None:
+        data = {
+            'transform_version': TRANSFORM_VERSION,
+            'digests': {key: value for key, value in self.digests.items() if key in self.used_digests},
+            'pages': self.pages,
+        }
+        with (self.target / MANIFEST_FILE).open(mode='w') as output_file:
+            json.dump(data, output_file, indent=1, sort_keys=True)
+
+    def digest(self, file: Path) -> str:
+        """
+        The content hash of a (source) file, re-using the recorded hash if the file is unchanged
+        :param file: the file to hash
+        :return: hex digest of the file content, or '' if the file doesn't exist
+        """
+        try:
+            stat = file.stat()
+        except OSError:
+            return ''
+        key = str(file)
+        self.used_digests.add(key)
+        cached = self.digests.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        hasher = hashlib.sha256()
+        with file.open(mode='rb') as input_file:
+            for block in iter(lambda: input_file.read(READ_BLOCK_SIZE), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+        self.digests[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def fingerprint(self, source: Path, dest: Path, afile: str, replacements: Dict[str, str], link_mode: str) -> str:
+        """
+        Fingerprint of all the inputs of a page
+        :param source: source directory
+        :param dest: the file of the page in the target
+        :param afile: the location of the page in the content tree
+        :param replacements: the link replacement dictionary of the content tree
+        :param link_mode: how files are materialized in the target
+        :return: hex digest
+        """
+        src = source / dest.name
+        hasher = hashlib.sha256()
+        hasher.update(f'{TRANSFORM_VERSION}\n{link_mode}\n{afile}\n{self.digest(src)}\n'.encode('utf-8'))
+        if src.is_file():
+            with src.open(mode='r') as input_file:
+                content = input_file.read()
+            # where the pages this page links to live in the hierarchy
+            rewriter = LinkRewriter(replacements)
+            for link in sorted(link_paths(content)):
+                resolved = rewriter.resolve(link)
+                if resolved:
+                    hasher.update(f'{link}:{resolved}\n'.encode('utf-8'))
+            attachment_info = get_attachment_info(src, src.stem)
+            if attachment_info:
+                self.page_ids[dest.name] = attachment_info.page_id
+                for attachment in attachment_info.attachments.values():
+                    for files in attachment.files.values():
+                        for file in files:
+                            hasher.update(f'{file}:{self.digest(source / file)}\n'.encode('utf-8'))
+            # the pages whose attachments this page embeds (attachments/<page id>/<attachment id>)
+            images = re.findall(r'<img\s*src="attachments/([^/"]+)/', content, re.IGNORECASE)
+            self.embedded_page_ids[dest.name] = set(images)
+        return hasher.hexdigest()
+
+    def changed_pages(self, source: Path, tree: Tree, replacements: Dict[str, str], link_mode: str,
+                      force: bool = False, remove_stale: bool = True) -> Set[Path]:
+        """
+        Determine the pages that have to be (re-)processed: pages whose fingerprint changed or whose outputs are
+        missing from the target. The outputs of these pages, as well as those of pages that no longer exist in
+        the source, are removed so the pages can be regenerated from scratch.
+        :param source: source directory
+        :param tree: content tree
+        :param replacements: the link replacement dictionary of the content tree
+        :param link_mode: how files are materialized in the target
+        :param force: treat every page as changed
+        :param remove_stale: if False, the outputs are left in place (they are only listed in stale_outputs)
+        :return: set of the target files of the pages to process
+        """
+        dests = {}
+        changed_names = set()
+        tree = as_content_tree(tree)
+        for dest, afile in zip(tree.dest_files(), tree.afiles):
+            dests[dest.name] = dest
+            with profiler.page(dest):
+                self.fingerprints[dest.name] = self.fingerprint(source, dest, afile, replacements, link_mode)
+        self._add_embedded_fingerprints()
+        for name in dests:
+            fingerprint = self.fingerprints[name]
+            recorded = self.pages.get(name)
+            if force or not recorded or recorded['fingerprint'] != fingerprint or \
+                    not all((self.target / output).exists() for output in recorded['outputs']):
+                changed_names.add(name)
+        self._add_colliding_pages(changed_names, dests)
+        changed = {dests[name] for name in changed_names}
+        kept_outputs = set()
+        for name in dests.keys() - changed_names:
+            kept_outputs.update(self.pages[name]['outputs'])
+        stale = set()
+        for name, recorded in list(self.pages.items()):
+            if name not in dests or name in changed_names:
+                stale.update(recorded['outputs'])
+                del self.pages[name]
+        self.stale_outputs = sorted(stale - kept_outputs)
+        if not remove_stale:
+            return changed
+        directories = set()
+        for output in self.stale_outputs:
+            output_file = self.target / output
+            if output_file.is_file() or output_file.is_symlink():
+                output_file.unlink()
+            directories.update(output_file.parents)
+        # directories left empty (e.g. of a page that moved), the directories still needed are re-created
+        for directory in sorted(directories, key=lambda path: len(path.parts), reverse=True):
+            if directory != self.target and self.target in directory.parents and directory.is_dir() and \
+                    not any(directory.iterdir()):
+                directory.rmdir()
+        return changed
+
+    def _add_embedded_fingerprints(self) -> None:
+        """
+        A page that embeds an attachment of another page refers to it by the destination the other page gives it,
+        so the fingerprint of the other page becomes part of the fingerprint of the page.
+        """
+        pages_by_id = {}
+        for name, page_id in self.page_ids.items():
+            pages_by_id.setdefault(page_id, name)
+        own_fingerprints = dict(self.fingerprints)
+        for name, page_ids in self.embedded_page_ids.items():
+            others = sorted({pages_by_id[page_id] for page_id in page_ids if page_id in pages_by_id} - {name})
+            if others:
+                hasher = hashlib.sha256(own_fingerprints[name].encode('utf-8'))
+                for other in others:
+                    hasher.update(f'{other}:{own_fingerprints[other]}\n'.encode('utf-8'))
+                self.fingerprints[name] = hasher.hexdigest()
+
+    def _add_colliding_pages(self, changed_names: Set[str], dests: Dict[str, Path]) -> None:
+        """
+        Outputs of different pages can collide (e.g. drawio files with the same name attached to sibling pages are
+        written to the directory of the pages), in which case the page processed last wins. To get the same
+        result as a full run, the unchanged pages that share an output, or have an output in the directory of a
+        changed page, are re-processed as well.
+        """
+        owners: Dict[str, Set[str]] = {}
+        by_dir: Dict[str, Set[str]] = {}
+        for name, recorded in self.pages.items():
+            if name not in dests:
+                continue
+            for output in recorded['outputs']:
+                owners.setdefault(output, set()).add(name)
+                if not output.endswith('.md'):
+                    by_dir.setdefault(str(Path(output).parent), set()).add(name)
+        pending = list(changed_names)
+        while pending:
+            name = pending.pop()
+            colliding = set(by_dir.get(str(dests[name].parent.relative_to(self.target)), ()))
+            for output in self.pages.get(name, {}).get('outputs', ()):
+                colliding.update(owners.get(output, ()))
+                colliding.update(by_dir.get(str(Path(output).parent), ()) if not output.endswith('.md') else ())
+            for other in colliding - changed_names:
+                changed_names.add(other)
+                pending.append(other)
+
+    def record(self, attachments: Dict[Path, AttachmentInfo], pages: Set[Path]) -> None:
+        """
+        Record the outputs of the processed pages
+        :param attachments: attachment information of the processed pages
+        :param pages: target files of the processed pages
+        """
+        for dest in pages:
+            outputs = {dest}
+            attachment_info = attachments.get(dest)
+            if attachment_info:
+                for attachment in attachment_info.attachments.values():
+                    if attachment.destination_file:
+                        outputs.add(attachment.destination_file)
+            page_dir = self.target / 'attachments' / dest.stem
+            if page_dir.is_dir():
+                outputs.update(file for file in page_dir.iterdir() if file.is_file())
+            self.pages[dest.name] = {
+                'fingerprint': self.fingerprints[dest.name],
+                'outputs': sorted(output.relative_to(self.target).as_posix() for output in outputs),
+            }
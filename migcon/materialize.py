@@ -0,0 +1,135 @@
+import errno
+import os
+import shutil
+import threading
+
+from migcon import output_sink, profiler
+from migcon.export_source import ZipPath
+from pathlib import Path
+from typing import Union
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+LINK_MODES = ('copy', 'hardlink', 'reflink', 'symlink')
+
+# ioctl to clone a file on copy-on-write file systems (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 1 << 30
+
+# errors that mean "this file system (or os) can't do that", anything else is a real error
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOTTY, errno.ENOSYS, errno.EOPNOTSUPP, errno.EMLINK}
+
+
+def materialize(source: Union[Path, ZipPath], target: Path, link_mode: str = 'copy') -> None:
+    """
+    Make the source file available at target, either by copying it or by linking to it. Any existing target
+    is replaced, so writing to target never writes through to a previously linked file.
+
+    - copy: a regular copy (shutil.copy)
+    - hardlink: a hard link, falls back to copy if source and target are on different file systems
+    - reflink: a copy-on-write clone, falls back to an in kernel copy (copy_file_range/sendfile) then copy
+    - symlink: a symbolic link to the (absolute) source
+
+    A member of a zipped export can't be linked to, it is streamed into place whatever the link mode. When an
+    output sink is active (see output_sink), the file is written to the sink instead.
+
+    :param source: the file to materialize
+    :param target: where the file should be materialized
+    :param link_mode: one of LINK_MODES
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode: {link_mode}")
+    sink = output_sink.active()
+    if sink is not None:
+        sink.add_file(target, source)
+        profiler.count('files_copied')
+        return
+    # materialize under a temporary name and move it into place, so that concurrent workers materializing the
+    # same file (e.g. shared images) don't trip over each other
+    temp_file = target.with_name(f'.{target.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        if isinstance(source, ZipPath):
+            source.copy_to(temp_file)
+        elif link_mode == 'copy':
+            shutil.copy(source, temp_file)
+        elif link_mode == 'hardlink':
+            try:
+                os.link(source, temp_file)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                shutil.copy(source, temp_file)
+        elif link_mode == 'reflink':
+            _reflink(source, temp_file)
+        else:
+            os.symlink(Path(source).resolve(), temp_file)
+        os.replace(temp_file, target)
+        profiler.count('files_copied')
+    finally:
+        if os.path.lexists(temp_file):
+            temp_file.unlink()
+
+
+def break_link(file: Path) -> None:
+    """
+    Make sure file is a file of its own (not a symbolic link or a hard link shared with the source) before it is
+    modified in place.
+    :param file: the file that is about to be modified
+    """
+    if file.is_symlink() or file.stat().st_nlink > 1:
+        temp_file = file.with_name(f'.{file.name}.tmp')
+        shutil.copyfile(file, temp_file)
+        shutil.copymode(file, temp_file)
+        os.replace(temp_file, file)
+
+
+def _reflink(source: Path, target: Path) -> None:
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        if not _clone(src.fileno(), dst.fileno()):
+            _kernel_copy(src, dst)
+    shutil.copymode(source, target)
+
+
+def _clone(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+        return False
+
+
+def _kernel_copy(src, dst) -> None:
+    """
+    Copy the content of src to dst without round tripping through user space where possible
+    """
+    size = os.fstat(src.fileno()).st_size
+    copied = 0
+    for name in ('copy_file_range', 'sendfile'):
+        function = getattr(os, name, None)
+        if function is None:
+            continue
+        try:
+            while copied < size:
+                if name == 'copy_file_range':
+                    count = function(src.fileno(), dst.fileno(), min(COPY_CHUNK_SIZE, size - copied))
+                else:
+                    count = function(dst.fileno(), src.fileno(), copied, min(COPY_CHUNK_SIZE, size - copied))
+                if count == 0:
+                    break
+                copied += count
+            if copied >= size:
+                return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+    # whatever is left, copy through user space
+    src.seek(copied)
+    dst.seek(copied)
+    shutil.copyfileobj(src, dst)
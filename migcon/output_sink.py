@@ -0,0 +1,277 @@
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from abc import ABC, abstractmethod
+from migcon.export_source import ZipPath
+from pathlib import Path
+from typing import List, Optional, Set, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed to write .tar.zst archives
+    zstandard = None
+
+# the archives a conversion can be written to, by suffix, and the tarfile mode (or gz, zstd, zip) they are written with
+ARCHIVE_SUFFIXES = {
+    '.tar': 'w|',
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'w|bz2',
+    '.tar.xz': 'w|xz',
+    '.tar.zst': 'zstd',
+    '.zip': 'zip',
+}
+# size of the blocks files are streamed into the archive in
+COPY_BUFFER_SIZE = 1024 * 1024
+# zip can't record earlier modification times
+ZIP_EPOCH = time.mktime((1980, 1, 1, 0, 0, 0, 0, 0, -1))
+# the modification time of generated files (1980-01-01 UTC), so converting the same export twice gives the same
+# archive. SOURCE_DATE_EPOCH overrides it (and clamps the times of copied files)
+DEFAULT_MTIME = 315532800
+
+# A sink receives the files of a conversion instead of the target directory, see ArchiveSink. The sink of this
+# process, None when the conversion writes to a directory. Code that writes to the target goes through make_dirs,
+# exists, remove and write_data (and materialize), which act on the target directory when there is no sink.
+_sink: Optional['Sink'] = None
+
+# a file for the sink, the content (in memory) or the file to read it from
+SinkEntry = Tuple[Path, Union[bytes, Path, ZipPath]]
+
+
+def active() -> Optional['Sink']:
+    return _sink
+
+
+def activate(sink: Optional['Sink']) -> None:
+    """
+    Make sink the sink of this process, None writes to the target directory again
+    """
+    global _sink
+    _sink = sink
+
+
+def archive_suffix(target: Path) -> Optional[str]:
+    """
+    :return: the suffix of the archive the target names (see ARCHIVE_SUFFIXES), None for a directory
+    """
+    name = target.name.lower()
+    return next((suffix for suffix in ARCHIVE_SUFFIXES if name.endswith(suffix)), None)
+
+
+def archive_root(archive: Path) -> Path:
+    """
+    The (never created) directory the paths of a conversion into the archive are under, named after the archive
+    """
+    return archive.with_name(archive.name[:-len(archive_suffix(archive))])
+
+
+def make_dirs(directory: Path) -> None:
+    """
+    Create a directory of the target (archives have no need for them)
+    """
+    if _sink is None:
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+def exists(file: Path) -> bool:
+    """
+    Whether a file of the target exists, or has been written to the sink
+    """
+    if _sink is None:
+        return file.exists()
+    return _sink.exists(file)
+
+
+def remove(file: Path) -> None:
+    """
+    Remove a file that a previous run left in the target (a sink starts out empty)
+    """
+    if _sink is None and file.exists():
+        file.unlink()
+
+
+def write_data(file: Path, data: bytes) -> None:
+    if _sink is None:
+        file.write_bytes(data)
+    else:
+        _sink.add_file(file, data)
+
+
+def source_date_epoch() -> Tuple[int, bool]:
+    """
+    :return: the modification time of generated files, and whether the times of copied files are clamped to it
+    (when SOURCE_DATE_EPOCH is set)
+    """
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        try:
+            return int(epoch), True
+        except ValueError:
+            print(f'Warning: ignoring SOURCE_DATE_EPOCH {epoch}, not an integer')
+    return DEFAULT_MTIME, False
+
+
+class Sink(ABC):
+    """
+    The files written to a sink, under the (virtual) target directory root. A file is only written once, the
+    files that are written again (e.g. an image shared by many pages) have the same content.
+
+    Use as a context manager, the sink is active (see activate) for the duration of the context.
+    """
+    # whether the content of generated files is needed, or only that they are written (see plan.PlanSink)
+    needs_content = True
+
+    def __init__(self, root: Path, written: Optional[Set[str]] = None):
+        self.root = root
+        self.written: Set[str] = set(written or ())
+        self.lock = threading.Lock()
+
+    def name(self, file: Path) -> str:
+        return file.relative_to(self.root).as_posix()
+
+    def exists(self, file: Path) -> bool:
+        return self.name(file) in self.written
+
+    def add_file(self, file: Path, content: Union[bytes, Path, ZipPath]) -> None:
+        """
+        Write file, with the content given or read from a (source) file
+        """
+        with self.lock:
+            name = self.name(file)
+            if name not in self.written:
+                self.written.add(name)
+                self._add(name, content)
+
+    def __enter__(self) -> 'Sink':
+        activate(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        activate(None)
+
+    def merge(self, entries: List[SinkEntry]) -> None:
+        """
+        Add the files a worker process collected (see CollectingSink.drain)
+        """
+        for file, content in entries:
+            self.add_file(file, content)
+
+    @abstractmethod
+    def _add(self, name: str, content: Union[bytes, Path, ZipPath]) -> None:
+        pass
+
+
+class CollectingSink(Sink):
+    """
+    The sink of a page pipeline worker process, collects what the pages write so it can be sent to the sink of
+    the main process with the results of each page (see drain and ArchiveSink.merge)
+    """
+    def __init__(self, root: Path, written: Optional[Set[str]] = None):
+        super().__init__(root, written)
+        self.entries: List[SinkEntry] = []
+
+    def _add(self, name: str, content: Union[bytes, Path, ZipPath]) -> None:
+        self.entries.append((self.root / name, content))
+
+    def drain(self) -> List[SinkEntry]:
+        entries = self.entries
+        self.entries = []
+        return entries
+
+
+class ArchiveSink(Sink):
+    """
+    Writes a conversion straight into a tar (optionally compressed) or zip archive, in a single streaming pass.
+    The archive is written under a temporary name and only moved into place once the conversion is done.
+    """
+    def __init__(self, archive: Path):
+        suffix = archive_suffix(archive)
+        if suffix is None:
+            raise ValueError(f'Not an archive: {archive}, supported are {", ".join(ARCHIVE_SUFFIXES)}')
+        mode = ARCHIVE_SUFFIXES[suffix]
+        if mode == 'zstd' and zstandard is None:
+            raise ValueError(f'Writing {suffix} archives requires the zstandard package')
+        super().__init__(archive_root(archive))
+        self.archive = archive
+        self.mode = mode
+        self.mtime, self.clamp = source_date_epoch()
+        self.temp_file = archive.with_name(f'.{archive.name}.tmp')
+        self.output_file = None
+        self.compressor = None
+        self.tar_file: Optional[tarfile.TarFile] = None
+        self.zip_file: Optional[zipfile.ZipFile] = None
+
+    def __enter__(self) -> 'ArchiveSink':
+        self.archive.parent.mkdir(parents=True, exist_ok=True)
+        self.output_file = open(self.temp_file, 'wb')
+        if self.mode == 'zip':
+            self.zip_file = zipfile.ZipFile(self.output_file, 'w', zipfile.ZIP_DEFLATED)
+        elif self.mode == 'zstd':
+            self.compressor = zstandard.ZstdCompressor().stream_writer(self.output_file, closefd=False)
+            self.tar_file = tarfile.open(fileobj=self.compressor, mode='w|')
+        elif self.mode == 'gz':
+            # (tarfile would stamp the gzip header with the current time)
+            self.compressor = gzip.GzipFile(filename='', mode='wb', fileobj=self.output_file, mtime=self.mtime)
+            self.tar_file = tarfile.open(fileobj=self.compressor, mode='w|')
+        else:
+            self.tar_file = tarfile.open(fileobj=self.output_file, mode=self.mode)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        super().__exit__(exc_type, exc_value, traceback)
+        try:
+            if self.zip_file:
+                self.zip_file.close()
+            if self.tar_file:
+                self.tar_file.close()
+            if self.compressor:
+                self.compressor.close()
+        finally:
+            self.output_file.close()
+            if exc_type is None:
+                os.replace(self.temp_file, self.archive)
+            else:
+                self.temp_file.unlink()
+
+    def _add(self, name: str, content: Union[bytes, Path, ZipPath]) -> None:
+        if isinstance(content, bytes):
+            size = len(content)
+            mtime = self.mtime
+        else:
+            stat = content.stat()
+            size = stat.st_size
+            mtime = stat.st_mtime_ns / 1e9
+            if self.clamp:
+                mtime = min(mtime, self.mtime)
+        if self.zip_file:
+            info = zipfile.ZipInfo(name, time.localtime(max(mtime, ZIP_EPOCH))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = size
+            info.external_attr = 0o644 << 16
+            with self.zip_file.open(info, mode='w') as output_file:
+                self._copy(content, output_file)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            if isinstance(content, bytes):
+                self.tar_file.addfile(info, io.BytesIO(content))
+            else:
+                with content.open(mode='rb') as input_file:
+                    self.tar_file.addfile(info, input_file)
+
+    @staticmethod
+    def _copy(content: Union[bytes, Path, ZipPath], output_file) -> None:
+        if isinstance(content, bytes):
+            output_file.write(content)
+        else:
+            with content.open(mode='rb') as input_file:
+                shutil.copyfileobj(input_file, output_file, COPY_BUFFER_SIZE)
+
@@ -0,0 +1,80 @@
+import json
+
+from migcon.attachment_info import AttachmentInfo
+from migcon.content_tree import Tree, as_content_tree
+from migcon.export_source import ZipPath
+from migcon.output_sink import Sink
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+
+class PlanSink(Sink):
+    """
+    Records what a conversion would write, without writing anything (see con2jb --plan). Generated files (pages,
+    the toc, embedded images) are recorded with their size, copied files with the file they are copied from.
+    Drawio diagrams are not rendered, they are recorded with the mxfile they would be rendered from.
+    """
+    needs_content = False
+
+    def __init__(self, root: Path):
+        super().__init__(root)
+        self.writes: List[Dict] = []
+
+    def _add(self, name: str, content: Union[bytes, Path, ZipPath]) -> None:
+        if isinstance(content, bytes):
+            self.writes.append({'file': name, 'bytes': len(content)})
+        else:
+            self.writes.append({'file': name, 'source': str(content)})
+
+
+def migration_plan(source: Union[Path, ZipPath], tree: Tree, replacements: Dict[str, str],
+                   attachments: Dict[Path, AttachmentInfo], links_rewritten: Dict[Path, int],
+                   pages: Optional[Set[Path]], sink: PlanSink, removed: List[str], warnings: List[str]) -> Dict:
+    """
+    The plan of a conversion, every file it writes (or removes) and every rewrite it makes, with paths relative
+    to the target
+    :param source: the source export
+    :param tree: the content tree
+    :param replacements: the link replacement dictionary of the content tree
+    :param attachments: the attachments of the pages (as returned by process_attachments)
+    :param links_rewritten: the number of links rewritten in each page (LinkRewriter.page_stats)
+    :param pages: the pages (target files) that are processed, None for all of them
+    :param sink: the sink that recorded the writes
+    :param removed: the outputs of a previous run that are removed
+    :param warnings: the warnings of the conversion
+    :return: the plan, as json serializable data
+    """
+    tree = as_content_tree(tree)
+    root = sink.root
+
+    def relative(file: Optional[Path]) -> Optional[str]:
+        return file.relative_to(root).as_posix() if file else None
+
+    return {
+        'source': str(source),
+        'target': str(root),
+        'directories': [relative(directory) for directory in tree.directories() if directory != root],
+        'pages': [{
+            'source': dest.name,
+            'target': relative(dest),
+            'processed': pages is None or dest in pages,
+            'links_rewritten': links_rewritten.get(dest, 0),
+        } for dest in tree.dest_files()],
+        'links': replacements,
+        'attachments': [{
+            'page': relative(page),
+            'name': name,
+            'files': [file for files in attachment.files.values() for file in files],
+            'destination': relative(attachment.destination_file),
+            'multiple_copies': attachment.multiple_copies_warning,
+        } for page, attachment_info in attachments.items() for name, attachment in attachment_info.attachments.items()],
+        'writes': sink.writes,
+        'removes': removed,
+        'warnings': warnings,
+    }
+
+
+def save_plan(plan: Dict, plan_file: Path) -> None:
+    with plan_file.open(mode='w') as output_file:
+        json.dump(plan, output_file, indent=1)
+        output_file.write('\n')
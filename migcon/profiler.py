@@ -0,0 +1,206 @@
+import cProfile
+import heapq
+import json
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# number of slowest pages reported for each stage
+SLOWEST_PAGES = 10
+# the counters recorded for each stage (see count)
+COUNTERS = ('pages', 'bytes_read', 'bytes_written', 'files_copied', 'substitutions')
+
+# the profiler of this process, None when profiling is off. Code that does work worth accounting for calls count
+# and page, which do (next to) nothing when profiling is off
+_profiler: Optional['Profiler'] = None
+_no_page = nullcontext()
+
+
+def count(counter: str, n: int = 1) -> None:
+    """
+    Add to a counter of the current stage, e.g. count('files_copied')
+    """
+    if _profiler is not None:
+        with _profiler.lock:
+            _profiler.counters[counter] += n
+
+
+def page(file: Path):
+    """
+    Context in which a page is processed, times the page and counts it as touched by the current stage
+    """
+    if _profiler is None:
+        return _no_page
+    return _profiler.page(file)
+
+
+def active() -> Optional['Profiler']:
+    return _profiler
+
+
+def activate(profiler: Optional['Profiler']) -> None:
+    """
+    Make profiler the profiler of this process, None turns profiling off
+    """
+    global _profiler
+    _profiler = profiler
+
+
+def _io_counters() -> Optional[Tuple[int, int]]:
+    """
+    Bytes read and written by this process so far (including from and to the page cache), None if the os doesn't
+    tell (only linux does)
+    """
+    try:
+        with open('/proc/self/io') as io_file:
+            values = dict(line.split(': ') for line in io_file.read().splitlines())
+        return int(values['rchar']), int(values['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss() -> Tuple[Optional[int], Optional[int]]:
+    """
+    Peak resident set size of this process and of its (terminated) child processes, in bytes
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in kilobytes, except on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, \
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+
+
+def _children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Profiler:
+    """
+    Records, for each stage of a conversion: wall and cpu time, the counters (pages touched, bytes read and
+    written, files copied, regex substitutions made) and the slowest pages, optionally along with a cProfile of
+    the stage. The peak memory is reported once, for the whole run. Pass stage to migcon.con2jb.convert.
+
+    Page pipeline workers run a profiler of their own, what they record is sent back with the results of each
+    page (see drain and merge).
+    """
+    def __init__(self, cprofile_prefix: Optional[Path] = None, slowest: int = SLOWEST_PAGES):
+        """
+        :param cprofile_prefix: if given, each stage is run under cProfile and its statistics are written to
+        <cprofile_prefix>-<stage>.prof
+        :param slowest: the number of slowest pages to report for each stage
+        """
+        self.cprofile_prefix = cprofile_prefix
+        self.slowest = slowest
+        self.counters = Counter()
+        # (seconds, page) of the slowest pages of the current stage, as a heap
+        self.page_times: List[Tuple[float, str]] = []
+        self.stages: List[Dict] = []
+        self.io = _io_counters()
+        # pages can be processed by several threads (see content_manager.process_attachments)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        self.counters = Counter()
+        self.page_times = []
+        io_start = _io_counters()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time() + _children_cpu()
+        profile = cProfile.Profile() if self.cprofile_prefix else None
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() + _children_cpu() - cpu_start
+            io_end = _io_counters()
+            if io_start and io_end:
+                self.counters['bytes_read'] += io_end[0] - io_start[0]
+                self.counters['bytes_written'] += io_end[1] - io_start[1]
+            stage = {
+                'name': name,
+                'wall_seconds': round(wall, 6),
+                'cpu_seconds': round(cpu, 6),
+            }
+            stage.update((counter, self.counters[counter]) for counter in COUNTERS)
+            stage['slowest_pages'] = [{'page': file, 'seconds': round(seconds, 6)}
+                                      for seconds, file in sorted(self.page_times, reverse=True)]
+            if profile:
+                profile_file = Path(f'{self.cprofile_prefix}-{name.replace(" ", "_")}.prof')
+                profile.dump_stats(profile_file)
+                stage['cprofile'] = str(profile_file)
+            self.stages.append(stage)
+
+    @contextmanager
+    def page(self, file: Path):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.counters['pages'] += 1
+                self._page_time(time.perf_counter() - start, str(file))
+
+    def _page_time(self, seconds: float, file: str) -> None:
+        if len(self.page_times) < self.slowest:
+            heapq.heappush(self.page_times, (seconds, file))
+        elif self.slowest:
+            heapq.heappushpop(self.page_times, (seconds, file))
+
+    def drain(self) -> Tuple[Dict[str, int], List[Tuple[float, str]]]:
+        """
+        What was recorded since the last drain (in a worker process), including the bytes read and written by
+        this process
+        :return: counters and page times, to be merged into the profiler of the main process
+        """
+        io = _io_counters()
+        if io and self.io:
+            self.counters['bytes_read'] += io[0] - self.io[0]
+            self.counters['bytes_written'] += io[1] - self.io[1]
+        self.io = io
+        recorded = dict(self.counters), self.page_times
+        self.counters = Counter()
+        self.page_times = []
+        return recorded
+
+    def merge(self, recorded: Tuple[Dict[str, int], List[Tuple[float, str]]]) -> None:
+        """
+        Add what a worker process recorded (see drain) to the current stage
+        """
+        counters, page_times = recorded
+        self.counters.update(counters)
+        for seconds, file in page_times:
+            self._page_time(seconds, file)
+
+    def report(self) -> Dict:
+        # the os only tells the peak over the lifetime of a process, so the peak memory is reported for the run
+        peak_rss, peak_worker_rss = _peak_rss()
+        return {
+            'total_wall_seconds': round(sum(stage['wall_seconds'] for stage in self.stages), 6),
+            'total_cpu_seconds': round(sum(stage['cpu_seconds'] for stage in self.stages), 6),
+            'peak_rss_bytes': peak_rss,
+            'peak_worker_rss_bytes': peak_worker_rss,
+            'stages': self.stages,
+        }
+
+    def save(self, report_file: Path) -> None:
+        with report_file.open(mode='w') as output_file:
+            json.dump(self.report(), output_file, indent=2)
+            output_file.write('\n')
@@ -1,27 +1,81 @@
+import filecmp
+import os
+import re
+
 from abc import ABC, abstractmethod
-from anytree import Node
-from anytree.exporter import DictExporter
+from migcon import output_sink
+from migcon.content_tree import Tree, as_content_tree
 from pathlib import Path
+from typing import Iterator
 from yaml import dump
 
 try:
-    from yaml import CLoader as Loader, CDumper as Dumper
+    from yaml import CDumper as Dumper
 except ImportError:
-    from yaml import Loader, Dumper
+    from yaml import Dumper
+
+# scalars that yaml writes without quotes, and reads back as the same string. Words that resolve to booleans or
+# null are excluded by _YAML_WORDS, anything else is quoted by yaml itself
+_PLAIN_SCALAR = re.compile(r'[A-Za-z][A-Za-z0-9_./-]*')
+_YAML_WORDS = {'y', 'n', 'yes', 'no', 'true', 'false', 'on', 'off', 'null'}
+# keep long scalars on one line
+_NO_WRAP = 2 ** 30
+
+
+def yaml_scalar(value: str) -> str:
+    """
+    Format a string as a yaml scalar, quoted (the way yaml would) if need be
+    :param value: the string
+    :return: the scalar, as it goes after the key of a mapping
+    """
+    if _PLAIN_SCALAR.fullmatch(value) and value.lower() not in _YAML_WORDS:
+        return value
+    return dump({'k': value}, Dumper=Dumper, width=_NO_WRAP)[len('k: '):-1]
+
+
+def jb_article_lines(doc_structure: Tree) -> Iterator[str]:
+    """
+    The lines of a jb-article _toc.yml for the content tree, in the format yaml would dump it in
+    :param doc_structure: the content tree
+    :return: iterator over the lines (with line endings)
+    """
+    tree = as_content_tree(doc_structure)
+    if not len(tree):
+        return
+    yield "format: jb-article\n"
+    yield f"root: {yaml_scalar(tree.afiles[0])}\n"
+    depths = tree.depths()
+    for index in range(1, len(tree)):
+        depth = depths[index]
+        indent = "  " * (depth - 1)
+        if depths[index - 1] < depth:
+            # first child, open the sections of the parent
+            yield f"{indent}sections:\n"
+        yield f"{indent}- file: {yaml_scalar(tree.afiles[index])}\n"
 
 
 class TOCGenerator(ABC):
     @abstractmethod
-    def generate(self, doc_structure: Node):
+    def generate(self, doc_structure: Tree):
         pass
 
 class JupyterBookTOCGenerator(TOCGenerator):
-    def generate(self, doc_structure: Node):
-        # this is a bit of a hack, we are using "afile" rather than "file" so it sorts before "children"
-        # I tried using an ordered dictionary, but it prints a bunch of extraneous stuff
-        dct = DictExporter(attriter=lambda attrs: [(k, v) for k, v in attrs if k == "afile"]).export(doc_structure)
-        toc = dump(dct).replace('children:', 'sections:').replace('afile:', 'file:').replace('file:', 'root:', 1)
-        # noinspection PyUnresolvedReferences
-        with open(Path(doc_structure.filepath, "_toc.yml"), "w") as toc_file:
-            toc_file.write("format: jb-article\n")
-            toc_file.write(toc)
+    def generate(self, doc_structure: Tree):
+        tree = as_content_tree(doc_structure)
+        toc_path = Path(tree.filepath, "_toc.yml")
+        sink = output_sink.active()
+        if sink is not None:
+            content = ''.join(jb_article_lines(tree)).encode('utf-8')
+            # a plan leaves out the toc that a real run would leave untouched
+            if not sink.needs_content and toc_path.is_file() and toc_path.read_bytes() == content:
+                return
+            output_sink.write_data(toc_path, content)
+            return
+        temp_path = toc_path.with_name(f'.{toc_path.name}.tmp')
+        with open(temp_path, "w") as toc_file:
+            toc_file.writelines(jb_article_lines(tree))
+        # leave an unchanged toc untouched (incremental runs)
+        if toc_path.is_file() and filecmp.cmp(temp_path, toc_path, shallow=False):
+            temp_path.unlink()
+            return
+        os.replace(temp_path, toc_path)
@@ -38,12 +38,15 @@ setup(name=package,
             'anytree>=2.8.0',
             'markdown_it_py>=1.1.0',
             'pyyaml>=6.0',
-            'markdwonify>=0.10.3',
+            'markdownify>=1.1.0',
       ],
       extras_require={
             'dev': [
                   'wheel>=0.29'
             ],
+            'zstd': [
+                  'zstandard>=0.15'
+            ],
       },
       entry_points = {
             'console_scripts': [
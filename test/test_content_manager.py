@@ -1,7 +1,9 @@
+from anytree import Node
 from markdown_it import MarkdownIt
+from pathlib import Path
 
 import migcon.attachment_info
-from migcon import content_manager
+from migcon import content_manager, content_tree
 
 
 def test_process_tokens():
@@ -196,6 +198,41 @@ Documentation.json](attachments/443510468/443510478.json)
     assert count == 10
 
 
+
+def test_scan_attachment_section():
+    section = """<div class="pageSectionHeader">
+
+## Attachments:
+
+</div>
+
+<div class="greybox" align="left">
+
+<img src="images/icons/bullet_blue.gif" width="8" height="8" /> [DRAFT
+DLP VPC Diagram.png](attachments/405902712/405902848.png) (image/png)  
+<img src="images/icons/bullet_blue.gif" width="8" height="8" />
+[vpc-architectures](attachments/405902712/405902847)
+(application/vnd.jgraph.mxfile)  
+<img src="images/icons/bullet_blue.gif" width="8" height="8" /> [DRAFT
+DLP VPC Diagram.png](attachments/405902712/405902917.png) (image/png)  
+
+</div>
+
+## Change History
+"""
+    expected = migcon.attachment_info.process_tokens(MarkdownIt("commonmark").parse(
+        section.replace(content_manager.REMOVE_STRING_B, '')), "test_file")
+    attachment_info = migcon.attachment_info.scan_attachment_section(section.encode('utf-8'), "test_file")
+    assert attachment_info == expected
+    assert attachment_info.page_id == "405902712"
+    assert attachment_info.attachments['DRAFT_DLP_VPC_Diagram.png'].files == {
+        '(image/png)': ['attachments/405902712/405902848.png', 'attachments/405902712/405902917.png']
+    }
+    # anything that isn't plain text is left to the markdown parser
+    section = section.replace('[vpc-architectures]', '[*vpc-architectures*]')
+    assert migcon.attachment_info.scan_attachment_section(section.encode('utf-8'), "test_file") is None
+
+
 def test_fixup_toc_macro():
     test_string = """
 <div class="toc-macro rbtoc1648571394609">
@@ -378,6 +415,24 @@ Bitbucket (proofpoint.com)</a></p></td>
     assert content.find('</div') == -1
 
 
+def test_div_fixup_nested():
+    test_string = "<div class=\"content-wrapper\">\n" + "<div>\n" * 5 + "text\n" + "</div>\n" * 5 + "</div>\n"
+    content = content_manager._fixup_divs(test_string)
+    assert content == "text\n\n"
+
+    # deep nesting, an unknown div and an unmatched close tag
+    depth = 5000
+    test_string = "<div class=\"other\">\n" + "<div>" * depth + "text" + "</div>" * depth + "</div>\n</div>"
+    content = content_manager._fixup_divs(test_string)
+    assert content == "<div class=\"other\">\ntext\n</div>\n</div>"
+
+    # whitespace is stripped across levels, from the content of divs nested inside the one unwrapped
+    test_string = " <div class=\"content-wrapper\">" + "<div id=\"expander-1\" class=\"expand-container\"> \n" * depth \
+        + "<div>\n \n</div>" + " text\n" + "</div>" * depth + "\n</div> end"
+    content = content_manager._fixup_divs(test_string)
+    assert content == " text\n end"
+
+
 def test_convert_html():
     test_string = """
 ## General
@@ -458,3 +513,109 @@ Bitbucket (proofpoint.com)</a></p></td>
 """
     content = content_manager._convert_remaining_html(test_string)
     assert content.find('href') == -1
+
+
+def test_run_page_pipeline(tmp_path):
+    root = Node("root")
+    root.filepath = tmp_path
+    child = Node("child", root)
+    child.filepath = tmp_path / "child"
+    (tmp_path / "root.md").write_text("[link](child)\n\n## Change History\n\nold stuff")
+    (tmp_path / "child.md").write_text("nothing to see")
+    calls = []
+
+    def record(file, content):
+        calls.append(file.name)
+        return content
+
+    transforms = [record, content_manager.LinkRewriter({"child": "child"}), content_manager.remove_trailing_section]
+    content_manager.run_page_pipeline(root, transforms)
+    assert calls == ["root.md", "child.md"]
+    assert (tmp_path / "root.md").read_text() == "[link](/child)\n\n"
+    assert (tmp_path / "child.md").read_text() == "nothing to see"
+
+
+def test_link_rewriter():
+    rewriter = content_manager.LinkRewriter({"Page_1": "A_2/Page_1"})
+    content = ("[a](Page_1) [b](Page_1.md#section) [c](Page_1?x=1#y) [d](Page_1 \"title\")\n"
+               "[e](Page_2) [f](https://example.com/Page_1) ![g](attachments/1/2.png)\n"
+               "[h](\nPage_1) [i](Page_1)")
+    assert rewriter(Path("page.md"), content) == (
+        "[a](/A_2/Page_1) [b](/A_2/Page_1.md#section) [c](/A_2/Page_1?x=1#y) [d](/A_2/Page_1 \"title\")\n"
+        "[e](Page_2) [f](https://example.com/Page_1) ![g](attachments/1/2.png)\n"
+        "[h](\nPage_1) [i](/A_2/Page_1)")
+    assert rewriter.page_stats == {Path("page.md"): 5}
+    assert content_manager.link_paths(content) == {"Page_1", "Page_1.md", "Page_2", "https://example.com/Page_1",
+                                                   "attachments/1/2.png"}
+
+
+def test_run_page_pipeline_parallel(tmp_path, capsys):
+    root = Node("root")
+    root.filepath = tmp_path
+    for i in range(8):
+        child = Node(f"child{i}", root)
+        child.filepath = tmp_path / f"child{i}"
+        (tmp_path / f"child{i}.md").write_text(f'[next](child{(i + 1) % 8})\n<img src="attachments/{i}.png" />')
+    (tmp_path / "root.md").write_text("[link](child0)")
+    attachments = {tmp_path / f"child{i}.md": migcon.attachment_info.AttachmentInfo(str(i), f"child{i}", {})
+                   for i in range(8)}
+    transforms = [
+        content_manager.LinkRewriter({f"child{i}": f"child{i}" for i in range(8)}),
+        content_manager.AttachmentReferenceFixup(attachments, tmp_path / "src", tmp_path),
+    ]
+    content_manager.run_page_pipeline(root, transforms, jobs=3)
+    warnings = capsys.readouterr().out.splitlines()
+    assert warnings == [f'Warning: Could not find attachment file attachments/{i}.png for page '
+                        f'{tmp_path / f"child{i}.md"}' for i in range(8)]
+    assert (tmp_path / "child7.md").read_text() == "[next](/child0)\n"
+    assert transforms[0].page_stats == {tmp_path / name: 1 for name in ["root.md"] + [f"child{i}.md" for i in range(8)]}
+
+
+def test_attachment_reference_fixup_other_page(tmp_path):
+    attachment = migcon.attachment_info.Attachment("diagram.png", {"(image/png)": ["attachments/1/11.png"]},
+                                                   tmp_path / "attachments" / "owner" / "diagram.png")
+    attachments = {
+        tmp_path / "owner.md": migcon.attachment_info.AttachmentInfo("1", "owner", {"diagram.png": attachment}),
+    }
+    fixup = content_manager.AttachmentReferenceFixup(attachments, tmp_path / "src", tmp_path)
+    assert fixup.attachment_index == {"attachments/1/11.png": (attachment, attachment.destination_file)}
+    content = fixup(tmp_path / "embedder.md", '<img src="attachments/1/11.png" height="250" />')
+    assert content == "![diagram.png](/attachments/owner/diagram.png)"
+
+
+def test_process_attachments_concurrent(tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    (source / "index.md").write_text("Available Pages:\n\n-   [Home](Home_1)\n\n    -   [A](A_2)\n\n    -   [B](B_3)\n")
+    (source / "Home_1.md").write_text("home")
+    for name, page_id in (("A_2", "2"), ("B_3", "3")):
+        attachment_dir = source / "attachments" / page_id
+        attachment_dir.mkdir(parents=True)
+        (attachment_dir / "21.png").write_bytes(f"first {name}".encode())
+        (attachment_dir / "22.png").write_bytes(f"second {name}".encode())
+        (attachment_dir / "23.png").write_bytes(f"first {name}".encode())
+        (attachment_dir / "24").write_text(f'<mxfile><diagram id="d"><mxGraphModel page="{name}"/></diagram></mxfile>')
+        entries = [("pic.png", "21.png", "image/png"), ("pic.png", "22.png", "image/png"),
+                   ("pic.png", "23.png", "image/png"), ("diagram", "24", "application/vnd.jgraph.mxfile"),
+                   ("gone.txt", "25.txt", "text/plain")]
+        section = "".join(f"[{entry}](attachments/{page_id}/{file})\n({kind})\n\n" for entry, file, kind in entries)
+        (source / f"{name}.md").write_text(f"text\n\n{migcon.attachment_info.SECTION_HEADER.decode()}\n\n{section}")
+
+    results = []
+    for io_workers in (1, 4):
+        target = tmp_path / f"target{io_workers}"
+        tree = content_tree.build_content_tree(source, target)
+        content_manager.copy_into_dir_tree(source, tree)
+        attachments = content_manager.process_attachments(source, tree, io_workers=io_workers)
+        results.append(({page: {name: attachment.destination_file.relative_to(target)
+                                for name, attachment in info.attachments.items() if attachment.destination_file}
+                         for page, info in attachments.items() if page.stem != "Home_1"},
+                        sorted(str(file.relative_to(target)) for file in target.rglob("*") if file.is_file())))
+    assert results[0][1] == results[1][1]
+    assert [list(pages.values()) for pages in (results[0][0], results[1][0])] == [[
+        {"pic.png": Path("attachments/A_2/pic_1.png"), "diagram": Path("diagram.drawio.xml")},
+        {"pic.png": Path("attachments/B_3/pic_1.png"), "diagram": Path("diagram.drawio.xml")},
+    ]] * 2
+    assert (tmp_path / "target4" / "attachments" / "B_3" / "pic.png").read_text() == "first B_3"
+    # both pages write the same diagram, the last page wins
+    assert 'page="B_3"' in (tmp_path / "target4" / "diagram.drawio.xml").read_text()
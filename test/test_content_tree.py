@@ -0,0 +1,47 @@
+import pickle
+
+from anytree import PreOrderIter
+from migcon.content_manager import get_dest_file_from_node
+from migcon.content_tree import ContentTree, build_content_tree, generate_replacement_dictionary
+
+
+def test_build_content_tree(tmp_path):
+    (tmp_path / 'index.md').write_text("# Space\n\nAvailable Pages:\n\n"
+                                       "-   [Home](Home_1)\n\n"
+                                       "    -   [A](A_2)\n\n"
+                                       "        -   [B](B_3)\n\n"
+                                       "            -   [C](C_4)\n\n"
+                                       "        -   [D](D_5)\n"
+                                       "    -   [E](E_6)\n")
+    target = tmp_path / 'target'
+    tree = build_content_tree(tmp_path, target)
+    assert tree.names == ['Home_1', 'A_2', 'B_3', 'C_4', 'D_5', 'E_6']
+    assert list(tree.parents) == [-1, 0, 1, 2, 1, 0]
+    assert tree.dest_files() == [target / 'Home_1.md', target / 'A_2.md', target / 'A_2' / 'B_3.md',
+                                 target / 'A_2' / 'B_3' / 'C_4.md', target / 'A_2' / 'D_5.md', target / 'E_6.md']
+    assert tree.directories() == [target, target / 'A_2', target / 'A_2' / 'B_3']
+    assert tree.depths() == [0, 1, 2, 3, 2, 1]
+
+    root = tree.to_node()
+    assert [(node.name, node.parent.name if node.parent else None) for node in PreOrderIter(root)] == [
+        ('Home_1', None), ('A_2', 'Home_1'), ('B_3', 'A_2'), ('C_4', 'B_3'), ('D_5', 'A_2'), ('E_6', 'Home_1')
+    ]
+    assert root.filepath == target
+    assert root.children[0].children[1].filepath == target / 'A_2' / 'D_5'
+    assert [get_dest_file_from_node(node) for node in PreOrderIter(root)] == tree.dest_files()
+    copy = pickle.loads(pickle.dumps(ContentTree.from_node(root)))
+    assert (copy.names, copy.parents, copy.afiles) == (tree.names, tree.parents, tree.afiles)
+    assert generate_replacement_dictionary(tree) == {
+        'A_2': 'A_2', 'B_3': 'A_2/B_3', 'C_4': 'A_2/B_3/C_4', 'D_5': 'A_2/D_5', 'E_6': 'E_6'
+    }
+
+
+def test_build_content_tree_bracketed_titles(tmp_path):
+    (tmp_path / 'index.md').write_text("Available Pages:\n\n"
+                                       "-   [Home](Home_1)\n\n"
+                                       "    -   [\\[Draft\\] Plan](Plan_2)\n\n"
+                                       "        -   [Child [old] \\]](Child_3)\n\n"
+                                       "        -   [Other](Other_4)\n")
+    tree = build_content_tree(tmp_path, tmp_path / 'target')
+    assert tree.names == ['Home_1', 'Plan_2', 'Child_3', 'Other_4']
+    assert list(tree.parents) == [-1, 0, 1, 1]
@@ -0,0 +1,125 @@
+import base64
+import pytest
+import zlib
+
+from migcon import content_manager, drawio_handler, drawio_stream
+from migcon.attachment_info import Attachment, AttachmentInfo
+from migcon.content_cache import ContentCache
+from pathlib import Path
+from urllib.parse import quote
+from xml.dom import minidom
+
+
+def test_handle_attachment(tmp_path):
+    source = tmp_path / 'source'
+    target = tmp_path / 'target'
+    (source / 'attachments' / '1').mkdir(parents=True)
+    (source / 'attachments' / '1' / '11.png').write_bytes(b'first')
+    (source / 'attachments' / '1' / '12.png').write_bytes(b'second')
+    attachment_info = AttachmentInfo('1', 'page', {
+        'diagram.png': Attachment('diagram.png', {'(image/png)': ['attachments/1/11.png', 'attachments/1/12.png']}),
+        'missing.png': Attachment('missing.png', {'(image/png)': ['attachments/1/13.png']}),
+    })
+    png_index = drawio_handler.png_digest_index(attachment_info, source)
+    assert len(png_index) == 2
+
+    def embedded(content):
+        return 'data:image/png;base64,' + base64.b64encode(content).decode('ascii')
+
+    assert drawio_handler.handle_attachment(embedded(b'second'), attachment_info, source, target, png_index) == \
+        ('diagram.png', 'attachments/1/12.png')
+    assert drawio_handler.handle_attachment(embedded(b'new'), attachment_info, source, target) == \
+        ('auto_generated_0.png', 'attachments/page/auto_generated_0.png')
+    assert (target / 'attachments' / 'page' / 'auto_generated_0.png').read_bytes() == b'new'
+    assert list((target / 'attachments').iterdir()) == [target / 'attachments' / 'page']
+
+
+
+def test_copy_drawio_file_cache(tmp_path, monkeypatch):
+    xml = '<mxGraphModel><root><mxCell id="0"/></root></mxGraphModel>'
+    compress = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    data = base64.b64encode(compress.compress(quote(xml).encode('utf-8')) + compress.flush()).decode('ascii')
+    source = tmp_path / 'diagram'
+    source.write_text(f'<mxfile><diagram id="1" name="Page-1">{data}</diagram></mxfile>')
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(drawio_handler, '_cache', ContentCache(directory=cache_dir))
+    target = drawio_handler.copy_drawio_file(source, tmp_path / 'first')
+    assert target == tmp_path / 'first.drawio.xml'
+    expected = minidom.parseString(xml).toprettyxml(indent="   ")
+    assert target.read_text() == expected
+    assert drawio_handler.render_diagram(data) == expected
+    assert len(list(cache_dir.iterdir())) == 1
+    # a later run re-uses the persisted entry, without decoding the diagram again
+    monkeypatch.setattr(drawio_handler, '_cache', ContentCache(directory=cache_dir))
+    monkeypatch.setattr(drawio_stream.base64, 'b64decode', None)
+    assert drawio_handler.copy_drawio_file(source, tmp_path / 'second').read_text() == expected
+
+    # page worker processes use the same cache
+    monkeypatch.setattr(drawio_handler, '_cache', ContentCache(max_size=10))
+    content_manager._init_page_worker([], drawio_cache=(cache_dir, 100))
+    assert drawio_handler.cache_settings() == (cache_dir, 100)
+    assert drawio_handler.copy_drawio_file(source, tmp_path / 'third').read_text() == expected
+
+
+def test_content_cache_bounded():
+    cache = ContentCache(max_size=10)
+    cache.put('a', '12345')
+    cache.put('b', '12345')
+    assert cache.get('a') == '12345'
+    cache.put('c', '12345')
+    assert cache.get('b') is None
+    assert cache.get('a') == cache.get('c') == '12345'
+    cache.put('d', '12345678901')
+    assert cache.get('d') is None
+
+
+def test_content_cache_directory_bounded(tmp_path):
+    cache = ContentCache(max_size=10, directory=tmp_path)
+    cache.put('a', '12345')
+    cache.put('b', '12345')
+    # a later run sees the persisted entries, and keeps the directory within max_size, least recently used first out
+    cache = ContentCache(max_size=10, directory=tmp_path)
+    assert cache.get('a') == '12345'
+    cache.put('c', '12345')
+    assert sorted(file.name for file in tmp_path.iterdir()) == ['a', 'c']
+    cache.put('d', '12345678901')
+    assert sorted(file.name for file in tmp_path.iterdir()) == ['a', 'c']
+
+
+@pytest.mark.parametrize("spool_size", [1, drawio_stream.SPOOL_SIZE])
+def test_copy_drawio_file_pages(tmp_path, monkeypatch, spool_size):
+    monkeypatch.setattr(drawio_stream, 'READ_BLOCK_SIZE', 7)
+    # (the first page is spooled to disk until the second one starts)
+    monkeypatch.setattr(drawio_stream, 'SPOOL_SIZE', spool_size)
+    xml = '<mxGraphModel dx="1"><root><mxCell id="0" value="a &amp; b"/><mxCell id="1">text</mxCell></root>' \
+          '</mxGraphModel>'
+    compress = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    data = base64.b64encode(compress.compress(quote(xml).encode('utf-8')) + compress.flush()).decode('ascii')
+    source = tmp_path / 'diagram'
+    source.write_text(f'<mxfile host="x">\n  <diagram id="1" name="compressed">{data}</diagram>\n'
+                      f'  <diagram id="2" name="plain">\n    {xml}\n  </diagram>\n</mxfile>')
+    monkeypatch.setattr(drawio_handler, '_cache', ContentCache())
+    target = drawio_handler.copy_drawio_file(source, tmp_path / 'pages')
+    model = minidom.parseString(xml).documentElement.toprettyxml(indent="   ")
+    page = ''.join(f'      {line}\n' for line in model.splitlines())
+    assert target.read_text() == '<?xml version="1.0" ?>\n<mxfile host="x">\n' \
+        f'   <diagram id="1" name="compressed">\n{page}   </diagram>\n' \
+        f'   <diagram id="2" name="plain">\n{page}   </diagram>\n</mxfile>\n'
+
+
+def test_copy_drawio_file_single_read(tmp_path, monkeypatch):
+    source = tmp_path / 'diagram'
+    source.write_text('<mxfile><diagram id="1"><mxGraphModel/></diagram></mxfile>')
+    monkeypatch.setattr(drawio_handler, '_cache', ContentCache())
+    reads = []
+    open_file = Path.open
+
+    def counting_open(self, *args, **kwargs):
+        if self == source:
+            reads.append(self)
+        return open_file(self, *args, **kwargs)
+    monkeypatch.setattr(Path, 'open', counting_open)
+    target = drawio_handler.copy_drawio_file(source, tmp_path / 'single')
+    assert target.read_text() == '<?xml version="1.0" ?>\n<mxGraphModel/>\n'
+    # the file is read once, for both the digest and the rendering
+    assert reads == [source]
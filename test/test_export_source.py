@@ -0,0 +1,65 @@
+import zipfile
+
+from migcon import file_dups
+from migcon.con2jb import convert
+from migcon.export_source import ZipPath, open_export
+from migcon.manifest import MANIFEST_FILE
+from pathlib import Path
+
+
+def write_export(source: Path) -> None:
+    source.mkdir()
+    (source / "index.md").write_text("Available Pages:\n\n-   [Home](Home_1)\n\n    -   [A](A_2)\n")
+    (source / "Home_1.md").write_text("# Home\n\nSee [A](A_2.md)\n")
+    attachment_dir = source / "attachments" / "2"
+    attachment_dir.mkdir(parents=True)
+    (attachment_dir / "21.png").write_bytes(b"first")
+    (attachment_dir / "22.png").write_bytes(b"second")
+    (attachment_dir / "23.png").write_bytes(b"first")
+    section = "".join(f"[pic.png](attachments/2/{file})\n(image/png)\n\n" for file in ("21.png", "22.png", "23.png"))
+    (source / "A_2.md").write_text(f'# A\n\n<img src="attachments/2/22.png" />\n\n'
+                                   f'<div class="pageSectionHeader">\n\n## Attachments:\n\n</div>\n\n{section}')
+
+
+def zip_export(source: Path, archive: Path, prefix: str = '') -> None:
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        for file in sorted(source.rglob('*')):
+            if file.is_file():
+                zip_file.write(file, prefix + file.relative_to(source).as_posix())
+
+
+def test_zip_path(tmp_path):
+    write_export(tmp_path / "src")
+    zip_export(tmp_path / "src", tmp_path / "export.zip", "space/")
+    root = open_export(tmp_path / "export.zip")
+    assert root == ZipPath(tmp_path / "export.zip", "space")
+    assert open_export(tmp_path / "src") == tmp_path / "src"
+
+    page_dir = root / "attachments" / "2"
+    assert page_dir.is_dir() and not page_dir.is_file()
+    assert [file.name for file in page_dir.glob('*.png')] == ["21.png", "22.png", "23.png"]
+    assert (page_dir / "21.png").read_bytes() == b"first"
+    assert (page_dir / "21.png").parent == page_dir
+    assert (root / "Home_1.md").stem == "Home_1"
+    assert not (root / "missing.md").exists()
+
+    files = [page_dir / "21.png", page_dir / "22.png", page_dir / "23.png", page_dir / "missing.png"]
+    duplicates = file_dups.find_duplicates(files)
+    assert duplicates == {files[0]: [files[2]], files[1]: [], files[3]: []}
+
+
+def test_convert_zip(tmp_path):
+    write_export(tmp_path / "src")
+    zip_export(tmp_path / "src", tmp_path / "export.zip")
+    (tmp_path / "from_dir").mkdir()
+    (tmp_path / "from_zip").mkdir()
+    convert(tmp_path / "src", tmp_path / "from_dir")
+    convert(tmp_path / "export.zip", tmp_path / "from_zip", link_mode='symlink')
+    files = sorted(file.relative_to(tmp_path / "from_dir") for file in (tmp_path / "from_dir").rglob('*')
+                   if file.is_file() and file.name != MANIFEST_FILE)
+    assert Path("attachments/A_2/pic_1.png") in files
+    for file in files:
+        assert not (tmp_path / "from_zip" / file).is_symlink()
+        assert (tmp_path / "from_zip" / file).read_bytes() == (tmp_path / "from_dir" / file).read_bytes()
+    # nothing changed, nothing is processed again
+    assert convert(tmp_path / "export.zip", tmp_path / "from_zip", link_mode='symlink') == set()
@@ -0,0 +1,53 @@
+import os
+
+from migcon import file_dups
+from pathlib import Path
+
+
+def test_find_duplicates(tmp_path):
+    contents = [b'a' * 10, b'b' * 10, b'a' * 10, b'c', b'b' * 10, b'a' * 10]
+    files = []
+    for i, content in enumerate(contents):
+        file = tmp_path / f'{i}.bin'
+        file.write_bytes(content)
+        files.append(file)
+    missing = tmp_path / 'missing.bin'
+    duplicates = file_dups.find_duplicates(files + [missing])
+    assert list(duplicates.keys()) == [files[0], files[1], files[3], missing]
+    assert duplicates[files[0]] == [files[2], files[5]]
+    assert duplicates[files[1]] == [files[4]]
+    assert duplicates[files[3]] == []
+    assert duplicates[missing] == []
+
+
+def test_find_duplicates_large_files(tmp_path):
+    head = b'x' * file_dups.PARTIAL_DIGEST_SIZE
+    a = tmp_path / 'a.bin'
+    b = tmp_path / 'b.bin'
+    c = tmp_path / 'c.bin'
+    a.write_bytes(head + b'1')
+    b.write_bytes(head + b'2')
+    c.write_bytes(head + b'1')
+    assert file_dups.find_duplicates([a, b, c]) == {a: [c], b: []}
+    assert file_dups.file_digest(a) == file_dups.file_digest(c) != file_dups.file_digest(b)
+
+
+def test_find_duplicates_unreadable(tmp_path, monkeypatch):
+    head = b'x' * file_dups.PARTIAL_DIGEST_SIZE
+    files = [tmp_path / f'{i}.bin' for i in range(5)]
+    for file, content in zip(files, [b'a', b'a', b'a', head + b'1', head + b'1']):
+        file.write_bytes(content)
+    unreadable = {files[1], files[4]}
+    for file in unreadable:
+        file.chmod(0)
+    if os.access(files[1], os.R_OK):
+        # (running as root) opening the files fails as it would for anyone else
+        open_file = Path.open
+
+        def failing_open(self, *args, **kwargs):
+            if self in unreadable:
+                raise PermissionError(13, 'Permission denied', str(self))
+            return open_file(self, *args, **kwargs)
+        monkeypatch.setattr(Path, 'open', failing_open)
+    # unreadable files are distinct from every other file, the scan goes on
+    assert file_dups.find_duplicates(files) == {files[0]: [files[2]], files[1]: [], files[3]: [], files[4]: []}
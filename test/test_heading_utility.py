@@ -0,0 +1,73 @@
+import json
+import pytest
+
+from migcon.heading_utility import Replacer, execute_replacement, extract_headings, generate_replacement_template
+
+
+def test_replacer():
+    new, missing = Replacer([("# A\n", "# B\n"), ("# B\n", "# A\n"), ("## Missing\n", "## Gone\n"),
+                             ("# Apple", "# Pear")])("# A\ntext\n# B\n# Apple\n# A\n")
+    # headings are swapped, the longer heading wins over its prefix
+    assert new == "# B\ntext\n# A\n# Pear\n# B\n"
+    assert missing == ["## Missing\n"]
+    assert Replacer([])("text") == ("text", [])
+    with pytest.raises(ValueError):
+        Replacer([("old", "new", "extra")])
+
+
+def test_execute_replacement_duplicates(tmp_path, capsys):
+    (tmp_path / "a.md").write_text("# One\n\n# One\n")
+    changes = {"a.md": [["# One\n", "# Uno\n"], ["# One\n", "# Uno\n"], ["# One\n", "# Eins\n"]]}
+    (tmp_path / "changes.json").write_text(json.dumps(changes))
+    execute_replacement(tmp_path / "changes.json", tmp_path)
+    assert (tmp_path / "a.md").read_text() == "# Uno\n\n# Uno\n"
+    # a repeated change is fine, a conflicting one is reported
+    assert capsys.readouterr().out == ("Warning: # One\n is changed more than once in a.md, ignoring the change to "
+                                       "# Eins\n. Only the first change of a heading is made\n")
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_execute_replacement(tmp_path, capsys, jobs):
+    (tmp_path / "a.md").write_text("# One\n\n## Two\n")
+    (tmp_path / "b.md").write_text("# Three\n")
+    changes = {
+        "a.md": [["# One\n", "# Uno\n"], ["## Two\n", "## Two\n"]],
+        "b.md": [["# Four\n", "# Cuatro\n"]],
+        "c.md": [["# Five\n", "# Cinco\n"]],
+    }
+    (tmp_path / "changes.json").write_text(json.dumps(changes))
+    modified = (tmp_path / "b.md").stat().st_mtime_ns
+    execute_replacement(tmp_path / "changes.json", tmp_path, jobs)
+    assert (tmp_path / "a.md").read_text() == "# Uno\n\n## Two\n"
+    assert (tmp_path / "b.md").read_text() == "# Three\n"
+    # unchanged files are not written
+    assert (tmp_path / "b.md").stat().st_mtime_ns == modified
+    assert capsys.readouterr().out == ("Warning: # Four\n not found in b.md. Content has changed, "
+                                       f"re-examine your change file\nWarning: {tmp_path / 'c.md'} doesn't exist\n")
+
+
+def test_extract_headings(tmp_path):
+    (tmp_path / "page.md").write_text("# Title\n\n```python\n# comment\n```\n## A .md: heading\nSome\ntext\n---\n\n---\n"
+                                      "####### no\n#no\n~~~~\n## code\n~~~\n## code\n~~~~\n    # code\nSetext\n===\n")
+    assert extract_headings(tmp_path / "page.md") == ["# Title\n", "## A .md: heading\n", "Some\ntext\n---\n",
+                                                      "Setext\n===\n"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_generate_replacement_template(tmp_path, jobs):
+    (tmp_path / "book" / "sub").mkdir(parents=True)
+    (tmp_path / "book" / "sub" / "b.md").write_text("# B\n\ntext\n")
+    (tmp_path / "book" / "a.md").write_text("# A\n## A.md: x\n")
+    (tmp_path / "book" / "c.md").write_text("no headings\n")
+    generate_replacement_template(tmp_path / "book", tmp_path / "changes.json", jobs)
+    expected = {"a.md": [["# A\n", "# A\n"], ["## A.md: x\n", "## A.md: x\n"]], "sub/b.md": [["# B\n", "# B\n"]]}
+    assert (tmp_path / "changes.json").read_text() == json.dumps(expected, indent=4)
+
+    # the output of grep is still accepted
+    (tmp_path / "grep.txt").write_text("a.md:# A\na.md:## A.md: x\nsub/b.md:# B\n")
+    generate_replacement_template(tmp_path / "grep.txt", tmp_path / "grep.json")
+    assert json.loads((tmp_path / "grep.json").read_text()) == expected
+
+    (tmp_path / "empty").mkdir()
+    generate_replacement_template(tmp_path / "empty", tmp_path / "empty.json", jobs)
+    assert json.loads((tmp_path / "empty.json").read_text()) == {}
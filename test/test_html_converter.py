@@ -0,0 +1,34 @@
+from markdownify import markdownify as md
+from migcon import html_converter
+from migcon.html_converter import fast_markdownify
+
+
+def test_fast_markdownify():
+    fragments = [
+        '<a href="https://example.com/a_b" rel="nofollow">Browse A / b_c - Stash\nBitbucket (example.com)</a>',
+        '<a\nhref="https://example.com">https://example.com</a>',
+        '<a href="x" title="say &quot;hi&quot;"> <strong>bold</strong> text </a>',
+        '<table class="wrapped confluenceTable">\n<colgroup>\n<col style="width: 50%" />\n</colgroup>\n<tbody>\n'
+        '<tr class="odd">\n<th class="confluenceTh"><p>Product</p>\n\n```{dropdown} Examples\n<p>PPS, TAP</p>\n```\n'
+        '<p><br />\n</p>\n</th>\n<td class="confluenceTd">Multiple *Products*</td>\n</tr>\n<tr class="even">\n'
+        '<th class="confluenceTh"><p>Source (name of git\nrepository)</p></th>\n'
+        '<td class="confluenceTd"><p>[Browse](https://example.com/a_b)</p>\n<p>&lt;none&gt;</p></td>\n</tr>\n'
+        '</tbody>\n</table>',
+        '<table><thead><tr><th>A</th><th>B</th></tr></thead><tbody><tr><td>1</td><td><em>2</em></td></tr>'
+        '</tbody></table>',
+    ]
+    for fragment in fragments:
+        assert fast_markdownify(fragment) == md(fragment)
+
+    # anything else is left to markdownify
+    assert fast_markdownify('<table><tr><td colspan="2">x</td></tr></table>') is None
+    assert fast_markdownify('<table><tr><td><ul><li>x</li></ul></td></tr></table>') is None
+    assert fast_markdownify('<a href="x"><img src="y" /></a>') is None
+    assert fast_markdownify('<table><tr><td>x<!-- comment --></td></tr></table>') is None
+
+
+def test_fast_markdownify_other_version(monkeypatch):
+    assert html_converter.MARKDOWNIFY_COMPATIBLE
+    # with a markdownify version the conversion isn't known to match, everything is left to markdownify
+    monkeypatch.setattr(html_converter, 'MARKDOWNIFY_COMPATIBLE', False)
+    assert fast_markdownify('<a href="x">y</a>') is None
@@ -0,0 +1,56 @@
+import json
+
+from migcon.content_manager import get_dest_file_from_node
+from migcon.content_tree import build_content_tree, generate_replacement_dictionary
+from migcon.manifest import MANIFEST_FILE, Manifest
+from pathlib import Path
+
+
+def _export(source):
+    source.mkdir()
+    (source / 'index.md').write_text("Available Pages:\n\n-   [Root](Root_1)\n\n    -   [A](A_2)\n\n    -   [B](B_3)\n")
+    (source / 'Root_1.md').write_text('root')
+    (source / 'A_2.md').write_text('links to [B](B_3)')
+    (source / 'B_3.md').write_text('b')
+
+
+def _changed(source, target, force=False):
+    tree = build_content_tree(source, target)
+    replacements = generate_replacement_dictionary(tree)
+    manifest = Manifest.load(target)
+    pages = manifest.changed_pages(source, tree, replacements, 'copy', force)
+    for page in pages:
+        page.parent.mkdir(parents=True, exist_ok=True)
+        page.write_text('output')
+    manifest.record({}, pages)
+    manifest.save()
+    return sorted(page.name for page in pages)
+
+
+def test_manifest(tmp_path):
+    source = tmp_path / 'source'
+    target = tmp_path / 'target'
+    target.mkdir()
+    _export(source)
+    assert _changed(source, target) == ['A_2.md', 'B_3.md', 'Root_1.md']
+    assert _changed(source, target) == []
+    assert _changed(source, target, force=True) == ['A_2.md', 'B_3.md', 'Root_1.md']
+
+    (source / 'B_3.md').write_text('new content for b')
+    assert _changed(source, target) == ['B_3.md']
+
+    # moving B under A changes B's location, and the link from A to B
+    (source / 'index.md').write_text("Available Pages:\n\n-   [Root](Root_1)\n\n    -   [A](A_2)\n\n"
+                                     "        -   [B](B_3)\n")
+    assert _changed(source, target) == ['A_2.md', 'B_3.md']
+    assert not (target / 'B_3.md').exists()
+    tree = build_content_tree(source, target)
+    assert get_dest_file_from_node(tree.to_node().children[0].children[0]) == target / 'A_2' / 'B_3.md'
+    assert tree.dest_file(2) == target / 'A_2' / 'B_3.md'
+
+    # the digests of the files that are gone are dropped
+    (source / 'index.md').write_text("Available Pages:\n\n-   [Root](Root_1)\n\n    -   [A](A_2)\n")
+    (source / 'B_3.md').unlink()
+    assert _changed(source, target) == ['A_2.md']
+    digests = json.loads((target / MANIFEST_FILE).read_text())['digests']
+    assert sorted(Path(key).name for key in digests) == ['A_2.md', 'Root_1.md']
@@ -0,0 +1,25 @@
+import pytest
+
+from migcon import materialize
+
+
+@pytest.mark.parametrize("link_mode", materialize.LINK_MODES)
+def test_materialize(tmp_path, link_mode):
+    source = tmp_path / 'source.md'
+    source.write_text('original')
+    target = tmp_path / 'target.md'
+    target.write_text('stale')
+    materialize.materialize(source, target, link_mode)
+    assert target.read_text() == 'original'
+
+    materialize.break_link(target)
+    target.write_text('modified')
+    assert source.read_text() == 'original'
+    assert not target.is_symlink()
+
+
+def test_materialize_unknown_mode(tmp_path):
+    source = tmp_path / 'source.md'
+    source.write_text('original')
+    with pytest.raises(ValueError):
+        materialize.materialize(source, tmp_path / 'target.md', 'teleport')
@@ -0,0 +1,71 @@
+import pytest
+import tarfile
+import zipfile
+
+from migcon import output_sink
+from migcon.con2jb import convert
+from migcon.manifest import MANIFEST_FILE
+from pathlib import Path
+
+
+def write_export(source: Path) -> None:
+    source.mkdir()
+    (source / "index.md").write_text("Available Pages:\n\n-   [Home](Home_1)\n\n    -   [A](A_2)\n\n"
+                                     "    -   [B](B_3)\n")
+    (source / "Home_1.md").write_text('# Home\n\nSee [A](A_2.md)\n\n<img src="images/icons/home.png" />\n')
+    (source / "images" / "icons").mkdir(parents=True)
+    (source / "images" / "icons" / "home.png").write_bytes(b"icon")
+    for name, page_id in (("A_2", "2"), ("B_3", "3")):
+        attachment_dir = source / "attachments" / page_id
+        attachment_dir.mkdir(parents=True)
+        (attachment_dir / "21.png").write_bytes(f"first {name}".encode())
+        (attachment_dir / "22.png").write_bytes(f"first {name}".encode())
+        (attachment_dir / "23").write_text('<mxfile><diagram id="d"><mxGraphModel/></diagram></mxfile>')
+        entries = [("pic.png", "21.png", "image/png"), ("pic.png", "22.png", "image/png"),
+                   (f"diagram {name}", "23", "application/vnd.jgraph.mxfile")]
+        section = "".join(f"[{entry}](attachments/{page_id}/{file})\n({kind})\n\n" for entry, file, kind in entries)
+        (source / f"{name}.md").write_text(f'# {name}\n\n<img src="images/icons/home.png" />\n\n'
+                                           f'<div class="pageSectionHeader">\n\n## Attachments:\n\n</div>\n\n'
+                                           f'{section}')
+
+
+def archive_contents(archive: Path):
+    if archive.suffix == '.zip':
+        with zipfile.ZipFile(archive) as zip_file:
+            return {name: zip_file.read(name) for name in zip_file.namelist()}
+    with tarfile.open(archive) as tar_file:
+        return {member.name: tar_file.extractfile(member).read() for member in tar_file.getmembers()}
+
+
+@pytest.mark.parametrize("archive,jobs", [("book.zip", 1), ("book.tar.gz", 2), ("book.tar", 1)])
+def test_convert_to_archive(tmp_path, archive, jobs):
+    write_export(tmp_path / "src")
+    (tmp_path / "book").mkdir()
+    convert(tmp_path / "src", tmp_path / "book")
+    expected = {file.relative_to(tmp_path / "book").as_posix(): file.read_bytes()
+                for file in (tmp_path / "book").rglob('*') if file.is_file() and file.name != MANIFEST_FILE}
+    assert "attachments/A_2/pic.png" in expected and "diagram_A_2.drawio.xml" in expected
+
+    (tmp_path / "book").rename(tmp_path / "directory")
+    pages = convert(tmp_path / "src", tmp_path / archive, jobs)
+    assert archive_contents(tmp_path / archive) == expected
+    assert pages == {tmp_path / "book" / "Home_1.md", tmp_path / "book" / "A_2.md", tmp_path / "book" / "B_3.md"}
+    # nothing but the archive is written
+    assert sorted(file.name for file in tmp_path.iterdir()) == sorted([archive, "directory", "src"])
+    assert output_sink.active() is None
+
+    # converting the same export again gives the same archive
+    convert(tmp_path / "src", tmp_path / "again" / archive, jobs)
+    assert (tmp_path / "again" / archive).read_bytes() == (tmp_path / archive).read_bytes()
+
+
+def test_archive_sink_failure(tmp_path):
+    with pytest.raises(RuntimeError):
+        with output_sink.ArchiveSink(tmp_path / "book.zip") as sink:
+            output_sink.write_data(sink.root / "page.md", b"page")
+            assert output_sink.exists(sink.root / "page.md")
+            raise RuntimeError()
+    assert list(tmp_path.iterdir()) == []
+    assert output_sink.active() is None
+    with pytest.raises(ValueError):
+        output_sink.ArchiveSink(tmp_path / "book.rar")
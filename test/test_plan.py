@@ -0,0 +1,61 @@
+import json
+
+from migcon.con2jb import convert
+from migcon.manifest import MANIFEST_FILE
+from pathlib import Path
+
+
+def write_export(source: Path) -> None:
+    source.mkdir()
+    (source / "index.md").write_text("Available Pages:\n\n-   [Home](Home_1)\n\n    -   [A](A_2)\n")
+    (source / "Home_1.md").write_text('# Home\n\nSee [A](A_2.md) and [A again](A_2)\n\n<img src="missing.png" />\n')
+    attachment_dir = source / "attachments" / "2"
+    attachment_dir.mkdir(parents=True)
+    (attachment_dir / "21.png").write_bytes(b"first")
+    (attachment_dir / "22.png").write_bytes(b"second")
+    (attachment_dir / "23.png").write_bytes(b"first")
+    (attachment_dir / "24").write_text('<mxfile><diagram id="d"><mxGraphModel/></diagram></mxfile>')
+    entries = [("pic.png", "21.png", "image/png"), ("pic.png", "22.png", "image/png"),
+               ("pic.png", "23.png", "image/png"), ("diagram", "24", "application/vnd.jgraph.mxfile")]
+    section = "".join(f"[{entry}](attachments/2/{file})\n({kind})\n\n" for entry, file, kind in entries)
+    (source / "A_2.md").write_text(f'# A\n\n<div class="pageSectionHeader">\n\n## Attachments:\n\n</div>\n\n'
+                                   f'{section}')
+
+
+def test_plan(tmp_path, capsys):
+    write_export(tmp_path / "src")
+    convert(tmp_path / "src", tmp_path / "planned", plan=tmp_path / "plan.json")
+    assert not (tmp_path / "planned").exists()
+    plan = json.loads((tmp_path / "plan.json").read_text())
+    assert plan["warnings"] == [f"Warning: Could not find attachment file missing.png for page "
+                                f"{tmp_path / 'planned' / 'Home_1.md'}"]
+    assert capsys.readouterr().out.splitlines() == plan["warnings"]
+    assert plan["pages"] == [
+        {"source": "Home_1.md", "target": "Home_1.md", "processed": True, "links_rewritten": 2},
+        {"source": "A_2.md", "target": "A_2.md", "processed": True, "links_rewritten": 0},
+    ]
+    assert [(attachment["name"], attachment["destination"], attachment["multiple_copies"])
+            for attachment in plan["attachments"]] == [("pic.png", "attachments/A_2/pic_1.png", True),
+                                                        ("diagram", "diagram.drawio.xml", False)]
+    assert {"file": "attachments/A_2/pic_1.png", "source": str(tmp_path / "src" / "attachments" / "2" / "22.png")} \
+        in plan["writes"]
+
+    # the plan has every file a conversion writes, generated files with their size
+    (tmp_path / "book").mkdir()
+    convert(tmp_path / "src", tmp_path / "book")
+    written = {file.relative_to(tmp_path / "book").as_posix(): file.stat().st_size
+               for file in (tmp_path / "book").rglob('*') if file.is_file() and file.name != MANIFEST_FILE}
+    assert {write["file"] for write in plan["writes"]} == written.keys()
+    for write in plan["writes"]:
+        if "bytes" in write:
+            assert write["bytes"] == written[write["file"]]
+
+    # a plan into the target of a previous conversion only has the changed pages
+    (tmp_path / "src" / "A_2.md").write_text("# A\n")
+    convert(tmp_path / "src", tmp_path / "book", plan=tmp_path / "plan.json")
+    plan = json.loads((tmp_path / "plan.json").read_text())
+    assert [page["processed"] for page in plan["pages"]] == [False, True]
+    assert plan["removes"] == ["A_2.md", "attachments/A_2/pic.png", "attachments/A_2/pic_1.png", "diagram.drawio.xml"]
+    # (the toc is unchanged, a real run leaves it untouched)
+    assert plan["writes"] == [{"file": "A_2.md", "bytes": 4}]
+    assert (tmp_path / "book" / "diagram.drawio.xml").is_file()
@@ -0,0 +1,38 @@
+from anytree import Node
+from migcon import content_manager, profiler
+
+
+def test_profile_page_pipeline(tmp_path):
+    root = Node("root")
+    root.filepath = tmp_path
+    for i in range(4):
+        child = Node(f"child{i}", root)
+        child.filepath = tmp_path / f"child{i}"
+        (tmp_path / f"child{i}.md").write_text(f"[next](child{(i + 1) % 4}) [root](root)")
+    (tmp_path / "root.md").write_text("[link](child0)")
+    replacements = {f"child{i}": f"child{i}" for i in range(4)}
+
+    stage_profiler = profiler.Profiler(slowest=3)
+    profiler.activate(stage_profiler)
+    try:
+        with stage_profiler.stage('serial'):
+            content_manager.run_page_pipeline(root, [content_manager.LinkRewriter(replacements)])
+        with stage_profiler.stage('parallel'):
+            content_manager.run_page_pipeline(root, [content_manager.LinkRewriter({"root": "root"})], jobs=2)
+    finally:
+        profiler.activate(None)
+
+    report = stage_profiler.report()
+    serial, parallel = report['stages']
+    assert (serial['name'], serial['pages'], serial['substitutions']) == ('serial', 5, 5)
+    assert (parallel['name'], parallel['pages'], parallel['substitutions']) == ('parallel', 5, 4)
+    assert len(serial['slowest_pages']) == len(parallel['slowest_pages']) == 3
+    assert serial['wall_seconds'] > 0 and serial['cpu_seconds'] > 0
+    # the peak memory is that of the run, not of a stage
+    assert report['peak_rss_bytes'] > 0 and 'peak_rss_bytes' not in serial
+
+    # nothing is recorded when profiling is off
+    counters = dict(stage_profiler.counters)
+    with profiler.page(tmp_path / "root.md"):
+        profiler.count('pages')
+    assert stage_profiler.counters == counters
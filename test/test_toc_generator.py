@@ -0,0 +1,31 @@
+import yaml
+
+from migcon.content_tree import ContentTree
+from migcon.toc_generator import JupyterBookTOCGenerator, jb_article_lines
+
+
+def test_jb_article_lines(tmp_path):
+    tree = ContentTree(tmp_path)
+    home = tree.add('Home_1')
+    a = tree.add('A_2', home)
+    tree.add('B_3', a)
+    tree.add('afile: children: yes', home)
+    tree.add('No', home)
+    toc = ''.join(jb_article_lines(tree))
+    assert toc.startswith("format: jb-article\n"
+                          "root: Home_1\n"
+                          "sections:\n"
+                          "- file: A_2\n"
+                          "  sections:\n"
+                          "  - file: A_2/B_3\n")
+    assert yaml.safe_load(toc) == {
+        'format': 'jb-article',
+        'root': 'Home_1',
+        'sections': [{'file': 'A_2', 'sections': [{'file': 'A_2/B_3'}]},
+                     {'file': 'afile: children: yes'},
+                     {'file': 'No'}]
+    }
+
+    JupyterBookTOCGenerator().generate(tree)
+    assert (tmp_path / '_toc.yml').read_text() == toc
+    assert [file.name for file in tmp_path.iterdir()] == ['_toc.yml']